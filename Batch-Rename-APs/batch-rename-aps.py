@@ -14,60 +14,94 @@ The format of the MAC address part of this CSV file has to be the following:
 import argparse
 import time
 import json
+import os
+import sys
 import requests
 import csv
-from pprint import pprint
+from concurrent.futures import ThreadPoolExecutor
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from mist_journal import Journal  # noqa: E402
+from mist_metrics import add_metrics_arguments, install_metrics  # noqa: E402
 
-def is_ap_in_site(configs: dict, ap_mac: str):
+
+def create_session(configs: dict, workers: int) -> requests.Session:
+    """
+    This function creates the HTTP session used for every API call of the run
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - workers: Number of concurrent rename requests (size of the connection pool)
+
+    Returns:
+        - A requests.Session carrying the authorization headers
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Content-Type': 'application/json',
+                            'Authorization': 'Token {}'.format(configs['api']['token'])})
+    return session
+
+
+def get_site_aps(configs: dict, session: requests.Session) -> dict:
     """
-    This function check if an AP is already assigned to a site
+    This function retreives all devices of the site once and indexes them by MAC address
 
     Parameters:
         - configs: Dictionary containing all configurations information
-        - site_id: ID of the site we would like to assign the AP to
+        - session: HTTP session used for the API call
 
     Returns:
-        - the ID of the AP if the AP is assign to the site
-        - the current name of the AP
+        - A dictionary {mac: (device_id, device_name)} of the devices assigned to the site,
+          None if the device list could not be retreived
     """
     api_url = f"{configs['api']['mist_url']}sites/{configs['site']['id']}/devices"
-    headers = {'Content-Type': 'application/json',
-               'Authorization': 'Token {}'.format(configs['api']['token'])}
-    response = requests.get(api_url, headers=headers)
+    response = session.get(api_url)
 
-    if response.status_code == 200:
-        devices = json.loads(response.content.decode('utf-8'))
-        for device in devices:
-            if device['mac'] == ap_mac:
-                return (device['id'], device['name'])
-    else:
-        print('Something went wrong: {}'.format(response.status_code))
-    return (None, None)
+    if response.status_code != 200:
+        print('Something went wrong: {0} - devices of site {1} not retreived'.format(response.status_code,
+                                                                                      configs['site']['id']))
+        return None
+    site_aps = {}
+    devices = json.loads(response.content.decode('utf-8'))
+    for device in devices:
+        site_aps[device['mac'].lower()] = (device['id'], device['name'])
+    return site_aps
 
 
-def rename_ap(configs: dict, ap_id: str, new_ap_name: str, ap_old_name: str):
+def rename_ap(configs: dict, session: requests.Session, ap_id: str, new_ap_name: str, ap_old_name: str) -> dict:
     """
     This function renames an AP
 
     Parameters:
         - configs: Dictionary containing all configurations information
+        - session: HTTP session used for the API call
         - ap_id: ID of the AP device object
         - new_ap_name: Name to apply to the AP
         - ap_old_name: Current Name of the AP
+
+    Returns:
+        - A dictionary describing the result of the rename (status, message, latency)
     """
     api_url = f"{configs['api']['mist_url']}sites/{configs['site']['id']}/devices/{ap_id}"
-    headers = {'Content-Type': 'application/json',
-               'Authorization': 'Token {}'.format(configs['api']['token'])}
     body = {}
     body['name'] = new_ap_name
-    response = requests.put(api_url, headers=headers, data=json.dumps(body))
+    start_time = time.time()
+    try:
+        response = session.put(api_url, data=json.dumps(body))
+    except requests.exceptions.RequestException as e:
+        return {'status': 'error', 'message': f"AP ID: {ap_id}\tSomething went wrong: {e}",
+                'latency': time.time() - start_time}
+    latency = time.time() - start_time
 
     if response.status_code == 200:
         device = json.loads(response.content.decode('utf-8'))
-        print(f"{device['mac']} renamed from {ap_old_name} to {device['name']}")
-    else:
-        print(f"AP ID: {ap_id}\tSomething went wrong: {response.status_code}")
+        return {'status': 'renamed', 'message': f"{device['mac']} renamed from {ap_old_name} to {device['name']}",
+                'latency': latency}
+    return {'status': 'error', 'message': f"AP ID: {ap_id}\tSomething went wrong: {response.status_code}",
+            'latency': latency}
 
 
 def retreive_ap_mac_list(csv_filename: str) -> dict:
@@ -87,25 +121,121 @@ def retreive_ap_mac_list(csv_filename: str) -> dict:
     return ap_list
 
 
+def rename_aps(configs: dict, ap_mac_list: list, workers: int, journal: Journal = None) -> list:
+    """
+    This function renames all the APs of the CSV file
+
+    The device list of the site is downloaded once, then the rename calls are sent
+    concurrently through a pool of 'workers' threads.
+    Rows already completed according to the journal are skipped, and no API call is made
+    at all when every row has been completed.
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - ap_mac_list: List of the CSV rows (mac, name)
+        - workers: Maximum number of rename calls in flight
+        - journal: Journal recording the rows renamed successfully (Default = None)
+
+    Returns:
+        - A list of results (one per CSV row, in the CSV order), None if the device list of
+          the site could not be retreived (nothing is renamed then)
+    """
+    results = [None] * len(ap_mac_list)
+    pending_rows = []
+    for row, ap in enumerate(ap_mac_list):
+        if journal and journal.is_done(ap):
+            results[row] = {'status': 'skipped', 'latency': 0, 'message': "Already renamed (journal)"}
+        else:
+            pending_rows.append(row)
+    if not pending_rows:
+        return results
+
+    def rename_and_record(ap: dict, ap_id: str, ap_old_name: str) -> dict:
+        result = rename_ap(configs, session, ap_id, ap['name'].strip(), ap_old_name)
+        if journal and result['status'] == 'renamed':
+            journal.record(ap, {'id': ap_id})
+        return result
+
+    session = create_session(configs, workers)
+    site_aps = get_site_aps(configs, session)
+    if site_aps is None:
+        session.close()
+        return None
+
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for row in pending_rows:
+            ap = ap_mac_list[row]
+            ap_id, ap_old_name = site_aps.get(ap['mac'].strip().lower(), (None, None))
+            if ap_id:
+                futures[row] = executor.submit(rename_and_record, ap, ap_id, ap_old_name)
+            else:
+                results[row] = {'status': 'not found', 'latency': 0,
+                                'message': f"AP {ap['name'].strip()} is not part of site {configs['site']['id']}"}
+        for row, future in futures.items():
+            results[row] = future.result()
+
+    session.close()
+    return results
+
+
+def print_summary(ap_mac_list: list, results: list, run_time: float):
+    """
+    This function prints the result of each CSV row followed by the throughput of the run
+
+    Parameters:
+        - ap_mac_list: List of the CSV rows (mac, name)
+        - results: List of results returned by rename_aps()
+        - run_time: Time spent renaming the APs (in seconds)
+    """
+    for row, (ap, result) in enumerate(zip(ap_mac_list, results), start=1):
+        print(f"Row {row}\t{ap['mac'].strip()}\t{result['status'].upper()}\t{result['message']}")
+
+    nb_renamed = sum(1 for result in results if result['status'] == 'renamed')
+    nb_not_found = sum(1 for result in results if result['status'] == 'not found')
+    nb_errors = sum(1 for result in results if result['status'] == 'error')
+    nb_skipped = sum(1 for result in results if result['status'] == 'skipped')
+    latencies = sorted(result['latency'] for result in results if result['status'] in ('renamed', 'error'))
+    print(f"\nRenamed: {nb_renamed}\tNot in site: {nb_not_found}\tErrors: {nb_errors}\tSkipped: {nb_skipped}")
+    if latencies and run_time > 0:
+        print(f"Throughput: {round(len(latencies) / run_time, 1)} renames/sec\t"
+              f"Median latency: {round(latencies[len(latencies) // 2] * 1000)} ms\t"
+              f"Max latency: {round(latencies[-1] * 1000)} ms")
+
+
 def main():
     """
     This script batch rename the APs listed in a CSV file
     """
-    parser = argparse.ArgumentParser(description='Configures a Mist AP for an APoS site survey')
+    parser = argparse.ArgumentParser(description='Batch rename the APs listed in a CSV file')
     parser.add_argument('config', metavar='config_file', type=argparse.FileType(
         'r'), help='file containing all the configuration information')
     parser.add_argument('ap_list', metavar='aps_names', type=argparse.FileType(
         'r'), help='csv file containing new AP names')
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help='number of rename calls sent concurrently (Default = 8)')
+    parser.add_argument('--resume', action='store_true',
+                        help='journal the APs renamed, and skip the ones a previous run of the same CSV '
+                             'already renamed in the same site')
+    parser.add_argument('--journal', metavar='journal_file',
+                        help='journal file of --resume (Default = <aps_names>.journal, implies --resume)')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
     configs = json.load(args.config)
+    install_metrics(args)
     ap_mac_list = retreive_ap_mac_list(args.ap_list)
+    journal = None
+    if args.resume or args.journal:
+        journal = Journal(args.journal or f"{args.ap_list.name}.journal",
+                          {'operation': 'rename-ap', 'site_id': configs['site']['id']})
 
-    for ap in ap_mac_list:
-        ap_id, ap_old_name = is_ap_in_site(configs, ap['mac'])
-        if ap_id:
-            rename_ap(configs, ap_id, ap['name'], ap_old_name)
-        else:
-            print(f"AP {ap['name']} is not part of site {configs['site']['id']}")
+    start_time = time.time()
+    results = rename_aps(configs, ap_mac_list, max(1, args.workers), journal)
+    if journal:
+        journal.close()
+    if results is None:
+        sys.exit(1)
+    print_summary(ap_mac_list, results, time.time() - start_time)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""Request-budget benchmark of every script of the repository.
+
+Each script is run in its own process against the local Mist API mock (Mock-Mist-API),
+with a synthetic organization and input files of 10, 100 and 1,000 APs or sites. For every
+run, the following numbers are measured:
+    - requests: number of API calls received by the mock
+    - bytes: bytes of the request and response bodies
+    - wall_time: seconds the script ran
+    - peak_rss: peak resident memory of the script process, in MB
+
+The requests and bytes are compared to baseline.json and the benchmark fails (exit status 1)
+when one of them got worse than its tolerance allows, or when a script fails. The request
+counts are exact, so any extra API call is reported. The wall time and peak memory depend on
+the machine the baseline was recorded on: they are only compared with --check-resources, on
+the machine of the baseline. Run with --update-baseline after a change that makes a script
+cheaper.
+
+Usage:
+    python benchmark-scripts.py [-k batch-rename] [-n 10 100 1000] [--latency 5] [--check-resources] [--update-baseline]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO, 'Mock-Mist-API'))
+from mist_mock_server import MockOrg, MockServer  # noqa: E402
+
+RUN_WITH_MOCK = os.path.join(REPO, 'Mock-Mist-API', 'run-with-mock.py')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+METRICS = ('requests', 'bytes', 'wall_time', 'peak_rss')
+# Metrics that do not depend on the machine, always compared to the baseline
+STABLE_METRICS = ('requests', 'bytes')
+
+# Relative and absolute increase tolerated before a number is reported as a regression
+TOLERANCES = {'requests': (0, 0), 'bytes': (0.05, 1024), 'wall_time': (0.5, 0.3), 'peak_rss': (0.2, 5)}
+
+
+# ----- Fixtures ---------------------------------------------------------------------------------
+
+def write_file(workdir: str, filename: str, content: str) -> str:
+    path = os.path.join(workdir, filename)
+    with open(path, mode='w') as output_file:
+        output_file.write(content)
+    return path
+
+
+def rename_fixture(n, workdir, config):
+    rows = ''.join(f"Renamed-AP-{i:06d},5c5b35{i:06x}\n" for i in range(n))
+    return [write_file(workdir, 'aps-names.csv', 'name,mac\n' + rows)]
+
+
+def sites_fixture(n, workdir, config):
+    rows = ''.join(f'"New Site {i:05d}",Group_{i % 5},"{i} Bench Street, London, ON",RF_{i % 5}\n' for i in range(n))
+    stub = {f"{i} Bench Street, London, ON": {'country': 'CA', 'lat': 42.98, 'lng': -81.24,
+                                              'timezone': 'America/Toronto'} for i in range(n)}
+    return ['--config', 'config.json', write_file(workdir, 'sites.csv', 'site_name,site_group,site_address,rf_template\n' + rows),
+            '--geocode-stub', write_file(workdir, 'geocode-stub.json', json.dumps(stub))]
+
+
+def fleet_fixture(n, workdir, config):
+    config['aps'] = [{'mac': f"d420b0{i:06x}", 'name': f"Survey-AP-{i}", 'claim-code': f"CLAIM-{i:05d}"} for i in range(n)]
+    return []
+
+
+def clients_fixture(n, workdir, config):
+    clients = ''.join(f"a8c83a{i:06x}\n" for i in range(max(1, n // 10)))
+    return ['--config', 'config.json', '--clients', write_file(workdir, 'clients.txt', clients)]
+
+
+def codes_fixture(n, workdir, config):
+    return ['-f', write_file(workdir, 'claim-codes.txt', ''.join(f"CLAIM-{i:05d}\n" for i in range(n)))]
+
+
+def claimed_ap_fixture(n, workdir, config):
+    config['ap']['mac'] = '5c5b35000000'
+    return []
+
+
+def case(name, script, org, args=(), fixture=None, interrupt_after=None, tolerances=None):
+    """Describe a benchmark case.
+
+    Args:
+        name: str name of the case in the results and the baseline
+        script: str path of the script, relative to the repository
+        org: function returning the MockOrg arguments (nb_sites, nb_aps, nb_unclaimed) for a size
+        args: list of the script arguments, 'config.json' being the config file of the mock
+        fixture: function(size, workdir, config) writing the input files, returning extra arguments
+        interrupt_after: float seconds after which the script is stopped with Ctrl-C (polling scripts)
+        tolerances: dict of the TOLERANCES overridden for this case
+    """
+    return {'name': name, 'script': script, 'org': org, 'args': list(args), 'fixture': fixture,
+            'interrupt_after': interrupt_after, 'tolerances': dict(TOLERANCES, **(tolerances or {}))}
+
+
+def one_site(n):
+    return {'nb_sites': 1, 'nb_aps': n, 'nb_unclaimed': 1}
+
+
+def many_sites(n):
+    return {'nb_sites': max(1, n // 10), 'nb_aps': n, 'nb_unclaimed': 1}
+
+
+def sites_only(n):
+    return {'nb_sites': n, 'nb_aps': 0, 'nb_unclaimed': 1}
+
+
+def unclaimed(n):
+    return {'nb_sites': 1, 'nb_aps': 0, 'nb_unclaimed': n}
+
+
+MINI = 'Learn Mist API with Mini Scripts/'
+CASES = [
+    case('batch-rename-aps', 'Batch-Rename-APs/batch-rename-aps.py', one_site, ['config.json'], rename_fixture),
+    case('create-multiple-sites', 'Create-Mulitple-Sites/create-multiple-sites.py',
+         lambda n: {'nb_sites': 0, 'nb_aps': 0, 'nb_unclaimed': 0}, fixture=sites_fixture),
+    case('ap-eth0-stats', 'Eth-Stats/ap-eth0-stats.py', one_site, ['config.json']),
+    case('ap-eth0-stats-org', 'Eth-Stats/ap-eth0-stats.py', many_sites, ['config.json', '--org']),
+    case('export-rf-configs', 'Export-RF-Configs/export-rf-configs.py', one_site, ['config.json']),
+    case('export-rf-configs-stream', 'Export-RF-Configs/export-rf-configs.py', one_site, ['config.json', '--stream']),
+    case('export-rf-configs-org', 'Export-RF-Configs/export-rf-configs.py', many_sites, ['config.json', '--org']),
+    case('purge-sites', 'Purge/purge-sites.py', sites_only, ['--config', 'config.json']),
+    case('purge-sites-token-pool', 'Purge/purge-sites.py', sites_only, ['--config', 'config.json', '--tokens', '3']),
+    case('setup-apos', 'Setup-APoS-AP/setup-apos.py', one_site, ['config.json']),
+    case('setup-apos-fleet', 'Setup-APoS-AP/setup-apos.py', unclaimed, ['config.json'], fleet_fixture),
+    case('monitor-channel-utilization', 'monitor_channel_utilization/monitor_channel_utilization.py', many_sites,
+         ['--config', 'config.json']),
+    # The number of polls of a polling script depends on timing, a few more calls are not a regression
+    case('client-rssi', 'client-rssi/client-rssi.py', one_site, fixture=clients_fixture, interrupt_after=3,
+         tolerances={'requests': (0.1, 2), 'bytes': (0.1, 1024)}),
+    case('token-class', 'Token_Management/token_class.py', one_site),
+    case('windows-token-demo', 'Token_Management/windows_token_demo.py', one_site),
+    case('claim-ap', MINI + 'Claim AP/claim-ap.py', unclaimed, ['config.json']),
+    case('claim-ap-codes', MINI + 'Claim AP/claim-ap.py', unclaimed, ['config.json'], codes_fixture),
+    case('create-site', MINI + 'Create Site/create-site.py', sites_only, ['config.json']),
+    case('create-wlan', MINI + 'Create WLAN/create-wlan.py', one_site, ['config.json']),
+    case('create-wlan-wep', MINI + 'Create WLAN/create-wlan-wep.py', one_site, ['config.json']),
+    case('delete-wlan', MINI + 'Delete WLAN/delete-wlan.py', one_site, ['config.json']),
+    case('does-site-exist', MINI + 'Does Site Exist/does-site-exist.py', sites_only, ['config.json']),
+    case('does-wlan-exist', MINI + 'Does WLAN Exist/does-wlan-exist.py', one_site, ['config.json']),
+    case('list-wlans', MINI + 'List WLANs/list-wlans.py', one_site, ['config.json']),
+    case('provision-ap', MINI + 'Provision AP/provision-ap.py', one_site, ['config.json'], claimed_ap_fixture),
+]
+
+
+# ----- Runs -------------------------------------------------------------------------------------
+
+def run_case(bench_case: dict, size: int, latency: float, timeout: float) -> dict:
+    """Run a case at a given size against a fresh mock and return its numbers."""
+    org = MockOrg(**bench_case['org'](size))
+    server = MockServer(org, port=0, latency=latency)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix='mist-bench-')
+    try:
+        config = server.config()
+        args = bench_case['args'] + (bench_case['fixture'](size, workdir, config) if bench_case['fixture'] else [])
+        with open(os.path.join(workdir, 'config.json'), mode='w') as config_file:
+            json.dump(config, config_file)
+
+        command = [sys.executable, RUN_WITH_MOCK, '--mock', server.url, os.path.join(REPO, bench_case['script'])] + args
+        with open(os.path.join(workdir, 'output.log'), mode='w+') as output:
+            start_time = time.perf_counter()
+            process = subprocess.Popen(command, cwd=workdir, stdout=output, stderr=subprocess.STDOUT)
+            timers = [threading.Timer(timeout, process.kill)]
+            if bench_case['interrupt_after']:
+                timers.append(threading.Timer(bench_case['interrupt_after'], process.send_signal, [signal.SIGINT]))
+            for timer in timers:
+                timer.start()
+            # wait4() returns the resource usage of this process only (getrusage would merge every child)
+            _, status, usage = os.wait4(process.pid, 0)
+            wall_time = time.perf_counter() - start_time
+            for timer in timers:
+                timer.cancel()
+            process.returncode = os.waitstatus_to_exitcode(status)
+            output.seek(0)
+            log = output.read()
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return {'requests': sum(server.calls.values()), 'bytes': server.bytes_received + server.bytes_sent,
+            'wall_time': round(wall_time, 3), 'peak_rss': round(peak_rss, 1),
+            'returncode': process.returncode, 'log': log}
+
+
+def regressions(result: dict, baseline: dict, tolerances: dict, metrics=STABLE_METRICS) -> list:
+    """Return the metrics of a result that got worse than the baseline beyond their tolerance."""
+    worse = []
+    for metric in metrics:
+        if metric not in baseline:
+            continue
+        relative, absolute = tolerances[metric]
+        allowed = baseline[metric] + max(baseline[metric] * relative, absolute)
+        if result[metric] > allowed:
+            worse.append(f"{metric} {baseline[metric]} -> {result[metric]}")
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Request-budget benchmark of every script of the repository')
+    parser.add_argument('-k', '--cases', nargs='+', metavar='name',
+                        help='run only the cases whose name contains one of these strings')
+    parser.add_argument('-n', '--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='numbers of APs or sites of the fixtures (Default = 10 100 1000)')
+    parser.add_argument('--latency', type=float, default=5, help='milliseconds added to every API call (Default = 5)')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds before a script is killed (Default = 300)')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file (Default = baseline.json)')
+    parser.add_argument('--check-resources', action='store_true',
+                        help='also compare the wall time and peak memory (only meaningful on the machine of the baseline)')
+    parser.add_argument('--update-baseline', action='store_true', help='save the numbers of this run as the baseline')
+    parser.add_argument('--output', metavar='results_file', help='also write the numbers of this run to a JSON file')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    cases = [bench_case for bench_case in CASES
+             if not args.cases or any(pattern in bench_case['name'] for pattern in args.cases)]
+    results = {}
+    failures = 0
+    print(f"{'Case':<30}{'Size':>6}{'Requests':>10}{'Bytes':>12}{'Time (s)':>10}{'RSS (MB)':>10}  Status")
+    for bench_case in cases:
+        for size in args.sizes:
+            result = run_case(bench_case, size, args.latency, args.timeout)
+            log = result.pop('log')
+            returncode = result.pop('returncode')
+            results.setdefault(bench_case['name'], {})[str(size)] = result
+
+            if returncode != 0:
+                status = f"FAILED (exit status {returncode})"
+            else:
+                case_baseline = baseline.get(bench_case['name'], {}).get(str(size), {})
+                worse = regressions(result, case_baseline, bench_case['tolerances'],
+                                    METRICS if args.check_resources else STABLE_METRICS)
+                status = 'REGRESSION: ' + ', '.join(worse) if worse else 'ok'
+            print(f"{bench_case['name']:<30}{size:>6}{result['requests']:>10}{result['bytes']:>12}"
+                  f"{result['wall_time']:>10.2f}{result['peak_rss']:>10.1f}  {status}", flush=True)
+            if status != 'ok':
+                failures += 1
+                if returncode != 0:
+                    print('\t' + '\n\t'.join(log.strip().splitlines()[-10:]))
+
+    if args.output:
+        with open(args.output, mode='w') as results_file:
+            json.dump(results, results_file, indent=2)
+    if args.update_baseline:
+        for name, sizes in results.items():
+            baseline.setdefault(name, {}).update(sizes)
+        with open(args.baseline, mode='w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    print(f"\n{failures} failure(s) out of {len(cases) * len(args.sizes)} runs")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""Opt-in record/replay cache of the GET responses of the Mist API, for read-only scripts.
+
+Once installed, every GET made with requests (directly or through semfio_mist) is looked up
+in a local store before reaching the Mist cloud. The store is content-addressed: the response
+bodies are saved once under the hash of their content, and an index entry per URL (query
+included) points to the body with the time it was recorded. Entries younger than the TTL are
+replayed without any API call. In offline mode, every GET is answered from the store whatever
+its age, and a GET that was never recorded raises OfflineError instead of reaching the Mist cloud.
+
+The URL is the key, not the token: the temporary tokens of the scripts change on every run.
+Only successful (200) responses are recorded.
+
+The store is pruned when the cache is installed online: the index entries older than the TTL
+are removed (they would be fetched again anyway), then the bodies no index entry points to.
+Nothing is pruned in offline mode, where entries of any age are replayed.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.mist_http_cache')
+
+# Answers of the temporary token calls in offline mode, so the semfio_mist scripts can run without network
+OFFLINE_TOKEN_CALLS = {'POST': {'id': 'offline-token', 'key': 'offline-token'}, 'DELETE': {}}
+
+
+class OfflineError(requests.ConnectionError):
+    """Raised in offline mode by a call that cannot be answered from the store."""
+
+
+def request_key(url: str, params=None) -> str:
+    """Return the hash identifying a GET request (independent of the order of the query parameters)."""
+    url = requests.Request('GET', url, params=params).prepare().url
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return hashlib.sha256(urlunsplit(parts._replace(query=query, fragment='')).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Content-addressed store of the GET responses.
+
+    Attributes:
+        directory: str directory of the store ('objects' holds the bodies, 'index' the entries per URL)
+        ttl: float number of seconds a recorded response is replayed
+        offline: bool replay every recorded response and never call the Mist cloud
+        hits: int number of responses replayed
+        misses: int number of responses fetched from the Mist cloud
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, ttl: float = 300, offline: bool = False):
+        self.directory = directory
+        self.ttl = ttl
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'index'), exist_ok=True)
+
+    def lookup(self, url: str, params=None) -> requests.Response:
+        """Return the recorded response of a GET request, None if there is none (or too old when online)."""
+        try:
+            with open(os.path.join(self.directory, 'index', request_key(url, params) + '.json')) as index_file:
+                entry = json.load(index_file)
+            with open(os.path.join(self.directory, 'objects', entry['body']), mode='rb') as body_file:
+                body = body_file.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        if not self.offline and time.time() - entry['recorded_at'] > self.ttl:
+            return None
+
+        response = requests.Response()
+        response.status_code = entry['status_code']
+        response.reason = 'OK'
+        response.url = entry['url']
+        response.encoding = 'utf-8'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.headers['X-Mist-Cache'] = 'hit'
+        response._content = body
+        with self.lock:
+            self.hits += 1
+        return response
+
+    def record(self, url: str, params, response: requests.Response):
+        """Save a successful GET response to the store."""
+        if response.status_code != 200:
+            return
+        body_hash = hashlib.sha256(response.content).hexdigest()
+        body_path = os.path.join(self.directory, 'objects', body_hash)
+        if not os.path.exists(body_path):
+            self._write(body_path, response.content)
+        entry = {'url': response.url, 'status_code': response.status_code, 'body': body_hash,
+                 'recorded_at': time.time(), 'headers': {name: value for name, value in response.headers.items()
+                                                         if name.lower() in ('content-type', 'x-page-total',
+                                                                             'x-page-limit', 'x-page-page')}}
+        self._write(os.path.join(self.directory, 'index', request_key(url, params) + '.json'),
+                    json.dumps(entry).encode('utf-8'))
+
+    def prune(self) -> int:
+        """Remove the index entries older than the TTL and the bodies no entry points to.
+
+        Returns:
+            The number of files removed
+        """
+        started_at = time.time()
+        removed = 0
+        referenced = set()
+        index_directory = os.path.join(self.directory, 'index')
+        for filename in os.listdir(index_directory):
+            path = os.path.join(index_directory, filename)
+            try:
+                if filename.endswith('.tmp'):
+                    # Left behind by a script interrupted while writing
+                    expired = started_at - os.path.getmtime(path) > self.ttl
+                else:
+                    with open(path) as index_file:
+                        entry = json.load(index_file)
+                    expired = started_at - entry['recorded_at'] > self.ttl
+                    if not expired:
+                        referenced.add(entry['body'])
+                if expired:
+                    os.remove(path)
+                    removed += 1
+            except (OSError, ValueError, KeyError):
+                continue
+
+        objects_directory = os.path.join(self.directory, 'objects')
+        for filename in os.listdir(objects_directory):
+            path = os.path.join(objects_directory, filename)
+            try:
+                # Bodies written since the scan started may belong to an entry of a concurrent run
+                if filename not in referenced and os.path.getmtime(path) < started_at:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def _write(self, path: str, content: bytes):
+        # Written to a temporary file first, so concurrent workers never read a partial file
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, mode='wb') as output_file:
+            output_file.write(content)
+        os.replace(temporary_path, path)
+
+    def install(self):
+        """Route every requests call of this process through the cache."""
+        original_request = requests.Session.request
+        cache = self
+
+        def request(session, method, url, params=None, *args, **kwargs):
+            if method.upper() == 'GET':
+                response = cache.lookup(url, params)
+                if response is not None:
+                    return response
+                if cache.offline:
+                    raise OfflineError(f"Offline mode: GET {url} was never recorded")
+                response = original_request(session, method, url, params, *args, **kwargs)
+                with cache.lock:
+                    cache.misses += 1
+                cache.record(url, params, response)
+                return response
+
+            if cache.offline:
+                if '/self/apitokens' in url and method.upper() in OFFLINE_TOKEN_CALLS:
+                    response = requests.Response()
+                    response.status_code = 200
+                    response.url = url
+                    response._content = json.dumps(OFFLINE_TOKEN_CALLS[method.upper()]).encode('utf-8')
+                    return response
+                raise OfflineError(f"Offline mode: {method.upper()} {url} is not allowed")
+            return original_request(session, method, url, params, *args, **kwargs)
+
+        requests.Session.request = request
+
+    def summary(self) -> str:
+        return f"HTTP cache: {self.hits} responses replayed, {self.misses} fetched from Mist"
+
+
+def add_cache_arguments(parser):
+    """Add the --cache, --cache-ttl, --cache-dir and --offline arguments to a script."""
+    parser.add_argument('--cache', action='store_true',
+                        help='replay the GET responses recorded by a previous run within the cache TTL')
+    parser.add_argument('--cache-ttl', metavar='seconds', type=float, default=300,
+                        help='number of seconds a recorded response is replayed and kept in the cache (Default = 300)')
+    parser.add_argument('--cache-dir', metavar='directory', default=CACHE_DIR,
+                        help='directory of the recorded responses (Default = ~/.mist_http_cache)')
+    parser.add_argument('--offline', action='store_true',
+                        help='answer every GET from the recorded responses, whatever their age, without any API call')
+
+
+def install_cache(args) -> ResponseCache:
+    """Install the cache if the script was run with --cache or --offline, return it (None otherwise)."""
+    if not (args.cache or args.offline):
+        return None
+    cache = ResponseCache(args.cache_dir, args.cache_ttl, args.offline)
+    if not cache.offline:
+        cache.prune()
+    cache.install()
+    return cache
@@ -0,0 +1,67 @@
+"""Write-ahead journal of the CSV rows already processed by a bulk provisioning script.
+
+Each completed operation is appended to the journal (one JSON line per row, keyed on a hash
+of the CSV row and of the scope of the run) and flushed to disk before the script moves on.
+When the script is run again with the same CSV file against the same target, the rows found in
+the journal are skipped without any API call. The scope holds the operation and its target (org
+or site ID), so the same CSV applied to another org or site is never skipped.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def row_key(row: dict, scope: dict = None) -> str:
+    """Return the hash identifying a CSV row within a scope (independent of the column order)."""
+    return hashlib.sha256(json.dumps({'row': row, 'scope': scope or {}}, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class Journal:
+    """Append-only journal of completed CSV rows.
+
+    Attributes:
+        filename: str name of the journal file
+        scope: dict of the operation and target of the run (ex: {'operation': 'rename', 'site_id': ...})
+        entries: dict of the journal entries keyed on the row hash
+    """
+
+    def __init__(self, filename: str, scope: dict = None):
+        """Load the entries of a previous run and open the journal for appending."""
+        self.filename = filename
+        self.scope = scope or {}
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(filename):
+            with open(filename) as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line cut short by a crash
+                        continue
+                    self.entries[entry['row']] = entry
+        self._file = open(filename, mode='a')
+
+    def is_done(self, row: dict) -> bool:
+        """Return True if the operation of this CSV row has already been completed."""
+        return row_key(row, self.scope) in self.entries
+
+    def pending(self, rows: list) -> list:
+        """Return the CSV rows that have not been completed yet."""
+        return [row for row in rows if not self.is_done(row)]
+
+    def record(self, row: dict, result: dict = None):
+        """Record a completed operation, making sure it reached the disk."""
+        entry = {'row': row_key(row, self.scope), 'done_at': time.time(), 'result': result or {}}
+        with self.lock:
+            self.entries[entry['row']] = entry
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,281 @@
+"""Per-endpoint metrics of the Mist API calls made by a script.
+
+Once installed, every call made with requests (directly or through semfio_mist) is recorded
+under its endpoint template, the IDs and MAC addresses of the URL being replaced by their
+name (ex: GET sites/:site_id/stats/devices). For each method, endpoint and status code, the
+registry keeps the number of calls, the latencies (a histogram, and p50/p95/p99 computed on a
+bounded random sample), the bytes sent and received, and the number of retries. A retry is a call sent again to the same URL
+after a 429, a 5xx or a connection error. The aiohttp pollers are covered with trace_config().
+
+The metrics are dumped at exit as JSON or Prometheus text, or served live over HTTP during
+long monitoring loops (GET /metrics for Prometheus, GET /metrics.json for JSON).
+"""
+
+import atexit
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+
+# Upper bounds of the latency histogram, in seconds
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Number of latencies sampled per key for the percentiles, so memory stays flat in long loops
+RESERVOIR_SIZE = 1024
+
+UUID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE)
+MAC_RE = re.compile(r'^[0-9a-f]{12}$', re.IGNORECASE)
+
+
+def endpoint_template(url: str) -> str:
+    """Return the endpoint of a URL with its IDs replaced by their name.
+
+    Ex: https://api.mist.com/api/v1/sites/8aaba0c5-.../devices/00000000-...-5c5b35000001
+        -> sites/:site_id/devices/:device_id
+    """
+    path = urlsplit(url).path
+    path = path.split('/api/v1/', 1)[1] if '/api/v1/' in path else path.lstrip('/')
+    segments = path.strip('/').split('/')
+    for index, segment in enumerate(segments):
+        if UUID_RE.match(segment):
+            collection = segments[index - 1] if index else 'object'
+            segments[index] = f":{collection[:-1] if collection.endswith('s') else collection}_id"
+        elif MAC_RE.match(segment):
+            segments[index] = ':mac'
+    return '/'.join(segments)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+class MetricsRegistry:
+    """Metrics of the API calls, keyed on (method, endpoint template, status).
+
+    Attributes:
+        calls: dict of the metrics of each (method, endpoint, status): 'count', 'latency_sum', 'latency_max',
+            'buckets' (calls per histogram bucket, the last one being +Inf), 'sample' (latency reservoir),
+            'bytes_out' and 'bytes_in'
+        retries: dict of the number of retries of each (method, endpoint)
+        started_at: float time the registry was created
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.retries = {}
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        # (method, URL) of the calls that failed, a new call to one of them is a retry
+        self._failed = set()
+
+    def record(self, method: str, url: str, status, latency: float, bytes_out: int = 0, bytes_in: int = 0):
+        """Record a call.
+
+        Args:
+            method: str HTTP method
+            url: str full URL of the call
+            status: int HTTP status code, or 'error' when no response was received
+            latency: float seconds until the response was received
+            bytes_out: int bytes of the request body
+            bytes_in: int bytes of the response body
+        """
+        method = method.upper()
+        endpoint = endpoint_template(url)
+        with self.lock:
+            if (method, url) in self._failed:
+                self._failed.discard((method, url))
+                self.retries[(method, endpoint)] = self.retries.get((method, endpoint), 0) + 1
+            if status == 'error' or status == 429 or status >= 500:
+                self._failed.add((method, url))
+
+            metrics = self.calls.get((method, endpoint, str(status)))
+            if metrics is None:
+                metrics = self.calls[(method, endpoint, str(status))] = {
+                    'count': 0, 'latency_sum': 0.0, 'latency_max': 0.0, 'buckets': [0] * (len(BUCKETS) + 1),
+                    'sample': [], 'bytes_out': 0, 'bytes_in': 0}
+            metrics['count'] += 1
+            metrics['latency_sum'] += latency
+            metrics['latency_max'] = max(metrics['latency_max'], latency)
+            metrics['buckets'][bisect.bisect_left(BUCKETS, latency)] += 1
+            # Reservoir sampling: every latency has the same chance of being in the sample
+            if len(metrics['sample']) < RESERVOIR_SIZE:
+                metrics['sample'].append(latency)
+            else:
+                index = random.randrange(metrics['count'])
+                if index < RESERVOIR_SIZE:
+                    metrics['sample'][index] = latency
+            metrics['bytes_out'] += bytes_out
+            metrics['bytes_in'] += bytes_in
+
+    def to_json(self) -> dict:
+        """Return the metrics as a JSON serializable dictionary."""
+        with self.lock:
+            calls = {key: dict(metrics, sample=sorted(metrics['sample'])) for key, metrics in self.calls.items()}
+            retries = dict(self.retries)
+        endpoints = []
+        for (method, endpoint, status), metrics in sorted(calls.items()):
+            sample = metrics['sample']
+            endpoints.append({'method': method, 'endpoint': endpoint, 'status': status, 'count': metrics['count'],
+                              'latency_total': round(metrics['latency_sum'], 6),
+                              'latency_p50': round(percentile(sample, 0.50), 6),
+                              'latency_p95': round(percentile(sample, 0.95), 6),
+                              'latency_p99': round(percentile(sample, 0.99), 6),
+                              'latency_max': round(metrics['latency_max'], 6),
+                              'bytes_out': metrics['bytes_out'], 'bytes_in': metrics['bytes_in']})
+        return {'started_at': self.started_at, 'duration': round(time.time() - self.started_at, 3),
+                'total_calls': sum(endpoint['count'] for endpoint in endpoints),
+                'total_retries': sum(retries.values()), 'endpoints': endpoints,
+                'retries': [{'method': method, 'endpoint': endpoint, 'count': count}
+                            for (method, endpoint), count in sorted(retries.items())]}
+
+    def to_prometheus(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        with self.lock:
+            calls = {key: dict(metrics, buckets=list(metrics['buckets'])) for key, metrics in self.calls.items()}
+            retries = dict(self.retries)
+
+        lines = ['# HELP mist_api_requests_total Mist API calls per method, endpoint and status',
+                 '# TYPE mist_api_requests_total counter']
+        for (method, endpoint, status), metrics in sorted(calls.items()):
+            lines.append(f'mist_api_requests_total{{method="{method}",endpoint="{endpoint}",status="{status}"}} '
+                         f'{metrics["count"]}')
+
+        # The latency histogram is per method and endpoint, whatever the status
+        durations = {}
+        for (method, endpoint, status), metrics in calls.items():
+            buckets, latency_sum = durations.get((method, endpoint), ([0] * (len(BUCKETS) + 1), 0.0))
+            durations[(method, endpoint)] = ([total + count for total, count in zip(buckets, metrics['buckets'])],
+                                             latency_sum + metrics['latency_sum'])
+        lines += ['# HELP mist_api_request_duration_seconds Latency of the Mist API calls',
+                  '# TYPE mist_api_request_duration_seconds histogram']
+        for (method, endpoint), (buckets, latency_sum) in sorted(durations.items()):
+            labels = f'method="{method}",endpoint="{endpoint}"'
+            cumulative = 0
+            for bucket, count in zip(BUCKETS, buckets):
+                cumulative += count
+                lines.append(f'mist_api_request_duration_seconds_bucket{{{labels},le="{bucket}"}} {cumulative}')
+            lines.append(f'mist_api_request_duration_seconds_bucket{{{labels},le="+Inf"}} {sum(buckets)}')
+            lines.append(f'mist_api_request_duration_seconds_sum{{{labels}}} {round(latency_sum, 6)}')
+            lines.append(f'mist_api_request_duration_seconds_count{{{labels}}} {sum(buckets)}')
+
+        for name, direction, help_text in (('mist_api_request_bytes_total', 'bytes_out', 'Bytes of the request bodies'),
+                                           ('mist_api_response_bytes_total', 'bytes_in', 'Bytes of the response bodies')):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            totals = {}
+            for (method, endpoint, status), metrics in calls.items():
+                totals[(method, endpoint)] = totals.get((method, endpoint), 0) + metrics[direction]
+            for (method, endpoint), total in sorted(totals.items()):
+                lines.append(f'{name}{{method="{method}",endpoint="{endpoint}"}} {total}')
+
+        lines += ['# HELP mist_api_retries_total Mist API calls sent again after a 429, a 5xx or a connection error',
+                  '# TYPE mist_api_retries_total counter']
+        for (method, endpoint), count in sorted(retries.items()):
+            lines.append(f'mist_api_retries_total{{method="{method}",endpoint="{endpoint}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filename: str):
+        """Write the metrics to a file, in Prometheus text if its extension is .prom or .txt, in JSON otherwise."""
+        with open(filename, mode='w') as metrics_file:
+            if filename.endswith(('.prom', '.txt')):
+                metrics_file.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), metrics_file, indent=2)
+
+    def install(self):
+        """Record every requests call of this process (the responses replayed by mist_http_cache are skipped)."""
+        original_request = requests.Session.request
+        registry = self
+
+        def request(session, method, url, *args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                response = original_request(session, method, url, *args, **kwargs)
+            except requests.RequestException:
+                registry.record(method, url, 'error', time.perf_counter() - start_time)
+                raise
+            if response.headers.get('X-Mist-Cache') == 'hit':
+                return response
+            body = response.request.body if response.request is not None else None
+            registry.record(method, url, response.status_code, time.perf_counter() - start_time,
+                            len(body or b''), len(response.content or b''))
+            return response
+
+        requests.Session.request = request
+
+    def trace_config(self):
+        """Return an aiohttp.TraceConfig recording the calls of an aiohttp.ClientSession.
+
+        Usage: aiohttp.ClientSession(..., trace_configs=[registry.trace_config()])
+        """
+        import aiohttp
+
+        async def on_request_start(session, context, params):
+            context.start_time = time.perf_counter()
+
+        async def on_request_end(session, context, params):
+            self.record(params.method, str(params.url), params.response.status,
+                        time.perf_counter() - context.start_time, 0, params.response.content_length or 0)
+
+        async def on_request_exception(session, context, params):
+            self.record(params.method, str(params.url), 'error', time.perf_counter() - context.start_time)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """Serve the metrics live in a background thread (GET /metrics or /metrics.json)."""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(registry.to_json()).encode('utf-8'), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def add_metrics_arguments(parser):
+    """Add the --metrics and --metrics-port arguments to a script."""
+    parser.add_argument('--metrics', metavar='metrics_file',
+                        help='write the metrics of the API calls to this file at exit (.prom or .txt for Prometheus text, JSON otherwise)')
+    parser.add_argument('--metrics-port', metavar='port', type=int,
+                        help='serve the metrics of the API calls live on http://127.0.0.1:port/metrics')
+
+
+def install_metrics(args) -> MetricsRegistry:
+    """Install the registry if the script was run with --metrics or --metrics-port, return it (None otherwise)."""
+    if not (args.metrics or args.metrics_port):
+        return None
+    registry = MetricsRegistry()
+    registry.install()
+    if args.metrics:
+        atexit.register(registry.dump, args.metrics)
+    if args.metrics_port:
+        registry.serve(args.metrics_port)
+    return registry
@@ -0,0 +1,22 @@
+"""Helpers shared by the scripts that retry the API calls rejected by the Mist rate limit.
+
+The Mist cloud answers 429 with a Retry-After header, given either as a number of seconds or
+as an HTTP date (RFC 9110), depending on the gateway that rejected the call.
+"""
+
+import time
+from email.utils import parsedate_to_datetime
+
+
+def retry_after_seconds(retry_after: str, default: float) -> float:
+    """Return the seconds of a Retry-After header, given either as seconds or as an HTTP date."""
+    if not retry_after:
+        return default
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,148 @@
+"""In-process time-series store for the metrics polled from the Mist cloud.
+
+Every series (one metric of one AP band or one client) lives in a fixed-size ring buffer, so
+the memory used by a series never grows past its capacity no matter how long a script runs.
+All the series share two 2D NumPy arrays (timestamps and values, one row per series), which
+lets the window aggregates run on every series at once instead of looping in Python.
+"""
+
+import time
+import warnings
+import numpy as np
+
+
+# Metrics recorded for each radio of an AP by record_device_stats()
+RADIO_METRICS = ('util_all', 'num_clients', 'channel')
+# Each sample costs a float64 timestamp and a float32 value
+BYTES_PER_SAMPLE = 12
+
+
+class TimeSeriesStore:
+    """Time-series store backed by NumPy ring buffers.
+
+    Attributes:
+        capacity: int number of samples kept per series (oldest samples are overwritten)
+        series: dict mapping a series key (entity, band, metric) to its row in the arrays
+        entity_series: dict mapping each entity to the keys of its series
+        times: 2D float64 array of sample timestamps (NaN for empty slots)
+        values: 2D float32 array of sample values
+        heads: int array of the next slot to write in each row
+    """
+
+    def __init__(self, capacity: int = None, max_bytes_per_series: int = 16384, initial_series: int = 64):
+        """Initialize the store.
+
+        Args:
+            capacity: int number of samples kept per series (Default: derived from max_bytes_per_series)
+            max_bytes_per_series: int memory budget of a series when capacity is not given
+                (Default = 16KB, about 11 hours of samples taken every 30 seconds)
+            initial_series: int number of rows allocated up front (doubles when full)
+        """
+        self.capacity = capacity or max(1, max_bytes_per_series // BYTES_PER_SAMPLE)
+        self.series = {}
+        self.entity_series = {}
+        self.times = np.full((initial_series, self.capacity), np.nan, dtype=np.float64)
+        self.values = np.full((initial_series, self.capacity), np.nan, dtype=np.float32)
+        self.heads = np.zeros(initial_series, dtype=np.int64)
+
+    def _row(self, key: tuple) -> int:
+        """Return the row of a series, allocating it (and growing the arrays) if needed."""
+        row = self.series.get(key)
+        if row is None:
+            row = len(self.series)
+            if row == len(self.heads):
+                extra = len(self.heads)
+                self.times = np.vstack([self.times, np.full((extra, self.capacity), np.nan, dtype=np.float64)])
+                self.values = np.vstack([self.values, np.full((extra, self.capacity), np.nan, dtype=np.float32)])
+                self.heads = np.concatenate([self.heads, np.zeros(extra, dtype=np.int64)])
+            self.series[key] = row
+            self.entity_series.setdefault(key[0], []).append(key)
+        return row
+
+    def append(self, entity: str, band: str, metric: str, value: float, timestamp: float = None):
+        """Append a sample to a series in O(1).
+
+        Args:
+            entity: str identifying the AP or the client (MAC address)
+            band: str radio band of the sample ('band_24', 'band_5'...) or any other sub-key of the entity
+            metric: str name of the metric ('util_all', 'rssi'...)
+            value: number value of the sample (None is ignored)
+            timestamp: float epoch of the sample (Default: now)
+        """
+        if value is None:
+            return
+        row = self._row((entity, band, metric))
+        head = self.heads[row]
+        self.times[row, head] = time.time() if timestamp is None else timestamp
+        self.values[row, head] = value
+        self.heads[row] = (head + 1) % self.capacity
+
+    def record_device_stats(self, device: dict, timestamp: float = None):
+        """Record the radio metrics of a device returned by GET sites/:site_id/stats/devices."""
+        if device.get('type') != 'ap' or device.get('status') != 'connected':
+            return
+        for band, radio in device.get('radio_stat', {}).items():
+            for metric in RADIO_METRICS:
+                self.append(device['mac'], band, metric, radio.get(metric), timestamp)
+
+    def window_stats(self, minutes: float, metric: str = None, band: str = None, entities: set = None,
+                     now: float = None) -> dict:
+        """Compute the mean, 95th percentile and max of every series over the last minutes.
+
+        The aggregates are computed on all the matching series at once.
+
+        Args:
+            minutes: float size of the window
+            metric: str only return the series of this metric (Default: all)
+            band: str only return the series of this band (Default: all)
+            entities: set only return the series of these APs or clients (Default: all)
+            now: float epoch of the end of the window (Default: now)
+
+        Returns:
+            A dict mapping each series key (entity, band, metric) to a dict with the
+            'mean', 'p95', 'max' and 'count' of its samples within the window
+        """
+        # Only the series of the requested entities are looked at, not every series of the store
+        candidates = self.series if entities is None else [
+            key for entity in entities for key in self.entity_series.get(entity, ())]
+        keys = [key for key in candidates
+                if (metric is None or key[2] == metric) and (band is None or key[1] == band)]
+        if not keys:
+            return {}
+        rows = np.array([self.series[key] for key in keys])
+        since = (time.time() if now is None else now) - minutes * 60
+
+        with np.errstate(invalid='ignore'):
+            in_window = self.times[rows] >= since
+        samples = np.where(in_window, self.values[rows], np.nan)
+        counts = in_window.sum(axis=1)
+        with warnings.catch_warnings():
+            # Series without any sample in the window give NaN aggregates
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            means = np.nanmean(samples, axis=1)
+            p95s = np.nanpercentile(samples, 95, axis=1)
+            maxs = np.nanmax(samples, axis=1)
+
+        return {key: {'mean': float(means[i]), 'p95': float(p95s[i]), 'max': float(maxs[i]), 'count': int(counts[i])}
+                for i, key in enumerate(keys) if counts[i]}
+
+    def series_stats(self, entity: str, band: str, metric: str, minutes: float, now: float = None) -> dict:
+        """Compute the mean, 95th percentile and max of a single series over the last minutes.
+
+        Returns:
+            A dict with the 'mean', 'p95', 'max' and 'count' of the samples, None if there are none
+        """
+        row = self.series.get((entity, band, metric))
+        if row is None:
+            return None
+        since = (time.time() if now is None else now) - minutes * 60
+        with np.errstate(invalid='ignore'):
+            samples = self.values[row][self.times[row] >= since]
+        if len(samples) == 0:
+            return None
+        return {'mean': float(samples.mean()), 'p95': float(np.percentile(samples, 95)),
+                'max': float(samples.max()), 'count': len(samples)}
+
+    def memory_usage(self) -> int:
+        """Return the number of bytes held by the ring buffers."""
+        return self.times.nbytes + self.values.nbytes + self.heads.nbytes
@@ -0,0 +1,178 @@
+"""Lightweight tracing spans of the workflow phases and API calls of a script.
+
+The phases of a workflow are wrapped in spans, which nest naturally on each thread:
+
+    with span('claim', aps=len(aps)):
+        ...
+
+    @traced()
+    def setup_site(configs):
+        ...
+
+When the script runs with --profile, every span and every API call made with requests
+(directly or through semfio_mist) is recorded, and written at exit to a Chrome trace file
+(open it in chrome://tracing or https://ui.perfetto.dev). --cprofile also writes a cProfile
+dump of the main thread (python -m pstats, snakeviz...).
+
+Without --profile, span() returns a shared no-op object and traced() calls the function
+directly: the overhead is about a microsecond per span.
+"""
+
+import atexit
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+
+import requests
+
+from mist_metrics import endpoint_template
+
+
+class _NoopSpan:
+    """Span returned while tracing is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """Timed phase of the script, recorded as a Chrome trace complete event."""
+
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add(self, end)
+        return False
+
+    def set(self, **args):
+        """Add arguments to the span (shown in the trace viewer)."""
+        self.args.update(args)
+
+
+class Tracer:
+    """Recorder of the spans of the process.
+
+    Attributes:
+        enabled: bool record the spans (False = no-op spans)
+        events: list of the recorded Chrome trace events
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.thread_names = {}
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+
+    def span(self, name: str, category: str = 'workflow', /, **args):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, category, args)
+
+    def add(self, span: Span, end: int):
+        thread_id = threading.get_ident()
+        if thread_id not in self.thread_names:
+            self.thread_names[thread_id] = threading.current_thread().name
+        # list.append is atomic, no lock is needed between the worker threads
+        self.events.append({'name': span.name, 'cat': span.category, 'ph': 'X', 'pid': self.pid, 'tid': thread_id,
+                            'ts': (span.start - self.origin) / 1000, 'dur': (end - span.start) / 1000,
+                            'args': span.args})
+
+    def to_chrome_trace(self) -> dict:
+        """Return the recorded spans in the Chrome trace event format."""
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': thread_id, 'args': {'name': name}}
+                    for thread_id, name in list(self.thread_names.items())]
+        return {'traceEvents': metadata + sorted(self.events, key=lambda event: event['ts']),
+                'displayTimeUnit': 'ms'}
+
+    def write(self, filename: str):
+        with open(filename, mode='w') as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
+
+
+TRACER = Tracer()
+
+
+def span(name: str, category: str = 'workflow', /, **args):
+    """Return a span of the global tracer, to use with 'with'. Arguments are shown in the trace viewer."""
+    return TRACER.span(name, category, **args)
+
+
+def traced(name: str = None):
+    """Decorator wrapping every call of a function in a span (named after the function by default)."""
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            with Span(TRACER, span_name, 'workflow', {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def install_http_spans():
+    """Wrap every requests call of this process in a span named after its method and endpoint."""
+    original_request = requests.Session.request
+
+    def request(session, method, url, *args, **kwargs):
+        if not TRACER.enabled:
+            return original_request(session, method, url, *args, **kwargs)
+        with Span(TRACER, f"{method.upper()} {endpoint_template(url)}", 'http', {'url': url}) as http_span:
+            response = original_request(session, method, url, *args, **kwargs)
+            http_span.set(status=response.status_code)
+            return response
+
+    requests.Session.request = request
+
+
+def add_profile_arguments(parser):
+    """Add the --profile and --cprofile arguments to a script."""
+    parser.add_argument('--profile', metavar='trace_file',
+                        help='write the spans of the workflow phases and API calls to a Chrome trace file '
+                             '(chrome://tracing, ui.perfetto.dev)')
+    parser.add_argument('--cprofile', metavar='stats_file',
+                        help='also write a cProfile dump of the main thread (python -m pstats stats_file)')
+
+
+def install_profiling(args):
+    """Start the tracing and profiling asked on the command line, their files are written at exit."""
+    if args.profile:
+        TRACER.enabled = True
+        install_http_spans()
+        atexit.register(TRACER.write, args.profile)
+    if args.cprofile:
+        profile = cProfile.Profile()
+        profile.enable()
+
+        def dump_profile():
+            profile.disable()
+            profile.dump_stats(args.cprofile)
+        atexit.register(dump_profile)
@@ -2,12 +2,19 @@
 import time
 import argparse
 import csv
-import geocoder
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from semfio_mist import Config
 from semfio_mist import logger
 from semfio_mist import API
-from semfio_mist import Site
+from geocode_cache import GeocodeCache, google_resolver, stub_resolver
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from mist_journal import Journal  # noqa: E402
+from mist_metrics import add_metrics_arguments, install_metrics  # noqa: E402
+from mist_tracing import add_profile_arguments, install_profiling, span, traced  # noqa: E402
 
 
 def retreive_csv_data(csv_filename: str) -> dict:
@@ -26,7 +33,26 @@ def script_args_parser() -> Config:
     parser.add_argument('site_list', metavar='site_info', type=argparse.FileType(
         'r'), help='csv file containing new sites names')
     parser.add_argument("-v", "--verbose", help="See DEBUG level messages", action="store_true")
+    parser.add_argument('--geocode-cache', metavar='cache_file', default='geocode-cache.jsonl',
+                        help='file storing the geocoding results between runs (Default = geocode-cache.jsonl)')
+    parser.add_argument('--geocode-ttl', metavar='days', type=float, default=30,
+                        help='number of days a geocoding result is reused (Default = 30)')
+    parser.add_argument('--geocode-stub', metavar='stub_file',
+                        help='JSON file of address locations used instead of the Google APIs')
+    parser.add_argument("-w", "--workers", type=int, default=8,
+                        help="number of sites created at the same time (Default = 8)")
+    parser.add_argument('--report', metavar='report_file', default='site-report.csv',
+                        help='csv file receiving the result of each site (Default = site-report.csv)')
+    parser.add_argument('--resume', action='store_true',
+                        help='journal the sites created, and skip the ones a previous run of the same CSV '
+                             'already created in the same org')
+    parser.add_argument('--journal', metavar='journal_file',
+                        help='journal file of --resume (Default = <site_info>.journal, implies --resume)')
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    install_metrics(args)
+    install_profiling(args)
 
     # Create a config object based on the config filename
     config = Config(args.config.name)
@@ -38,90 +64,252 @@ def script_args_parser() -> Config:
     # Extract the information from the CSV fiel into a Python dictionary
     site_list = retreive_csv_data(args.site_list)
 
-    return config, site_list
+    # Create the geocode cache, backed by the Google APIs unless a stub file is given
+    resolver = stub_resolver(args.geocode_stub) if args.geocode_stub else google_resolver(
+        config.data.get('google_api_key'))
+    geocodes = GeocodeCache(resolver, args.geocode_cache, args.geocode_ttl)
+
+    # Journal of the rows completed by previous runs of the same CSV file in the same org
+    journal = None
+    if args.resume or args.journal:
+        journal = Journal(args.journal or f"{args.site_list.name}.journal",
+                          {'operation': 'create-site', 'org_id': config.data['org_id']})
+
+    return config, site_list, geocodes, journal, args
+
+
+class OrgObjectCache:
+    """Name to ID cache of a list of organization objects (site groups, RF templates...).
+
+    The list is downloaded from the Mist cloud the first time it is needed, then every
+    lookup is served locally. Objects created by the script are added to the cache.
+    """
+
+    def __init__(self, object_type: str, api: API, config: Config):
+        """Initialize the cache.
+
+        Args:
+            object_type: str type of the objects in the API URL ('sitegroups', 'rftemplates'...)
+            api: API object used to retreive the objects
+            config: Config object containing the content of the config file
+        """
+        self.call_url = f"orgs/{config.data['org_id']}/{object_type}"
+        self.api = api
+        self._ids = None
 
+    def get_id(self, name: str) -> str:
+        """Return the ID of the object with this name, None if it does not exist."""
+        if self._ids is None:
+            self._ids = {}
+            for org_object in self.api.get(self.call_url):
+                self._ids.setdefault(org_object['name'], org_object['id'])
+        return self._ids.get(name)
 
-def validate_site_group(site_group_name: str, api: API, config: Config) -> str:
+    def add(self, name: str, object_id: str):
+        """Record an object created by the script."""
+        if self._ids is None:
+            self.get_id(name)
+        self._ids[name] = object_id
+
+
+def validate_site_group(site_group_name: str, api: API, config: Config, site_groups: OrgObjectCache) -> str:
     """Validate if a Site Group exists and creates it if not."""
     logger.debug(f"Validating if the following site group exists: {site_group_name}")
-    site_groups = api.get(f"orgs/{config.data['org_id']}/sitegroups")
-    sitegroup_id = None
+    sitegroup_id = site_groups.get_id(site_group_name)
 
-    site_group_exists = False
-    for site_group in site_groups:
-        if site_group_name == site_group['name']:
-            site_group_exists = True
-            sitegroup_id = site_group['id']
-            break
-
-    if site_group_exists is False:
+    if sitegroup_id is None:
         logger.debug(f"Site Group {site_group_name} does not exist. Creating site group...")
         create_new_site_group_body = {}
         create_new_site_group_body['name'] = site_group_name
         response_post = api.post(
             f"orgs/{config.data['org_id']}/sitegroups", create_new_site_group_body)
+        if response_post is None:
+            raise ValueError(f"Site Group {site_group_name} could not be created")
         sitegroup_id = response_post['id']
+        site_groups.add(site_group_name, sitegroup_id)
     else:
         logger.debug(f"Site Group {site_group_name} already exists.")
 
     return sitegroup_id
 
 
-def validate_rf_template(rf_template_name: str, address: str, api: API, config: Config) -> str:
+def validate_rf_template(rf_template_name: str, address: str, api: API, config: Config,
+                         rf_templates: OrgObjectCache, geocodes: GeocodeCache) -> str:
     """Validate if an RF template exists and creates a barebone one if not."""
     logger.debug(f"Validating if the following rf tempalte exists: {rf_template_name}")
-    rf_templates = api.get(f"orgs/{config.data['org_id']}/rftemplates")
-    rf_template_id = None
-
-    rf_template_exists = False
-    for rf_template in rf_templates:
-        if rf_template_name == rf_template['name']:
-            rf_template_exists = True
-            rf_template_id = rf_template['id']
-            break
+    rf_template_id = rf_templates.get_id(rf_template_name)
 
-    if rf_template_exists is False:
+    if rf_template_id is None:
         logger.debug(f"RF Template {rf_template_name} does not exist. Creating site group...")
         create_new_rf_template_body = {}
         create_new_rf_template_body['name'] = rf_template_name
-        try:
-            glocation = geocoder.google(address, key=config.data['google_api_key'])
-        except Exception:
-            raise
-        create_new_rf_template_body['country_code'] = glocation.country
+        create_new_rf_template_body['country_code'] = geocodes.resolve(address)['country']
         response_post = api.post(
             f"orgs/{config.data['org_id']}/rftemplates", create_new_rf_template_body)
+        if response_post is None:
+            raise ValueError(f"RF Template {rf_template_name} could not be created")
         rf_template_id = response_post['id']
+        rf_templates.add(rf_template_name, rf_template_id)
     else:
         logger.debug(f"RF Template {rf_template_name} already exists.")
 
     return rf_template_id
 
 
-def main():
-    """Create Mist sites based on CSV list."""
-    config, site_list = script_args_parser()
-    api = API(config)
+@traced()
+def resolve_dependencies(site_list: list, api: API, config: Config, geocodes: GeocodeCache) -> (dict, dict, set, dict):
+    """Resolve once everything the sites depend on (first stage of the pipeline).
+
+    Every new address is geocoded, then each unique site group and RF template is looked up
+    (and created if needed), and the names of the existing sites are retreived. A site group or
+    RF template that cannot be resolved does not stop the run: the sites using it fail.
 
+    Returns:
+        The site group IDs and RF template IDs keyed by name, the set of existing site names,
+        and the error of each ('site_group' or 'rf_template', name) that could not be resolved
+    """
+    # Geocode every new address up front, so the geocoder is not on the path of each site
+    with span('geocode', addresses=len(site_list)):
+        geocodes.pre_resolve(site['site_address'] for site in site_list)
+
+    site_groups = OrgObjectCache('sitegroups', api, config)
+    rf_templates = OrgObjectCache('rftemplates', api, config)
+    sitegroup_ids = {}
+    rf_template_ids = {}
+    errors = {}
     for site in site_list:
-        logger.debug(f"Adding following site: {site['site_name']}")
+        if site['site_group'] not in sitegroup_ids:
+            with span('site group', name=site['site_group']):
+                try:
+                    sitegroup_ids[site['site_group']] = validate_site_group(site['site_group'], api, config, site_groups)
+                except Exception as e:
+                    logger.error(f"Site Group {site['site_group']} not resolved: {e!r}")
+                    sitegroup_ids[site['site_group']] = None
+                    errors[('site_group', site['site_group'])] = f"Site Group {site['site_group']}: {e!r}"
+        if site['rf_template'] not in rf_template_ids:
+            with span('rf template', name=site['rf_template']):
+                try:
+                    rf_template_ids[site['rf_template']] = validate_rf_template(
+                        site['rf_template'], site['site_address'], api, config, rf_templates, geocodes)
+                except Exception as e:
+                    logger.error(f"RF Template {site['rf_template']} not resolved: {e!r}")
+                    rf_template_ids[site['rf_template']] = None
+                    errors[('rf_template', site['rf_template'])] = f"RF Template {site['rf_template']}: {e!r}"
+
+    with span('existing sites'):
+        existing_sites = {site['name'] for site in api.get(f"orgs/{config.data['org_id']}/sites")}
+    return sitegroup_ids, rf_template_ids, existing_sites, errors
+
+
+@traced()
+def create_site(site: dict, api: API, config: Config, geocodes: GeocodeCache,
+                sitegroup_id: str, rf_template_id: str) -> dict:
+    """Create a new site on the Mist Cloud with a single POST call.
+
+    The location comes from the geocode cache filled by resolve_dependencies().
+
+    Returns:
+        A dict describing the result of the creation (status, site id, latency)
+    """
+    start_time = time.time()
+    location = geocodes.resolve(site['site_address'])
+    site_body = {}
+    site_body['name'] = site['site_name']
+    site_body['timezone'] = location.get('timezone')
+    site_body['country_code'] = location.get('country')
+    site_body['address'] = site['site_address']
+    site_body['latlng'] = {'lat': location.get('lat'), 'lng': location.get('lng')}
+    site_body['rftemplate_id'] = rf_template_id
+    site_body['sitegroup_ids'] = [sitegroup_id]
+
+    response_new_site = api.post(f"orgs/{config.data['org_id']}/sites", site_body)
+    latency = time.time() - start_time
+    if response_new_site is None:
+        return {'status': 'error', 'site_id': '', 'latency': latency,
+                'error': 'Site not created: the API call failed (see the log)'}
+    return {'status': 'created', 'site_id': response_new_site['id'], 'latency': latency}
 
-        # Validate that the Site Group exists
-        sitegroup_ids = []
-        sitegroup_id = validate_site_group(site['site_group'], api, config)
-        sitegroup_ids.append(sitegroup_id)
 
-        # Validate that the RF template exists
-        rf_template_id = validate_rf_template(
-            site['rf_template'], site['site_address'], api, config)
+def create_sites(site_list: list, api: API, config: Config, geocodes: GeocodeCache, journal: Journal, args):
+    """Run the two stages of the pipeline and write the result of each site to the report."""
+    # Stage 1: resolve the site groups, RF templates and geocodes shared by the sites
+    stage_start = time.time()
+    sitegroup_ids, rf_template_ids, existing_sites, errors = resolve_dependencies(site_list, api, config, geocodes)
+    logger.info(f"Dependencies resolved in {round(time.time() - stage_start, 2)} sec\t"
+                f"Site Groups: {len(sitegroup_ids)}\tRF Templates: {len(rf_template_ids)}")
 
-        # Create the new site
-        new_site = Site(site['site_name'], site['site_address'],
-                        api, config, rf_template_id=rf_template_id, sitegroup_ids=sitegroup_ids)
-        new_site.create()
+    # Stage 2: create the sites in parallel, streaming each result to the report
+    nb_done = 0
+    with open(args.report, mode='w') as report_file, \
+            ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor, \
+            span('create sites', sites=len(site_list)):
+        report = csv.writer(report_file)
+        report.writerow(['site_name', 'status', 'site_id', 'latency_sec', 'error'])
+
+        futures = {}
+        for site in site_list:
+            if site['site_name'] in existing_sites:
+                logger.info(f"Site already exists:\t{site['site_name']}")
+                report.writerow([site['site_name'], 'exists', '', 0, ''])
+                if journal:
+                    journal.record(site, {'status': 'exists'})
+                continue
+            # Sites whose site group or RF template could not be resolved are not created
+            dependency_errors = [errors[key] for key in (('site_group', site['site_group']),
+                                                         ('rf_template', site['rf_template'])) if key in errors]
+            if dependency_errors:
+                logger.info(f"Site error:\t{site['site_name']}\t{'; '.join(dependency_errors)}")
+                report.writerow([site['site_name'], 'error', '', 0, '; '.join(dependency_errors)])
+                continue
+            existing_sites.add(site['site_name'])
+            futures[executor.submit(create_site, site, api, config, geocodes,
+                                    sitegroup_ids[site['site_group']], rf_template_ids[site['rf_template']])] = site
+
+        for future in as_completed(futures):
+            site = futures[future]
+            try:
+                result = future.result()
+                error = result.get('error', '')
+            except Exception as e:
+                result = {'status': 'error', 'site_id': '', 'latency': 0}
+                error = repr(e)
+            if journal and result['status'] == 'created':
+                journal.record(site, {'status': 'created', 'site_id': result['site_id']})
+            nb_done += 1
+            report.writerow([site['site_name'], result['status'], result['site_id'],
+                             round(result['latency'], 3), error])
+            report_file.flush()
+            logger.info(f"[{nb_done}/{len(futures)}] Site {result['status']}:\t{site['site_name']}\t"
+                        f"ID: {result['site_id']}\t{round(result['latency'], 2)} sec")
+
+    logger.info(f"Report written to {args.report}")
+
+
+def main():
+    """Create Mist sites based on CSV list."""
+    config, site_list, geocodes, journal, args = script_args_parser()
 
-    api.__exit__()
+    # Rows completed by a previous run are skipped without any API call
+    pending_sites = journal.pending(site_list) if journal else site_list
+    if len(pending_sites) < len(site_list):
+        logger.info(f"Skipping {len(site_list) - len(pending_sites)} site(s) already completed (journal)")
+    if not pending_sites:
+        logger.info("Nothing left to do")
+        if journal:
+            journal.close()
+        return
+    site_list = pending_sites
+    with span('api token'):
+        api = API(config)
 
+    try:
+        create_sites(site_list, api, config, geocodes, journal, args)
+    finally:
+        if journal:
+            journal.close()
+        # Delete the temporary token whatever stopped the run
+        with span('api token delete'):
+            api.__exit__()
 
 if __name__ == '__main__':
     start_time = time.time()
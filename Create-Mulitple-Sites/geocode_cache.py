@@ -0,0 +1,150 @@
+"""Persistent cache of the geocoding results used to create sites and RF templates.
+
+Results are appended to a JSON-lines file keyed on the normalized address, so an address
+resolved by a previous run is not sent to the geocoder again until its entry expires. Failed
+lookups are never saved, and the file is rewritten when expired or duplicate lines dominate.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import geocoder
+import requests
+
+from semfio_mist import logger
+
+
+class GeocodeError(Exception):
+    """Raised when an address could not be geocoded."""
+
+
+def normalize_address(address: str) -> str:
+    """Return the cache key of an address (case, spacing and punctuation insensitive)."""
+    address = re.sub(r"[\s,]+", " ", address.lower())
+    return address.strip(" .")
+
+
+def google_resolver(google_api_key: str):
+    """Return a resolver using the Google geocoding and timezone APIs.
+
+    The resolver returns the country code, latitude, longitude and timezone of an address, and
+    raises GeocodeError when Google does not return them (unknown address, OVER_QUERY_LIMIT...).
+    """
+    def resolve(address: str) -> dict:
+        glocation = geocoder.google(address, key=google_api_key)
+        if not glocation.ok:
+            raise GeocodeError(f"Address not geocoded: {address} ({glocation.status})")
+        gtimezone_url = f"https://maps.googleapis.com/maps/api/timezone/json?location={glocation.lat},{glocation.lng}&timestamp={int(time.time())}&key={google_api_key}"
+        gtimezone_data = requests.get(url=gtimezone_url).json()
+        if not gtimezone_data.get('timeZoneId'):
+            raise GeocodeError(f"Timezone not found: {address} ({gtimezone_data.get('status')})")
+        return {'country': glocation.country, 'lat': glocation.lat, 'lng': glocation.lng,
+                'timezone': gtimezone_data['timeZoneId']}
+    return resolve
+
+
+def stub_resolver(filename: str):
+    """Return a resolver answering from a local JSON file instead of the Google APIs.
+
+    The file maps each address to its 'country', 'lat', 'lng' and 'timezone'. Used to run the
+    script without a Google API key (tests, benchmarks).
+    """
+    with open(filename) as stub_file:
+        locations = {normalize_address(address): location for address, location in json.load(stub_file).items()}
+
+    def resolve(address: str) -> dict:
+        return locations[normalize_address(address)]
+    return resolve
+
+
+class GeocodeCache:
+    """Geocoding results cache persisted to a JSON-lines file.
+
+    Attributes:
+        filename: str name of the JSON-lines file
+        ttl: float number of seconds an entry stays valid
+        resolver: function called with an address when it is not in the cache
+        entries: dict of the valid entries keyed on the normalized address
+    """
+
+    def __init__(self, resolver, filename: str = "geocode-cache.jsonl", ttl_days: float = 30):
+        """Initialize the cache and load the entries that have not expired yet."""
+        self.filename = filename
+        self.ttl = ttl_days * 24 * 3600
+        self.resolver = resolver
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        nb_lines = 0
+        if os.path.exists(filename):
+            with open(filename) as cache_file:
+                for line in cache_file:
+                    nb_lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if time.time() - entry['resolved_at'] < self.ttl:
+                        self.entries[entry['address']] = entry
+        logger.debug(f"Geocode cache loaded: {len(self.entries)} address(es) from {filename}")
+        # The file is only appended to: rewrite it when most of its lines are expired or duplicates
+        if nb_lines > 2 * len(self.entries) + 100:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the file with the valid entries only."""
+        temporary_filename = f"{self.filename}.tmp"
+        with self.lock:
+            with open(temporary_filename, mode='w') as cache_file:
+                for entry in self.entries.values():
+                    cache_file.write(json.dumps(entry) + "\n")
+            os.replace(temporary_filename, self.filename)
+        logger.debug(f"Geocode cache compacted: {len(self.entries)} address(es) kept in {self.filename}")
+
+    def get(self, address: str) -> dict:
+        """Return the cached location of an address, None if it is not cached (or expired)."""
+        entry = self.entries.get(normalize_address(address))
+        if entry and time.time() - entry['resolved_at'] < self.ttl:
+            return entry
+        return None
+
+    def resolve(self, address: str) -> dict:
+        """Return the location of an address, calling the resolver if it is not cached.
+
+        Raises GeocodeError (or the error of the resolver) when the address cannot be resolved,
+        nothing is saved in that case so the address is looked up again next time.
+        """
+        entry = self.get(address)
+        if entry:
+            return entry
+
+        logger.debug(f"Geocoding address: {address}")
+        entry = dict(self.resolver(address))
+        entry['address'] = normalize_address(address)
+        entry['resolved_at'] = time.time()
+        with self.lock:
+            self.entries[entry['address']] = entry
+            with open(self.filename, mode='a') as cache_file:
+                cache_file.write(json.dumps(entry) + "\n")
+        return entry
+
+    def pre_resolve(self, addresses, workers: int = 8):
+        """Resolve every unique address that is not cached yet, several at a time.
+
+        An address that fails is logged and left out of the cache, the sites using it fail when created.
+        """
+        missing = {normalize_address(address): address for address in addresses if self.get(address) is None}
+        if not missing:
+            return
+        logger.info(f"Geocoding {len(missing)} new address(es)...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self.resolve, address): address for address in missing.values()}
+        for future, address in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Geocoding failed for {address}: {e}")
@@ -1,11 +1,21 @@
 import argparse
+import operator
+import os
+import re
+import sys
 import time
 import json
 import requests
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pprint import pprint
 from tabulate import tabulate
 from datetime import datetime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from mist_http_cache import OfflineError, add_cache_arguments, install_cache  # noqa: E402
+from mist_metrics import add_metrics_arguments, install_metrics  # noqa: E402
+
 
 def humanbytes(B):
     """
@@ -40,58 +50,396 @@ def uptime(time_in_sec):
     return (str(uptime_days) + "d " + str(uptime_hours) + "h " + str(uptime_minutes) + "m")
 
 
-def main():
+HEADERS = ['AP Name', 'AP Model', 'Up Time', 'Last Seen', 'Tx Bps', 'Rx Bps',
+           'Eth0 Speed', 'Eth0 Tx', 'Eth0 Rx', 'Eth0 Errors']
+UNITS = np.array(['B', 'KB', 'MB', 'GB', 'TB'])
+# String ufuncs of NumPy 2 (much faster than the np.char functions they replace)
+strings = getattr(np, 'strings', np.char)
+
+
+def humanbytes_array(B):
     """
-    Script to find out the speed of an Eth0 port
+    Vectorized humanbytes(): return an array of bytes as human friendly KB, MB, GB, or TB strings
     """
-    parser = argparse.ArgumentParser(description='Configures a Mist AP for an APoS site survey')
-    parser.add_argument('config', metavar='config_file', type=argparse.FileType(
-        'r'), help='file containing all the configuration information')
-    args = parser.parse_args()
-    configs = json.load(args.config)
+    B = np.asarray(B, dtype=np.int64)
+    # Index of the unit of each value (0 = B ... 4 = TB), from the number of 1024 powers it holds
+    exponents = np.zeros(B.shape, dtype=np.int64)
+    for exponent in range(1, len(UNITS)):
+        exponents += B >= 1024 ** exponent
+    divisors = np.int64(1024) ** exponents
+    # Value in hundredths of the unit with integer math, rounded half to even like '{0:.2f}'
+    cents, remainders = np.divmod(B * 100, divisors)
+    cents += (2 * remainders > divisors) | ((2 * remainders == divisors) & (cents % 2 == 1))
+    scaled = strings.add(strings.add((cents // 100).astype(str), '.'), strings.zfill((cents % 100).astype(str), 2))
+    return np.where(exponents == 0,
+                    strings.add(B.astype(str), '.0 B'),
+                    strings.add(strings.add(scaled, ' '), UNITS[exponents]))
+
+
+def uptime_array(time_in_sec):
+    """
+    Vectorized uptime(): return an array of human friendly times expressed in days, hours and minutes
+    """
+    time_in_sec = np.asarray(time_in_sec, dtype=np.int64)
+    uptime_days, remainder = np.divmod(time_in_sec, 24 * 3600)
+    uptime_hours, remainder = np.divmod(remainder, 3600)
+    uptime_minutes = remainder // 60
+    return strings.add(strings.add(strings.add(strings.add(strings.add(
+        uptime_days.astype(str), 'd '), uptime_hours.astype(str)), 'h '), uptime_minutes.astype(str)), 'm')
+
+
+def time_of_day_array(timestamps):
+    """
+    Vectorized datetime.fromtimestamp(timestamp).time(): return an array of local times of day as strings
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    # The UTC offset only changes on the hour: look it up once per distinct hour
+    hours, hour_index = np.unique(timestamps // 3600, return_inverse=True)
+    offsets = np.array([time.localtime(hour * 3600).tm_gmtoff for hour in hours], dtype=np.float64)
+    seconds, microseconds = np.divmod(np.round((timestamps + offsets[hour_index.ravel()]) * 1e6), 1e6)
+    seconds = seconds.astype(np.int64) % (24 * 3600)
+    times = strings.zfill((seconds // 3600).astype(str), 2)
+    for field in (seconds % 3600 // 60, seconds % 60):
+        times = strings.add(strings.add(times, ':'), strings.zfill(field.astype(str), 2))
+    return np.where(microseconds == 0, times, strings.add(strings.add(times, '.'), strings.zfill(
+        microseconds.astype(np.int64).astype(str), 6)))
+
+
+def number_column(values, count):
+    """
+    Load numbers into a float NumPy array, NaN where a value is missing
+    """
+    return np.fromiter((np.nan if value is None else value for value in values), dtype=np.float64, count=count)
+
+
+def load_eth_stats(devices):
+    """
+    Load the stats of a list of devices into NumPy arrays (one array per column)
+
+    Disconnected APs do not report their uptime, throughput or eth0 stats: these values are NaN
+    ("no data"), so they never match a filter on them. Devices other than APs are skipped.
+
+    Parameters:
+        - devices: List of the device stats returned by the Mist API
+
+    Returns:
+        - Dictionary of NumPy arrays
+    """
+    devices = [device for device in devices if device.get('type', 'ap') == 'ap']
+    count = len(devices)
+    eth0_stats = [(device.get('port_stat') or {}).get('eth0') or {} for device in devices]
+    return {
+        'name': np.array([device.get('name') or device.get('mac', '') for device in devices], dtype=str),
+        'model': np.array([device.get('model', '') for device in devices], dtype=str),
+        'uptime': number_column((device.get('uptime') for device in devices), count),
+        'last_seen': number_column((device.get('last_seen') for device in devices), count),
+        'tx_bps': number_column((device.get('tx_bps') for device in devices), count),
+        'rx_bps': number_column((device.get('rx_bps') for device in devices), count),
+        'eth0_speed': number_column((eth0.get('speed') for eth0 in eth0_stats), count),
+        'eth0_tx_bytes': number_column((eth0.get('tx_bytes') for eth0 in eth0_stats), count),
+        'eth0_rx_bytes': number_column((eth0.get('rx_bytes') for eth0 in eth0_stats), count),
+        'eth0_rx_errors': number_column((eth0.get('rx_errors') for eth0 in eth0_stats), count),
+    }
+
+
+def integer_array(values):
+    return np.asarray(values, dtype=np.int64).astype(str)
+
+
+def format_column(formatter, values):
+    """
+    Format a column of numbers with a vectorized formatter, 'N/A' where there is no data
+    """
+    missing = np.isnan(values)
+    formatted = formatter(np.where(missing, 0, values))
+    return np.where(missing, 'N/A', formatted) if missing.any() else formatted
+
+
+def format_eth_stats(stats):
+    """
+    Compute the human friendly strings of every column at once
+
+    Parameters:
+        - stats: Dictionary of NumPy arrays returned by load_eth_stats()
+
+    Returns:
+        - List of the string columns of the table, in the HEADERS order
+    """
+    return [stats['name'],
+            stats['model'],
+            format_column(uptime_array, stats['uptime']),
+            format_column(time_of_day_array, stats['last_seen']),
+            format_column(humanbytes_array, stats['tx_bps']),
+            format_column(humanbytes_array, stats['rx_bps']),
+            format_column(integer_array, stats['eth0_speed']),
+            format_column(humanbytes_array, stats['eth0_tx_bytes']),
+            format_column(humanbytes_array, stats['eth0_rx_bytes']),
+            format_column(integer_array, stats['eth0_rx_errors'])]
+
+
+def render_table(headers, columns):
+    """
+    Render string columns as a left aligned plain text table (same layout as tabulate's default format)
+
+    Parameters:
+        - headers: List of the column headers
+        - columns: List of NumPy string arrays (one per column)
+
+    Returns:
+        - The table as a string
+    """
+    # Like tabulate, headers get 2 characters of padding
+    widths = [max(len(header) + 2, int(strings.str_len(column).max(initial=0))) for header, column in zip(headers, columns)]
+    lines = ['  '.join(header.ljust(width) for header, width in zip(headers, widths)),
+             '  '.join('-' * width for width in widths)]
+    if len(columns[0]):
+        rows = strings.ljust(columns[0], widths[0])
+        for column, width in zip(columns[1:], widths[1:]):
+            rows = strings.add(strings.add(rows, '  '), strings.ljust(column, width))
+        lines.extend(rows.tolist())
+    return '\n'.join(lines)
+
+
+# Fields usable in the filter expressions of the org scan, computed from the load_eth_stats() arrays
+FILTER_FIELDS = {
+    'speed': lambda stats, now: stats['eth0_speed'],
+    'rx_errors': lambda stats, now: stats['eth0_rx_errors'],
+    'tx_bytes': lambda stats, now: stats['eth0_tx_bytes'],
+    'rx_bytes': lambda stats, now: stats['eth0_rx_bytes'],
+    'tx_bps': lambda stats, now: stats['tx_bps'],
+    'rx_bps': lambda stats, now: stats['rx_bps'],
+    'uptime': lambda stats, now: stats['uptime'],
+    'last_seen_age': lambda stats, now: now - stats['last_seen'],
+}
+FILTER_OPERATORS = {'<=': operator.le, '>=': operator.ge, '==': operator.eq, '!=': operator.ne,
+                    '<': operator.lt, '>': operator.gt}
+DEFAULT_FILTERS = ['speed<1000', 'rx_errors>0', 'last_seen_age>600']
+
+
+def parse_filter(expression):
+    """
+    Parse a filter expression such as 'speed<1000' or 'rx_errors>0'
+
+    Parameters:
+        - expression: String '<field><operator><number>' (see FILTER_FIELDS and FILTER_OPERATORS)
+
+    Returns:
+        - Tuple (expression, field, operator function, value)
+    """
+    match = re.fullmatch(r"\s*(\w+)\s*(<=|>=|==|!=|<|>)\s*(-?[\d.]+)\s*", expression)
+    if not match or match.group(1) not in FILTER_FIELDS:
+        raise argparse.ArgumentTypeError(
+            f"invalid filter '{expression}' (fields: {', '.join(FILTER_FIELDS)}; operators: < <= > >= == !=)")
+    return (expression.strip(), match.group(1), FILTER_OPERATORS[match.group(2)], float(match.group(3)))
 
+
+def filter_mask(stats, filters, now=None):
+    """
+    Returns the boolean array of the devices matching at least one of the filters
+    """
+    now = time.time() if now is None else now
+    mask = np.zeros(len(stats['name']), dtype=bool)
+    for _, field, compare, value in filters:
+        mask |= compare(FILTER_FIELDS[field](stats, now), value)
+    return mask
+
+
+def get_org_sites(configs, session):
+    """
+    This function retreive all sites of the Mist organization
+    API Call Used: GET https://api.mist.com/api/v1/orgs/:org_id/sites
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - session: requests.Session used for the API call
+
+    Returns:
+        - A list of sites (dictionaries)
+    """
+    api_url = f"{configs['api']['mist_url']}orgs/{configs['api']['org_id']}/sites"
+    response = session.get(api_url)
+
+    if response.status_code == 200:
+        return json.loads(response.content.decode('utf-8'))
+    print(f"Something went wrong: {response.status_code}")
+    return []
+
+
+def get_site_devices(configs, session, site_id):
+    """
+    This function retreive the stats of the APs of a site
+    API Call Used: GET https://api.mist.com/api/v1/sites/:site_id/stats/devices
+
+    Returns:
+        - A list of device stats, None if the call failed
+    """
+    api_url = f"{configs['api']['mist_url']}sites/{site_id}/stats/devices"
+    response = session.get(api_url)
+
+    if response.status_code == 200:
+        return json.loads(response.content.decode('utf-8'))
+    print(f"Something went wrong: {response.status_code} - stats of site {site_id} not retreived")
+    return None
+
+
+def scan_org(configs, filters, workers=8):
+    """
+    This function scans the APs of every site of the organization and prints the ones matching a filter
+
+    The stats of 'workers' sites are downloaded at the same time. Each site is filtered and printed
+    as soon as its stats arrive, then dropped, so the memory used does not grow with the number of sites.
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - filters: List of filters returned by parse_filter() (an AP is printed if it matches any of them)
+        - workers: Maximum number of sites downloaded at the same time (Default = 8)
+
+    Returns:
+        - The number of APs scanned and the number of APs matching a filter
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Content-Type': 'application/json',
+                            'Authorization': 'Token {}'.format(configs['api']['token'])})
+
+    sites = iter(get_org_sites(configs, session))
+    print(f"Filters: {' OR '.join(expression for expression, _, _, _ in filters)}\n")
+    nb_aps = 0
+    nb_matches = 0
+    failed_sites = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Only 2 sites per worker are in flight, the next site is submitted when one completes
+        in_flight = {}
+        for site in sites:
+            in_flight[executor.submit(get_site_devices, configs, session, site['id'])] = site
+            if len(in_flight) >= 2 * workers:
+                break
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                site = in_flight.pop(future)
+                next_site = next(sites, None)
+                if next_site:
+                    in_flight[executor.submit(get_site_devices, configs, session, next_site['id'])] = next_site
+
+                try:
+                    devices = future.result()
+                except requests.RequestException as error:
+                    print(f"Something went wrong: {error} - stats of site {site['name']} not retreived")
+                    devices = None
+                if devices is None:
+                    failed_sites.append(site['name'])
+                    continue
+                if not devices:
+                    continue
+                stats = load_eth_stats(devices)
+                mask = filter_mask(stats, filters)
+                nb_aps += len(stats['name'])
+                nb_matches += int(mask.sum())
+                if mask.any():
+                    print(f"== {site['name']}: {int(mask.sum())}/{len(stats['name'])} APs")
+                    matches = {column: values[mask] for column, values in stats.items()}
+                    print(render_table(HEADERS, format_eth_stats(matches)) + "\n")
+
+    session.close()
+    print(f"APs scanned: {nb_aps}\tAPs matching a filter: {nb_matches}")
+    if failed_sites:
+        print(f"Sites not scanned ({len(failed_sites)}): {', '.join(failed_sites)}")
+    return nb_aps, nb_matches
+
+
+def format_eth_stats_rows(devices):
+    """
+    Format the stats of a list of devices one device at a time
+
+    Parameters:
+        - devices: List of the device stats returned by the Mist API
+
+    Returns:
+        - List of the rows of the table
+    """
+    aps_eth_stats = []
+    # Loop on each APs
+    for device in devices:
+        # Loading relevant AP stats into a dictionary
+        aps_eth_stats.append([
+            device['name'],
+            device['model'],
+            uptime(int(device['uptime'])),
+            datetime.fromtimestamp(device['last_seen']).time(),
+            humanbytes(int(device['tx_bps'])),
+            humanbytes(int(device['rx_bps'])),
+            device['port_stat']['eth0']['speed'],
+            humanbytes(int(device['port_stat']['eth0']['tx_bytes'])),
+            humanbytes(int(device['port_stat']['eth0']['rx_bytes'])),
+            device['port_stat']['eth0']['rx_errors']
+        ])
+    return aps_eth_stats
+
+
+def print_site_eth_stats(configs, columnar=False):
+    """
+    This function prints the eth0 stats of the APs of the site of the config file
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - columnar: Format the stats with the columnar (NumPy) path (Default = False)
+    """
     # GET /api/v1/sites/:site_id/stats/devices
     api_url = f"{configs['api']['mist_url']}sites/{configs['site']['id']}/stats/devices"
     headers = {'Content-Type': 'application/json',
                'Authorization': 'Token {}'.format(configs['api']['token'])}
     response = requests.get(api_url, headers=headers)
 
-    aps_eth_stats = []
     if response.status_code == 200:
         devices = json.loads(response.content.decode('utf-8'))
-        # Loop on each APs
-        for device in devices:
-            # Loading relevant AP stats into a dictionary
-            aps_eth_stats.append([
-                device['name'],
-                device['model'],
-                uptime(int(device['uptime'])),
-                datetime.fromtimestamp(device['last_seen']).time(),
-                humanbytes(int(device['tx_bps'])),
-                humanbytes(int(device['rx_bps'])),
-                device['port_stat']['eth0']['speed'],
-                humanbytes(int(device['port_stat']['eth0']['tx_bytes'])),
-                humanbytes(int(device['port_stat']['eth0']['rx_bytes'])),
-                device['port_stat']['eth0']['rx_errors']
-            ])
-        # Print the AP stats in a table fashion
-        print(tabulate(aps_eth_stats,
-                       headers=[
-                           'AP Name',
-                           'AP Model',
-                           'Up Time',
-                           'Last Seen',
-                           'Tx Bps',
-                           'Rx Bps',
-                           'Eth0 Speed',
-                           'Eth0 Tx',
-                           'Eth0 Rx',
-                           'Eth0 Errors'],
-                       numalign="left"))
+        if columnar:
+            print(render_table(HEADERS, format_eth_stats(load_eth_stats(devices))))
+        else:
+            # Print the AP stats in a table fashion
+            print(tabulate(format_eth_stats_rows(devices), headers=HEADERS, numalign="left"))
     else:
         print('Something went wrong: {}'.format(response.status_code))
 
 
+def main():
+    """
+    Script to find out the speed of an Eth0 port
+    """
+    parser = argparse.ArgumentParser(description='Configures a Mist AP for an APoS site survey')
+    parser.add_argument('config', metavar='config_file', type=argparse.FileType(
+        'r'), help='file containing all the configuration information')
+    parser.add_argument('-c', '--columnar', action='store_true',
+                        help='format the stats column by column with NumPy (faster for thousands of APs)')
+    parser.add_argument('-o', '--org', action='store_true',
+                        help='scan every site of the organization and only print the APs matching a filter')
+    parser.add_argument('-f', '--filter', dest='filters', metavar='expression', type=parse_filter, action='append',
+                        help=f"filter of the org scan, ex: 'speed<1000' (repeatable, an AP matching any filter is "
+                             f"printed; fields: {', '.join(FILTER_FIELDS)}; Default = {' '.join(DEFAULT_FILTERS)})")
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help='number of sites downloaded at the same time by the org scan (Default = 8)')
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    configs = json.load(args.config)
+    cache = install_cache(args)
+    install_metrics(args)
+
+    try:
+        if args.org:
+            scan_org(configs, args.filters or [parse_filter(expression) for expression in DEFAULT_FILTERS],
+                     max(1, args.workers))
+        else:
+            print_site_eth_stats(configs, args.columnar)
+    except OfflineError as e:
+        print(f"Something went wrong: {e}")
+
+    if cache:
+        print(f"\n{cache.summary()}")
+
+
 if __name__ == '__main__':
     start_time = time.time()
     print('** Getting Eth0 Stats...\n')
@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of the per-row and columnar formatting of ap-eth0-stats.py
+
+Synthetic device stats are formatted with both implementations (no API call is made):
+    - per-row: format_eth_stats_rows() + tabulate, as the script does by default
+    - columnar: load_eth_stats() + format_eth_stats() + render_table(), as with --columnar
+
+Both tables are compared line by line before the timings are printed.
+
+Usage: python bench-eth0-stats.py [-n 1000 10000 50000] [-r 3]
+"""
+
+import argparse
+import os
+import random
+import runpy
+import time
+from tabulate import tabulate
+
+
+def synthetic_devices(nb_devices, seed=0):
+    """
+    Returns a list of device stats shaped like the GET sites/:site_id/stats/devices response
+    """
+    rng = random.Random(seed)
+    now = int(time.time())
+    return [{'name': f"AP-{i:05d}",
+             'model': rng.choice(['AP12', 'AP32', 'AP33', 'AP43', 'AP45']),
+             'uptime': rng.randrange(0, 90 * 24 * 3600),
+             'last_seen': now - rng.randrange(0, 600),
+             'tx_bps': rng.choice([0, rng.randrange(0, 1024), rng.randrange(0, 10 ** 9)]),
+             'rx_bps': rng.randrange(0, 10 ** 8),
+             'port_stat': {'eth0': {'speed': rng.choice([100, 1000, 2500]),
+                                    'tx_bytes': rng.randrange(0, 10 ** 13),
+                                    'rx_bytes': rng.randrange(0, 10 ** 14),
+                                    'rx_errors': rng.randrange(0, 50)}}}
+            for i in range(nb_devices)]
+
+
+def best_time(function, repeat):
+    """
+    Returns the result of function() and the best of 'repeat' run times
+    """
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start_time)
+    return result, min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the formatting of ap-eth0-stats.py')
+    parser.add_argument('-n', '--devices', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='numbers of devices formatted (Default = 1000 10000 50000)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per measure, the best one is kept (Default = 3)')
+    args = parser.parse_args()
+
+    script = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ap-eth0-stats.py'))
+
+    print(f"{'Devices':>8}  {'Per-row format':>15}  {'+ tabulate':>11}  {'Columnar format':>16}  {'+ render':>9}  {'Speedup':>8}")
+    for nb_devices in args.devices:
+        devices = synthetic_devices(nb_devices)
+
+        rows, row_format_time = best_time(lambda: script['format_eth_stats_rows'](devices), args.repeat)
+        row_table, row_render_time = best_time(
+            lambda: tabulate(rows, headers=script['HEADERS'], numalign="left"), args.repeat)
+
+        columns, column_format_time = best_time(
+            lambda: script['format_eth_stats'](script['load_eth_stats'](devices)), args.repeat)
+        column_table, column_render_time = best_time(
+            lambda: script['render_table'](script['HEADERS'], columns), args.repeat)
+
+        if [line.rstrip() for line in row_table.splitlines()] != [line.rstrip() for line in column_table.splitlines()]:
+            raise AssertionError(f"The columnar table differs from the per-row table ({nb_devices} devices)")
+
+        row_time = row_format_time + row_render_time
+        column_time = column_format_time + column_render_time
+        print(f"{nb_devices:>8}  {row_format_time:>13.3f} s  {row_time:>9.3f} s  "
+              f"{column_format_time:>14.3f} s  {column_time:>7.3f} s  {row_time / column_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -8,45 +8,100 @@ All the configuration details are coming from the 'config.json' file
 
 
 import argparse
+import os
+import sys
 import time
 import json
 import requests
 import csv
-from tabulate import tabulate
-from pprint import pprint
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from mist_http_cache import OfflineError, add_cache_arguments, install_cache  # noqa: E402
+from mist_metrics import add_metrics_arguments, install_metrics  # noqa: E402
 
-def export_ap_rf_congs_to_file(aps_rf_configs):
+
+CSV_HEADER = ['AP Name', 'AP Model', 'MAC Address', 'IP Address', '2.4GHz Channel',
+              '2.4GHz Tx Power', '5GHz Channel', '5GHz Channel Width', '5GHz Tx Power']
+
+
+def ap_rf_config_row(ap):
+    """
+    This function converts the RF configs of an AP into a CSV row
+
+    Parameters:
+        - ap: Dictionary of the AP configs (as built by parse_ap_rf_config)
+
+    Returns:
+        - A list of the CSV columns for this AP
+    """
+    if ap['status'] == "connected":
+        return [ap['name'], ap['model'], ap['mac'], ap['ip'],
+                ap['band_24']['channel'],
+                str(ap['band_24']['power']) + "dBm",
+                ap['band_5']['channel'],
+                str(ap['band_5']['bandwidth']) + "MHz",
+                str(ap['band_5']['power']) + "dBm"]
+    return [ap['name'], ap['model'], ap['mac'], "N/A",
+            "N/A", "N/A", "N/A", "N/A", "N/A"]
+
+
+def export_ap_rf_congs_to_file(aps_rf_configs_pages, filename='ap-rf-config.csv'):
     """
     This function export the AP RF configs into a csv File
 
+    The rows are written page by page and the file is flushed after each page, so rows
+    reach the disk while the next pages are still being downloaded.
+
     Parameters:
-        - aps_rf_configs: Dictionary of all AP configs
+        - aps_rf_configs_pages: Iterable of lists of AP configs (one list per API page)
+        - filename: Name of the CSV file (Default = 'ap-rf-config.csv')
     """
     ap_count = 0
-    with open('ap-rf-config.csv', mode='w') as config_file:
+    with open(filename, mode='w') as config_file:
         config_writer = csv.writer(config_file, delimiter=',',
                                    quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        config_writer.writerow(['AP Name', 'AP Model', 'MAC Address', 'IP Address', '2.4GHz Channel',
-                                '2.4GHz Tx Power', '5GHz Channel', '5GHz Channel Width', '5GHz Tx Power'])
-
-        for ap in aps_rf_configs:
-            ap_count += 1
-            pprint(ap)
-            if ap['status'] == "connected":
-                config_writer.writerow([ap['name'], ap['model'], ap['mac'], ap['ip'],
-                                        ap['band_24']['channel'],
-                                        str(ap['band_24']['power']) + "dBm",
-                                        ap['band_5']['channel'],
-                                        str(ap['band_5']['bandwidth']) + "MHz",
-                                        str(ap['band_5']['power']) + "dBm"])
-            else:
-                config_writer.writerow([ap['name'], ap['model'], ap['mac'], "N/A",
-                                        "N/A", "N/A", "N/A", "N/A", "N/A"])
+        config_writer.writerow(CSV_HEADER)
+
+        for aps_rf_configs in aps_rf_configs_pages:
+            for ap in aps_rf_configs:
+                ap_count += 1
+                config_writer.writerow(ap_rf_config_row(ap))
+            config_file.flush()
 
     print(f"* AP RF configuration exported!\t\tNb of APs: {ap_count}")
 
 
+def parse_ap_rf_config(device):
+    """
+    This function extracts the RF configs of an AP from its device stats
+
+    Parameters:
+        - device: Dictionary of the device stats returned by the Mist API
+
+    Returns:
+        - A dictionary containing the AP RF configurations (None if the device is not an AP)
+    """
+    if device['type'] != "ap":
+        return None
+    ap_rf_configs = {}
+    ap_rf_configs['id'] = device['id']
+    ap_rf_configs['name'] = device['name'] if len(device['name']) > 0 else "N/A"
+    ap_rf_configs['model'] = device['model']
+    ap_rf_configs['mac'] = device['mac']
+    ap_rf_configs['status'] = device['status']
+    if device['status'] == "connected":
+        ap_rf_configs['ip'] = device['ip']
+        ap_rf_configs['band_24'] = {"channel": device['radio_stat']['band_24']['channel'],
+                                    "power": device['radio_stat']['band_24']['power']}
+        ap_rf_configs['band_5'] = {"channel": device['radio_stat']['band_5']['channel'],
+                                   "power": device['radio_stat']['band_5']['power'],
+                                   "bandwidth": device['radio_stat']['band_5']['bandwidth']}
+    return ap_rf_configs
+
+
 def get_ap_rf_configs(configs):
     """
     This function retreive the RF Configs of all APs part of a Mist site
@@ -67,22 +122,9 @@ def get_ap_rf_configs(configs):
     devices = json.loads(response.content.decode('utf-8'))
 
     if response.status_code == 200:
-        # print(json.dumps(devices, indent=4, sort_keys=True))
         for device in devices:
-            if device['type'] == "ap":
-                ap_rf_configs = {}
-                ap_rf_configs['id'] = device['id']
-                ap_rf_configs['name'] = device['name'] if len(device['name']) > 0 else "N/A"
-                ap_rf_configs['model'] = device['model']
-                ap_rf_configs['mac'] = device['mac']
-                ap_rf_configs['status'] = device['status']
-                if device['status'] == "connected":
-                    ap_rf_configs['ip'] = device['ip']
-                    ap_rf_configs['band_24'] = {"channel": device['radio_stat']['band_24']['channel'],
-                                                "power": device['radio_stat']['band_24']['power']}
-                    ap_rf_configs['band_5'] = {"channel": device['radio_stat']['band_5']['channel'],
-                                               "power": device['radio_stat']['band_5']['power'],
-                                               "bandwidth": device['radio_stat']['band_5']['bandwidth']}
+            ap_rf_configs = parse_ap_rf_config(device)
+            if ap_rf_configs is not None:
                 aps_rf_configs.append(ap_rf_configs)
     else:
         print(f"Something went wrong: {response.status_code}")
@@ -90,22 +132,238 @@ def get_ap_rf_configs(configs):
     return(aps_rf_configs)
 
 
+def iter_ap_rf_configs_pages(configs, site_id, page_limit=100, session=None):
+    """
+    This function retreive the RF Configs of all APs part of a Mist site, one API page at a time
+    API Call Used: GET https://api.mist.com/api/v1/sites/:site_id/stats/devices?limit=:limit&page=:page
+
+    Only one page of devices is held in memory at any time.
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - site_id: ID of the site to export
+        - page_limit: Number of devices requested per page (Default = 100)
+        - session: requests.Session to reuse between pages (Default = a new session)
+
+    Yields:
+        - A list of AP RF configurations for each page
+    """
+    api_url = f"{configs['api']['mist_url']}sites/{site_id}/stats/devices"
+    headers = {'Content-Type': 'application/json',
+               'Authorization': f"Token {configs['api']['token']}"}
+    session = session or requests.Session()
+
+    page = 1
+    while True:
+        response = session.get(api_url, headers=headers, params={'limit': page_limit, 'page': page})
+        if response.status_code != 200:
+            print(f"Something went wrong: {response.status_code}")
+            return
+        devices = json.loads(response.content.decode('utf-8'))
+
+        aps_rf_configs = []
+        for device in devices:
+            ap_rf_configs = parse_ap_rf_config(device)
+            if ap_rf_configs is not None:
+                aps_rf_configs.append(ap_rf_configs)
+        yield aps_rf_configs
+
+        # Stop on a short page or once the total announced by the API has been reached
+        total = response.headers.get('X-Page-Total')
+        if len(devices) < page_limit or (total is not None and page * page_limit >= int(total)):
+            return
+        page += 1
+
+
+def get_org_sites(configs, session):
+    """
+    This function retreive all sites of the Mist organization
+    API Call Used: GET https://api.mist.com/api/v1/orgs/:org_id/sites
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - session: requests.Session used for the API call
+
+    Returns:
+        - A list of sites (dictionaries)
+    """
+    api_url = f"{configs['api']['mist_url']}orgs/{configs['api']['org_id']}/sites"
+    headers = {'Content-Type': 'application/json',
+               'Authorization': f"Token {configs['api']['token']}"}
+    response = session.get(api_url, headers=headers)
+
+    if response.status_code == 200:
+        return json.loads(response.content.decode('utf-8'))
+    print(f"Something went wrong: {response.status_code}")
+    return []
+
+
+def _put(pages_queue, item, cancel):
+    """
+    Put an item on the queue, giving up if the export is cancelled while the queue is full
+
+    Returns:
+        - False if the export was cancelled
+    """
+    while not cancel.is_set():
+        try:
+            pages_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _export_site(configs, site, page_limit, session, pages_queue, cancel):
+    """
+    This function runs in a worker thread: it pushes the pages of one site onto the queue
+    read by export_org_ap_rf_configs_to_file(), followed by the site latency, or by the
+    exception that stopped it
+    """
+    if cancel.is_set():
+        return
+    start_time = time.time()
+    ap_count = 0
+    try:
+        for aps_rf_configs in iter_ap_rf_configs_pages(configs, site['id'], page_limit, session):
+            ap_count += len(aps_rf_configs)
+            if not _put(pages_queue, ('page', site, aps_rf_configs), cancel):
+                return
+    except Exception as error:
+        _put(pages_queue, ('error', site, error), cancel)
+    else:
+        _put(pages_queue, ('done', site, (ap_count, time.time() - start_time)), cancel)
+
+
+def export_org_ap_rf_configs_to_file(configs, workers=8, page_limit=100, filename='ap-rf-config.csv'):
+    """
+    This function export the AP RF configs of every site of the organization into a single csv File
+
+    Sites are retreived concurrently by a pool of worker threads. Each page is written to the
+    CSV as soon as it arrives (whatever the site), so a slow site does not hold up the others.
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - workers: Number of sites retreived at the same time (Default = 8)
+        - page_limit: Number of devices requested per page (Default = 100)
+        - filename: Name of the CSV file (Default = 'ap-rf-config.csv')
+
+    Returns:
+        - The list of (site name, error) of the sites that failed, their rows may be incomplete
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    sites = get_org_sites(configs, session)
+    # Bounded so that memory stays flat if the CSV writer falls behind the workers
+    pages_queue = queue.Queue(maxsize=workers * 2)
+    # Set if the writer stops, so the workers blocked on the full queue give up instead of deadlocking
+    cancel = threading.Event()
+    site_latencies = []
+    failed_sites = []
+    ap_count = 0
+
+    with open(filename, mode='w') as config_file, ThreadPoolExecutor(max_workers=workers) as executor:
+        config_writer = csv.writer(config_file, delimiter=',',
+                                   quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        config_writer.writerow(['Site Name'] + CSV_HEADER)
+
+        for site in sites:
+            executor.submit(_export_site, configs, site, page_limit, session, pages_queue, cancel)
+
+        nb_sites_done = 0
+        try:
+            while nb_sites_done < len(sites):
+                kind, site, data = pages_queue.get()
+                if kind == 'page':
+                    for ap in data:
+                        config_writer.writerow([site['name']] + ap_rf_config_row(ap))
+                    config_file.flush()
+                elif kind == 'error':
+                    nb_sites_done += 1
+                    failed_sites.append((site['name'], data))
+                    print(f"[{nb_sites_done}/{len(sites)}] {site['name']}\tSomething went wrong: {data!r}")
+                else:
+                    nb_sites_done += 1
+                    site_ap_count, latency = data
+                    ap_count += site_ap_count
+                    site_latencies.append((latency, site['name'], site_ap_count))
+                    print(f"[{nb_sites_done}/{len(sites)}] {site['name']}\tAPs: {site_ap_count}\t{round(latency, 2)} sec")
+        finally:
+            cancel.set()
+
+    session.close()
+    print(f"\n* AP RF configuration exported!\t\tNb of sites: {len(sites)}\tNb of APs: {ap_count}")
+    if site_latencies:
+        print("* Slowest sites:")
+        for latency, site_name, site_ap_count in sorted(site_latencies, reverse=True)[:5]:
+            print(f"\t{site_name}\tAPs: {site_ap_count}\t{round(latency, 2)} sec")
+    if failed_sites:
+        print(f"* Sites that failed ({len(failed_sites)}), their APs may be missing from {filename}:")
+        for site_name, error in failed_sites:
+            print(f"\t{site_name}\t{error!r}")
+    return failed_sites
+
+
+def positive_int(value):
+    """
+    argparse type of the arguments that must be a number greater than 0
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"invalid value '{value}' (must be a whole number greater than 0)")
+    return number
+
+
 def main():
     """
-    This function configures a Mist WLAN profile within a specific site
+    This function exports the RF configurations of all APs of a Mist site into a CSV file
     """
     parser = argparse.ArgumentParser(
-        description='Creates a Mist WLAN profile within a specific site')
+        description='Exports the RF configurations of all APs of a Mist site')
     parser.add_argument('config', metavar='config_file', type=argparse.FileType(
         'r'), help='file containing all the configuration information')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='download the device stats page by page and write the CSV as pages arrive')
+    parser.add_argument('--page-limit', type=positive_int, default=100,
+                        help='number of devices per API page in stream and org mode (Default = 100)')
+    parser.add_argument('-o', '--org', action='store_true',
+                        help='export the APs of every site of the organization into a single CSV file')
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help='number of sites retreived at the same time in org mode (Default = 8)')
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
     configs = json.load(args.config)
+    cache = install_cache(args)
+    install_metrics(args)
+
+    failed_sites = []
+    try:
+        if args.org:
+            # Writing the APs of all the sites of the organization into a single CSV File
+            failed_sites = export_org_ap_rf_configs_to_file(configs, max(1, args.workers), args.page_limit)
+        elif args.stream:
+            # Writing the CSV File while the pages are retreived from Mist
+            export_ap_rf_congs_to_file(iter_ap_rf_configs_pages(configs, configs['site']['id'], args.page_limit))
+        else:
+            # Retreiving the information from Mist (Using an API Call)
+            aps_rf_configs = get_ap_rf_configs(configs)
 
-    # Retreiving the information from Mist (Using an API Call)
-    aps_rf_configs = get_ap_rf_configs(configs)
+            # Exporting all the RF configuration into a CSV File
+            export_ap_rf_congs_to_file([aps_rf_configs])
+    except OfflineError as e:
+        print(f"Something went wrong: {e}")
 
-    # Exporting all the RF configuration into a CSV File
-    export_ap_rf_congs_to_file(aps_rf_configs)
+    if cache:
+        print(f"\n{cache.summary()}")
+    if failed_sites:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
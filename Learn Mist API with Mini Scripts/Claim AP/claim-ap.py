@@ -45,17 +45,94 @@ def claim_ap(configs):
     return()
 
 
+def read_claim_codes(codes_file):
+    """
+    This function reads the claim codes of a file (one claim code per line)
+
+    Parameters:
+        - codes_file: File object of the claim codes file
+
+    Returns:
+        - List of the claim codes (empty lines and lines starting with '#' are ignored)
+    """
+    claim_codes = []
+    for line in codes_file:
+        claim_code = line.strip()
+        if claim_code and not claim_code.startswith('#') and claim_code not in claim_codes:
+            claim_codes.append(claim_code)
+    return claim_codes
+
+
+def claim_aps(configs, claim_codes, chunk_size=100):
+    """
+    This function claims a list of APs to an organization, sending up to chunk_size
+    claim codes per API call
+    API Call Used: POST https://api.mist.com/api/v1/orgs/:org_id/inventory
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - claim_codes: List of the claim codes of the APs
+        - chunk_size: Maximum number of claim codes sent in one API call (Default = 100)
+
+    Returns:
+        - Dictionary with the claim codes 'added', the claim codes 'duplicated' and the
+          (claim code, reason) of the claim codes in 'error'
+    """
+    api_url = f"{configs['api']['mist_url']}orgs/{configs['api']['org_id']}/inventory"
+    headers = {'Content-Type': 'application/json',
+               'Authorization': f"Token {configs['api']['token']}"}
+    results = {'added': [], 'duplicated': [], 'error': []}
+
+    with requests.Session() as session:
+        for start in range(0, len(claim_codes), chunk_size):
+            chunk = claim_codes[start:start + chunk_size]
+            response = session.post(api_url, data=json.dumps(chunk), headers=headers)
+            if response.status_code != 200:
+                print(f"Something went wrong: {response.status_code} - {len(chunk)} claim codes NOT sent")
+                results['error'] += [(code, f"HTTP {response.status_code}") for code in chunk]
+                continue
+
+            claim_response = json.loads(response.content.decode('utf-8'))
+            errors = claim_response.get('error', [])
+            reasons = claim_response.get('reason', []) + [''] * len(errors)
+            chunk_results = {'added': claim_response.get('added', []),
+                             'duplicated': claim_response.get('duplicated', []),
+                             'error': list(zip(errors, reasons))}
+            # Claim codes that are not part of any list were not processed by the Mist cloud
+            answered = {code.upper() for code in chunk_results['added'] + chunk_results['duplicated'] + errors}
+            chunk_results['error'] += [(code, 'No result returned') for code in chunk if code.upper() not in answered]
+            for key in results:
+                results[key] += chunk_results[key]
+            print(f"Claim codes {start + 1}-{start + len(chunk)}/{len(claim_codes)} sent:\t"
+                  f"Added: {len(chunk_results['added'])}\tDuplicated: {len(chunk_results['duplicated'])}\t"
+                  f"Errors: {len(chunk_results['error'])}")
+
+    for code, reason in results['error']:
+        print(f"ERROR: {code} was NOT claimed.\t\t Reason: {reason}")
+    print(f"\nAPs claimed: {len(results['added'])}\tAlready claimed: {len(results['duplicated'])}\t"
+          f"Errors: {len(results['error'])}")
+
+    return results
+
+
 def main():
     """
-    This function claims a Mist AP to a specific Organization
+    This function claims a Mist AP (or a list of Mist APs) to a specific Organization
     """
-    parser = argparse.ArgumentParser(description='Creates a Mist site within your organization')
+    parser = argparse.ArgumentParser(description='Claims Mist APs to your organization')
     parser.add_argument('config', metavar='config_file', type=argparse.FileType(
         'r'), help='file containing all the configuration information')
+    parser.add_argument('-f', '--codes', metavar='codes_file', type=argparse.FileType('r'),
+                        help='file containing the claim codes of the APs to claim (one per line)')
+    parser.add_argument('-c', '--chunk-size', type=int, default=100,
+                        help='number of claim codes sent per API call (Default = 100)')
     args = parser.parse_args()
     configs = json.load(args.config)
 
-    claim_ap(configs)
+    if args.codes:
+        claim_aps(configs, read_claim_codes(args.codes), max(1, args.chunk_size))
+    else:
+        claim_ap(configs)
 
 
 if __name__ == '__main__':
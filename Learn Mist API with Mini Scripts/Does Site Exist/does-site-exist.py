@@ -10,10 +10,15 @@ All the configuration details are coming from the 'config-site.json' file
 
 
 import argparse
+import os
+import sys
 import time
 import json
 import requests
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from mist_http_cache import OfflineError, add_cache_arguments, install_cache  # noqa: E402
+
 
 def does_site_exist(configs):
     """
@@ -54,10 +59,18 @@ def main():
         description='Check if a Mist site exists within your organization')
     parser.add_argument('config', metavar='config_file', type=argparse.FileType(
         'r'), help='file containing all the configuration information')
+    add_cache_arguments(parser)
     args = parser.parse_args()
     configs = json.load(args.config)
+    cache = install_cache(args)
+
+    try:
+        does_site_exist(configs)
+    except OfflineError as e:
+        print('Something went wrong: {}'.format(e))
 
-    does_site_exist(configs)
+    if cache:
+        print(f"\n{cache.summary()}")
 
 
 if __name__ == '__main__':
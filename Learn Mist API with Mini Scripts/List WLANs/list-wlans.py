@@ -10,11 +10,16 @@ All the configuration details are coming from the 'config.json' file
 
 
 import argparse
+import os
+import sys
 import time
 import json
 import requests
 from tabulate import tabulate
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from mist_http_cache import OfflineError, add_cache_arguments, install_cache  # noqa: E402
+
 
 def list_wlans(configs):
     """
@@ -55,10 +60,18 @@ def main():
     parser = argparse.ArgumentParser(description='List all WLANS within a specific Mist Site')
     parser.add_argument('config', metavar='config_file', type=argparse.FileType(
         'r'), help='file containing all the configuration information')
+    add_cache_arguments(parser)
     args = parser.parse_args()
     configs = json.load(args.config)
+    cache = install_cache(args)
+
+    try:
+        my_wlans = list_wlans(configs)
+    except OfflineError as e:
+        print(f"Something went wrong: {e}")
 
-    my_wlans = list_wlans(configs)
+    if cache:
+        print(f"\n{cache.summary()}")
 
 
 if __name__ == '__main__':
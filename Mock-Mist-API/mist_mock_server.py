@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Mist API, used to test and benchmark the scripts without a live org.
+
+The server generates a synthetic organization (sites, APs, WLANs, site groups, RF templates,
+inventory) and answers the API calls made by the scripts of this repository:
+
+    GET/POST         orgs/:org_id/sites                  DELETE      sites/:site_id
+    GET/PUT          sites/:site_id/setting
+    GET              sites/:site_id/devices              GET/PUT     sites/:site_id/devices/:device_id
+    GET              sites/:site_id/stats/devices        GET         sites/:site_id/stats/devices/:device_id
+    GET              sites/:site_id/stats/clients/:mac
+    GET/POST         sites/:site_id/wlans                DELETE      sites/:site_id/wlans/:wlan_id
+    GET/POST         orgs/:org_id/inventory              (POST = claim codes)
+    GET              installer/orgs/:org_id/devices      PUT         installer/orgs/:org_id/devices/:mac
+    GET/POST         orgs/:org_id/sitegroups
+    GET/POST         orgs/:org_id/rftemplates            DELETE      orgs/:org_id/rftemplates/:rftemplate_id
+    POST             self/apitokens                      DELETE      self/apitokens/:token_id
+
+Every list supports the 'limit' and 'page' query parameters (X-Page-Total, X-Page-Limit and
+X-Page-Page headers). Latency, page size caps, random server errors and a per-token rate limit
+(429 with Retry-After and X-RateLimit-* headers) can be injected from the command line.
+GET /_mock/stats returns the number of calls received per route and the bytes of the request and
+response bodies, POST /_mock/reset clears them.
+
+Usage:
+    python mist_mock_server.py --sites 100 --aps 10000 --latency 50 --write-config config.json
+
+The scripts reach the mock either through the 'mist_url' of the generated config file or with
+run-with-mock.py, which redirects https://api.mist.com/api/v1/ to the mock.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+MIST_API_URL = "https://api.mist.com/api/v1/"
+AP_MODELS = ('AP12', 'AP32', 'AP33', 'AP41', 'AP43', 'AP45')
+CHANNELS_24 = (1, 6, 11)
+CHANNELS_5 = (36, 40, 44, 48, 52, 56, 60, 64, 100, 104, 108, 112, 116, 132, 136, 140, 149, 153, 157, 161)
+
+
+def make_id(kind: int, number: int) -> str:
+    """Return a deterministic UUID for the object number of a kind (1 = site, 2 = wlan...)."""
+    return str(uuid.UUID(int=(kind << 96) | number))
+
+
+def device_id(mac: str) -> str:
+    """Return the device ID Mist derives from the MAC address of a device."""
+    return f"00000000-0000-0000-1000-{mac}"
+
+
+class MockOrg:
+    """Synthetic Mist organization and the API calls that read or change it.
+
+    Attributes:
+        org_id: str ID of the organization
+        sites: dict of the sites keyed by ID
+        devices: dict of the devices assigned to a site keyed by ID
+        inventory: dict of the devices claimed to the org keyed by MAC address
+        claim_codes: dict of the claim codes not claimed yet mapped to the MAC address of their AP
+    """
+
+    def __init__(self, nb_sites: int = 10, nb_aps: int = 100, nb_unclaimed: int = 100, seed: int = 0):
+        """Generate the organization.
+
+        Args:
+            nb_sites: int number of sites
+            nb_aps: int number of APs, spread evenly across the sites
+            nb_unclaimed: int number of APs that can be claimed with the codes CLAIM-00000, CLAIM-00001...
+            seed: int seed of the generated values
+        """
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.org_id = make_id(0, 1)
+        self.sites = {}
+        self.settings = {}
+        self.devices = {}
+        self.site_devices = {}
+        self.wlans = {}
+        self.inventory = {}
+        self.sitegroups = {}
+        self.rftemplates = {}
+        self.apitokens = {}
+        self.claim_codes = {}
+        self._next_id = 1000000
+
+        rng = random.Random(seed)
+        for site_number in range(nb_sites):
+            site = {'id': make_id(1, site_number), 'org_id': self.org_id, 'name': f"Site {site_number:05d}",
+                    'timezone': 'America/Toronto', 'country_code': 'CA', 'address': f"{site_number} Mock Street",
+                    'latlng': {'lat': 43.0 + rng.random(), 'lng': -81.0 - rng.random()}}
+            self._add_site(site)
+            for band in ('24', '5'):
+                wlan = {'id': make_id(2, site_number * 2 + len(band)), 'site_id': site['id'],
+                        'ssid': f"Mock-{band}", 'band': band, 'enabled': True}
+                self.wlans[site['id']][wlan['id']] = wlan
+
+        site_ids = list(self.sites)
+        for number in range(nb_aps):
+            mac = f"5c5b35{number:06x}"
+            site_id = site_ids[number % len(site_ids)] if site_ids else None
+            self._add_inventory(mac, f"AP-{number:06d}", rng.choice(AP_MODELS), site_id)
+        for number in range(nb_unclaimed):
+            self.claim_codes[f"CLAIM-{number:05d}"] = f"d420b0{number:06x}"
+
+    # ----- Organization changes -------------------------------------------------------------
+
+    def new_id(self) -> str:
+        with self.lock:
+            self._next_id += 1
+            return make_id(9, self._next_id)
+
+    def _add_site(self, site: dict):
+        self.sites[site['id']] = site
+        self.settings[site['id']] = {'site_id': site['id'], 'persist_config_on_device': False}
+        self.site_devices[site['id']] = {}
+        self.wlans[site['id']] = {}
+
+    def _add_inventory(self, mac: str, name: str, model: str, site_id: str = None):
+        self.inventory[mac] = {'mac': mac, 'serial': mac[6:].upper(), 'model': model, 'type': 'ap',
+                               'name': name, 'site_id': site_id, 'magic': ''}
+        if site_id:
+            self._assign(mac, site_id, name)
+
+    def _assign(self, mac: str, site_id: str, name: str):
+        entry = self.inventory[mac]
+        if entry.get('site_id') and entry['site_id'] in self.site_devices:
+            self.site_devices[entry['site_id']].pop(device_id(mac), None)
+        entry.update({'site_id': site_id, 'name': name})
+        device = self.devices.get(device_id(mac)) or {
+            'id': device_id(mac), 'mac': mac, 'serial': entry['serial'], 'model': entry['model'],
+            'type': 'ap', 'org_id': self.org_id,
+            'radio_config': {'band_24': {'channel': 0, 'power': 0}, 'band_5': {'channel': 0, 'power': 0, 'bandwidth': 40}}}
+        device.update({'name': name, 'site_id': site_id})
+        self.devices[device['id']] = device
+        self.site_devices[site_id][device['id']] = device
+
+    # ----- Generated stats --------------------------------------------------------------------
+
+    def device_stats(self, device: dict) -> dict:
+        """Return the stats of a device, regenerated every 30 seconds."""
+        now = int(time.time())
+        rng = random.Random(f"{self.seed}-{device['mac']}-{now // 30}")
+        stats = dict(device)
+        stats.update({
+            'status': 'connected', 'ip': f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+            'version': '0.12.27139', 'uptime': rng.randrange(3600, 90 * 24 * 3600), 'last_seen': now - rng.randrange(0, 60),
+            'tx_bps': rng.randrange(0, 10 ** 8), 'rx_bps': rng.randrange(0, 10 ** 8), 'num_clients': rng.randrange(0, 60),
+            'port_stat': {'eth0': {'up': True, 'speed': rng.choice((1000, 1000, 1000, 2500, 100)), 'full_duplex': True,
+                                   'tx_bytes': rng.randrange(0, 10 ** 13), 'rx_bytes': rng.randrange(0, 10 ** 13),
+                                   'rx_errors': rng.choice((0, 0, 0, 0, rng.randrange(1, 100)))}},
+            'radio_stat': {'band_24': {'channel': rng.choice(CHANNELS_24), 'power': rng.randrange(5, 18), 'bandwidth': 20,
+                                       'num_clients': rng.randrange(0, 20), 'util_all': rng.randrange(5, 90),
+                                       'noise_floor': -rng.randrange(85, 98)},
+                           'band_5': {'channel': rng.choice(CHANNELS_5), 'power': rng.randrange(8, 20), 'bandwidth': 40,
+                                      'num_clients': rng.randrange(0, 40), 'util_all': rng.randrange(2, 70),
+                                      'noise_floor': -rng.randrange(88, 100)}}})
+        return stats
+
+    def client_stats(self, site_id: str, client_mac: str) -> dict:
+        """Return the stats of a client, connected to an AP of the site picked from its MAC address."""
+        aps = sorted(self.site_devices.get(site_id, {}))
+        if not aps:
+            return None
+        rng = random.Random(f"{self.seed}-{client_mac}-{int(time.time()) // 10}")
+        return {'mac': client_mac, 'site_id': site_id, 'ap_id': aps[int(hashlib.md5(client_mac.encode()).hexdigest(), 16) % len(aps)],
+                'band': rng.choice(('24', '5', '5')), 'rssi': -rng.randrange(40, 80), 'snr': rng.randrange(10, 50),
+                'tx_rate': rng.choice((54.0, 144.4, 300.0, 433.3, 866.7))}
+
+    # ----- API calls --------------------------------------------------------------------------
+
+    def routes(self):
+        """Return the (method, URL, handler) of every API call of the mock, with the URL parameters prefixed by ':'."""
+        org = "orgs/:org_id"
+        site = "sites/:site_id"
+        return [
+            ('GET', f"{org}/sites", lambda m, body: list(self.sites.values())),
+            ('POST', f"{org}/sites", self.create_site),
+            ('DELETE', site, self.delete_site),
+            ('GET', f"{site}/setting", lambda m, body: self.settings.get(m['site_id'])),
+            ('PUT', f"{site}/setting", self.update_setting),
+            ('GET', f"{site}/devices", lambda m, body: self._site(m) and list(self.site_devices[m['site_id']].values())),
+            ('GET', f"{site}/devices/:device_id", lambda m, body: self.devices.get(m['device_id'])),
+            ('PUT', f"{site}/devices/:device_id", self.update_device),
+            ('GET', f"{site}/stats/devices", lambda m, body: self._site(m) and [
+                self.device_stats(device) for device in self.site_devices[m['site_id']].values()]),
+            ('GET', f"{site}/stats/devices/:device_id",
+             lambda m, body: m['device_id'] in self.devices and self.device_stats(self.devices[m['device_id']]) or None),
+            ('GET', f"{site}/stats/clients/:mac", lambda m, body: self.client_stats(m['site_id'], m['mac'])),
+            ('GET', f"{site}/wlans", lambda m, body: self._site(m) and list(self.wlans[m['site_id']].values())),
+            ('POST', f"{site}/wlans", self.create_wlan),
+            ('DELETE', f"{site}/wlans/:wlan_id",
+             lambda m, body: self._site(m) and self.wlans[m['site_id']].pop(m['wlan_id'], None) and {}),
+            ('GET', f"{org}/inventory", lambda m, body: list(self.inventory.values())),
+            ('POST', f"{org}/inventory", self.claim),
+            ('GET', f"installer/{org}/devices", lambda m, body: list(self.inventory.values())),
+            ('PUT', f"installer/{org}/devices/:mac", self.provision),
+            ('GET', f"{org}/sitegroups", lambda m, body: list(self.sitegroups.values())),
+            ('POST', f"{org}/sitegroups", lambda m, body: self._create(self.sitegroups, body)),
+            ('GET', f"{org}/rftemplates", lambda m, body: list(self.rftemplates.values())),
+            ('POST', f"{org}/rftemplates", lambda m, body: self._create(self.rftemplates, body)),
+            ('DELETE', f"{org}/rftemplates/:rftemplate_id",
+             lambda m, body: self.rftemplates.pop(m['rftemplate_id'], None) and {}),
+            ('POST', "self/apitokens", self.create_apitoken),
+            ('DELETE', "self/apitokens/:token_id", lambda m, body: self.apitokens.pop(m['token_id'], None) and {}),
+        ]
+
+    def _site(self, match) -> bool:
+        return match['site_id'] in self.sites
+
+    def _create(self, objects: dict, body: dict) -> dict:
+        new_object = dict(body, id=self.new_id(), org_id=self.org_id)
+        with self.lock:
+            objects[new_object['id']] = new_object
+        return new_object
+
+    def create_site(self, match, body: dict) -> dict:
+        site = dict(body, id=self.new_id(), org_id=self.org_id)
+        with self.lock:
+            self._add_site(site)
+        return site
+
+    def delete_site(self, match, body) -> dict:
+        with self.lock:
+            if self.sites.pop(match['site_id'], None) is None:
+                return None
+            for device in self.site_devices.pop(match['site_id']).values():
+                device['site_id'] = None
+                self.inventory[device['mac']]['site_id'] = None
+            self.wlans.pop(match['site_id'])
+            self.settings.pop(match['site_id'])
+        return {}
+
+    def update_setting(self, match, body: dict) -> dict:
+        if not self._site(match):
+            return None
+        self.settings[match['site_id']].update(body)
+        return self.settings[match['site_id']]
+
+    def update_device(self, match, body: dict) -> dict:
+        device = self.devices.get(match['device_id'])
+        if device is None or device['site_id'] != match['site_id']:
+            return None
+        for key, value in body.items():
+            if isinstance(value, dict) and isinstance(device.get(key), dict):
+                device[key] = json.loads(json.dumps(device[key]))
+                for sub_key, sub_value in value.items():
+                    device[key].setdefault(sub_key, {}).update(sub_value) if isinstance(sub_value, dict) \
+                        else device[key].__setitem__(sub_key, sub_value)
+            else:
+                device[key] = value
+        if 'name' in body:
+            self.inventory[device['mac']]['name'] = body['name']
+        return device
+
+    def create_wlan(self, match, body: dict) -> dict:
+        if not self._site(match):
+            return None
+        wlan = dict(body, id=self.new_id(), site_id=match['site_id'])
+        self.wlans[match['site_id']][wlan['id']] = wlan
+        return wlan
+
+    def claim(self, match, body: list) -> dict:
+        """Claim a list of claim codes, answering like the Mist cloud (added / duplicated / error)."""
+        result = {'op': 'assign', 'added': [], 'duplicated': [], 'error': [], 'reason': [],
+                  'inventory_added': [], 'inventory_duplicated': []}
+        with self.lock:
+            for code in body:
+                mac = self.claim_codes.get(code)
+                if mac is None:
+                    result['error'].append(code)
+                    result['reason'].append(f"invalid claim code: {code}")
+                    continue
+                entry = {'mac': mac, 'magic': code, 'type': 'ap', 'model': 'AP43'}
+                if mac in self.inventory:
+                    result['duplicated'].append(code)
+                    result['inventory_duplicated'].append(entry)
+                else:
+                    self._add_inventory(mac, '', 'AP43')
+                    self.inventory[mac]['magic'] = code
+                    result['added'].append(code)
+                    result['inventory_added'].append(entry)
+        return result
+
+    def provision(self, match, body: dict) -> dict:
+        with self.lock:
+            if match['mac'] not in self.inventory or body.get('site_id') not in self.sites:
+                return None
+            self._assign(match['mac'], body['site_id'], body.get('name', self.inventory[match['mac']]['name']))
+            entry = dict(self.inventory[match['mac']])
+        entry['site_name'] = self.sites[entry['site_id']]['name']
+        return entry
+
+    def create_apitoken(self, match, body) -> dict:
+        token = {'id': self.new_id(), 'key': uuid.uuid4().hex, 'created_time': int(time.time())}
+        self.apitokens[token['id']] = token
+        return token
+
+
+class RateLimiter:
+    """Per-token fixed-window rate limit."""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def check(self, token: str) -> (int, float):
+        """Count a call of the token and return the calls left (-1 if over the limit) and the seconds to the reset."""
+        now = time.monotonic()
+        with self.lock:
+            window_start, count = self.calls.get(token, (now, 0))
+            if now - window_start >= self.window:
+                window_start, count = now, 0
+            count += 1
+            self.calls[token] = (window_start, count)
+        return self.limit - count, self.window - (now - window_start)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """HTTP handler dispatching the API calls to the MockOrg of the server."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _send(self, status: int, payload=None, headers: dict = None):
+        body = b'' if status == 304 else json.dumps(payload if payload is not None else {}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if not self.path.startswith('/_mock/'):
+            with self.server.calls_lock:
+                self.server.bytes_sent += len(body)
+
+    def _handle(self, method: str):
+        server = self.server
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+
+        if url.path.startswith('/_mock/'):
+            if url.path == '/_mock/stats':
+                return self._send(200, {'calls': dict(server.calls), 'total': sum(server.calls.values()),
+                                        'bytes_received': server.bytes_received, 'bytes_sent': server.bytes_sent})
+            if url.path == '/_mock/reset' and method == 'POST':
+                with server.calls_lock:
+                    server.calls.clear()
+                    server.bytes_received = server.bytes_sent = 0
+                return self._send(200, {})
+            return self._send(404, {'detail': 'unknown mock command'})
+
+        path = url.path[len('/api/v1/'):] if url.path.startswith('/api/v1/') else url.path.lstrip('/')
+        for route_method, route, pattern, handler in server.routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                break
+        else:
+            return self._send(404, {'detail': f"{method} {url.path} is not part of the mock"})
+
+        with server.calls_lock:
+            server.calls[f"{method} {route}"] += 1
+            server.bytes_received += len(raw_body)
+        if server.latency or server.jitter:
+            time.sleep((server.latency + random.uniform(0, server.jitter)) / 1000)
+
+        headers = {}
+        if server.rate_limiter:
+            remaining, reset = server.rate_limiter.check(self.headers.get('Authorization', ''))
+            headers.update({'X-RateLimit-Limit': server.rate_limiter.limit,
+                            'X-RateLimit-Remaining': max(remaining, 0), 'X-RateLimit-Reset': round(reset, 3)})
+            if remaining < 0:
+                headers['Retry-After'] = max(1, round(reset))
+                return self._send(429, {'detail': 'Too Many Requests'}, headers)
+        if server.fail_rate and random.random() < server.fail_rate:
+            return self._send(503, {'detail': 'Service Unavailable (injected)'}, headers)
+
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+        except ValueError:
+            return self._send(400, {'detail': 'invalid JSON body'}, headers)
+        payload = handler(match.groupdict(), body)
+        if payload is None or payload is False:
+            return self._send(404, {'detail': 'Object Not Found', 'message': 'Object Not Found'}, headers)
+
+        if isinstance(payload, list):
+            payload, page_headers = self.paginate(payload, parse_qs(url.query))
+            headers.update(page_headers)
+        if method == 'GET':
+            etag = '"{}"'.format(hashlib.md5(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest())
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                return self._send(304, headers=headers)
+        self._send(200, payload, headers)
+
+    def paginate(self, items: list, query: dict) -> (list, dict):
+        """Return the page of the list asked by the limit/page query parameters, and the page headers."""
+        server = self.server
+        limit = int(query.get('limit', [server.default_limit])[0] or 0)
+        if server.max_limit:
+            limit = min(limit or server.max_limit, server.max_limit)
+        if not limit:
+            return items, {'X-Page-Total': len(items)}
+        page = max(1, int(query.get('page', ['1'])[0]))
+        return items[(page - 1) * limit:page * limit], {'X-Page-Total': len(items), 'X-Page-Limit': limit,
+                                                        'X-Page-Page': page}
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class MockServer(ThreadingHTTPServer):
+    """Threaded HTTP server serving a MockOrg.
+
+    Attributes:
+        org: MockOrg served
+        latency: float milliseconds added to every call
+        jitter: float maximum random milliseconds added on top of the latency
+        default_limit: int page size used when a call has no 'limit' (0 = whole list)
+        max_limit: int largest page size served (0 = no cap)
+        fail_rate: float probability of answering 503
+        rate_limiter: RateLimiter applied per token, None to disable
+        calls: Counter of the calls received per route
+        bytes_received: int bytes of the request bodies received
+        bytes_sent: int bytes of the response bodies sent
+    """
+
+    daemon_threads = True
+
+    def __init__(self, org: MockOrg, host: str = '127.0.0.1', port: int = 8080, latency: float = 0, jitter: float = 0,
+                 default_limit: int = 0, max_limit: int = 0, fail_rate: float = 0, rate_limit: int = 0,
+                 rate_window: float = 3600, verbose: bool = False):
+        super().__init__((host, port), MockHandler)
+        self.org = org
+        self.routes = [(method, route, re.compile(re.sub(r':(\w+)', r'(?P<\1>[^/]+)', route)), handler)
+                       for method, route, handler in org.routes()]
+        self.latency = latency
+        self.jitter = jitter
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+        self.fail_rate = fail_rate
+        self.rate_limiter = RateLimiter(rate_limit, rate_window) if rate_limit else None
+        self.verbose = verbose
+        self.calls = Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.calls_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """Base URL of the mock API (replaces https://api.mist.com/api/v1/)."""
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/api/v1/"
+
+    def start(self) -> threading.Thread:
+        """Serve in a background thread (benchmarks, tests) and return the thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def config(self, token: str = 'mock-token') -> dict:
+        """Return a config pointing to the mock, usable by every script of the repository."""
+        first_site = next(iter(self.org.sites.values()), {'id': '', 'name': ''})
+        # The AP of the config is the first one that can be claimed, so the claim and provision scripts have work to do
+        claim_code, ap_mac = next(iter(self.org.claim_codes.items()), ('', ''))
+        return {'api': {'org_id': self.org.org_id, 'token': token, 'mist_url': self.url},
+                'org_id': self.org.org_id, 'token': token,
+                'site': {'id': first_site['id'], 'name': first_site['name'], 'timezone': 'America/Toronto',
+                         'country_code': 'CA', 'address': 'London, ON, Canada', 'lat': '42.98', 'lng': '-81.24'},
+                'clients': {'mac': 'a8c83a000001'},
+                'ap': {'mac': ap_mac, 'name': 'APoS-Mock', 'claim-code': claim_code},
+                'wlan': {'ssid': 'Mock-5', 'type': 'psk', 'psk': 'mock-passphrase', 'hostname_ie': 'true', 'band': '5'},
+                '24ghz': {'ssid': 'Survey-2.4', 'channel': '6', 'tx-power': '8'},
+                '5ghz': {'ssid': 'Survey-5', 'channel': '48', 'bandwidth': '20', 'tx-power': '14'}}
+
+    def write_config(self, filename: str, token: str = 'mock-token'):
+        """Write the config file of config()."""
+        with open(filename, mode='w') as config_file:
+            json.dump(self.config(token), config_file, indent=2)
+
+
+def redirect_mist_api(mock_url: str):
+    """Send the calls made to https://api.mist.com/api/v1/ in this process to the mock instead.
+
+    Patches requests (used directly or through semfio_mist) and the Mist cloud URL of the
+    semfio_mist API class (also used by the aiohttp pollers).
+    """
+    import requests
+
+    original_request = requests.Session.request
+
+    def request(session, method, url, *args, **kwargs):
+        if isinstance(url, str) and url.startswith(MIST_API_URL):
+            url = mock_url + url[len(MIST_API_URL):]
+        return original_request(session, method, url, *args, **kwargs)
+
+    requests.Session.request = request
+    try:
+        from semfio_mist import mist_api
+        mist_api.API.mist_cloud_url = mock_url
+    except ImportError:
+        pass
+
+
+def script_args_parser() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Local stand-in for the Mist API with a synthetic organization')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (Default = 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='port to listen on (Default = 8080)')
+    parser.add_argument('--sites', type=int, default=10, help='number of sites of the organization (Default = 10)')
+    parser.add_argument('--aps', type=int, default=100, help='number of APs spread across the sites (Default = 100)')
+    parser.add_argument('--unclaimed', type=int, default=100,
+                        help='number of claim codes available (CLAIM-00000, CLAIM-00001...) (Default = 100)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic organization (Default = 0)')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to every call (Default = 0)')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='maximum random milliseconds added on top of the latency (Default = 0)')
+    parser.add_argument('--default-limit', type=int, default=0,
+                        help='page size of the lists when a call has no limit parameter, 0 = whole list (Default = 0)')
+    parser.add_argument('--max-limit', type=int, default=0, help='largest page size served, 0 = no cap (Default = 0)')
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help='calls allowed per token and per rate window, 0 = no limit (Default = 0)')
+    parser.add_argument('--rate-window', type=float, default=3600, help='seconds of the rate limit window (Default = 3600)')
+    parser.add_argument('--fail-rate', type=float, default=0, help='probability of answering 503 (Default = 0)')
+    parser.add_argument('--write-config', metavar='config_file', help='write a config file pointing to the mock')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every call')
+    return parser.parse_args()
+
+
+def main():
+    args = script_args_parser()
+    start_time = time.time()
+    org = MockOrg(args.sites, args.aps, args.unclaimed, args.seed)
+    server = MockServer(org, args.host, args.port, args.latency, args.jitter, args.default_limit, args.max_limit,
+                        args.fail_rate, args.rate_limit, args.rate_window, args.verbose)
+    if args.write_config:
+        server.write_config(args.write_config)
+    print(f"** Mock Mist API listening on {server.url}\n"
+          f"\tORG ID: {org.org_id}\tSites: {len(org.sites)}\tAPs: {len(org.devices)}\t"
+          f"(generated in {round(time.time() - start_time, 2)} sec)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
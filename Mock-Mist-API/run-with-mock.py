@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Run one of the scripts of the repository against the local Mist API mock.
+
+Every call the script makes to https://api.mist.com/api/v1/ (semfio_mist, requests, the
+temporary token calls, the aiohttp pollers) is sent to the mock instead, so scripts that
+do not read the Mist URL from their config file can be measured too.
+
+Usage:
+    python mist_mock_server.py --sites 100 --aps 10000 --write-config config.json &
+    python run-with-mock.py [--mock http://127.0.0.1:8080/api/v1/] ../Purge/purge-sites.py --config config.json
+"""
+
+import argparse
+import os
+import runpy
+import sys
+
+from mist_mock_server import redirect_mist_api
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a script against the local Mist API mock')
+    parser.add_argument('--mock', default='http://127.0.0.1:8080/api/v1/',
+                        help='base URL of the mock (Default = http://127.0.0.1:8080/api/v1/)')
+    parser.add_argument('script', help='script to run')
+    parser.add_argument('script_args', nargs=argparse.REMAINDER, help='arguments of the script')
+    args = parser.parse_args()
+
+    # The token calls need a master token, any value is accepted by the mock
+    os.environ.setdefault('MIST_TOKEN', 'mock-token')
+    redirect_mist_api(args.mock if args.mock.endswith('/') else args.mock + '/')
+
+    script = os.path.abspath(args.script)
+    sys.argv = [script] + args.script_args
+    sys.path.insert(0, os.path.dirname(script))
+    runpy.run_path(script, run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,41 @@
 import time
 import argparse
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
 from semfio_mist import Config
 from semfio_mist import API
 from semfio_mist import logger
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from mist_metrics import add_metrics_arguments, install_metrics  # noqa: E402
+from mist_retry import retry_after_seconds  # noqa: E402
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Token_Management'))
+from token_class import TokenPool  # noqa: E402
+
 
 def script_args_parser() -> Config:
     """Parse the Arguments and returns a Config instance."""
-    parser = argparse.ArgumentParser(description='Configures a Mist AP for an APoS site survey')
+    parser = argparse.ArgumentParser(description='Delete all sites and RF templates of a Mist organization')
     parser.add_argument('--config', metavar='config_file', type=argparse.FileType(
         'r'), default='config.json', help='file containing all the configuration information')
     parser.add_argument("-v", "--verbose", help="See DEBUG level messages", action="store_true")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="List what would be deleted without sending any DELETE call")
+    parser.add_argument("-c", "--concurrency", type=int, default=8,
+                        help="Maximum number of DELETE calls in flight (Default = 8)")
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="Number of retries of a DELETE call after a 429/5xx or connection error (Default = 5)")
+    parser.add_argument("--tokens", type=int, default=1,
+                        help="Number of temporary tokens the DELETE calls are spread over, "
+                             "each with its own rate limit (Default = 1)")
+    add_metrics_arguments(parser)
     args = parser.parse_args()
+    install_metrics(args)
 
     # Create a config object based on the config filename
     config = Config(args.config.name)
@@ -21,32 +44,181 @@ def script_args_parser() -> Config:
     if args.verbose:
         logger.setLevel("DEBUG")
 
-    return config
+    return config, args
+
+
+class RateLimiter:
+    """Pace the DELETE calls of all workers based on the Mist rate limit.
+
+    When the Mist cloud answers 429, or announces that the token has (almost) no call left,
+    every worker waits until the limit resets before sending its next call.
+    """
+
+    def __init__(self, reserve: int = 0):
+        """Initialize the rate limiter.
+
+        Args:
+            reserve: int number of calls left below which the workers are paused (usually the concurrency)
+        """
+        self.reserve = reserve
+        self.resume_at = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the workers are allowed to send calls again."""
+        while True:
+            with self.lock:
+                delay = self.resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Pause all the workers for the given number of seconds."""
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+        logger.debug(f"Rate limited, pausing all DELETE calls for {round(seconds, 1)} sec")
+
+    def update(self, response: requests.Response):
+        """Read the rate limit headers of a response and pause the workers if needed."""
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if remaining is not None and reset is not None and int(remaining) <= self.reserve:
+            reset = float(reset)
+            # The reset is either a number of seconds or an epoch timestamp
+            self.pause(reset - time.time() if reset > 1e9 else reset)
+
+
+class Progress:
+    """Print the progress of the purge along with the delete rate."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.retries = 0
+        self.start_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, name: str, deleted: bool, retries: int):
+        with self.lock:
+            self.done += 1
+            self.retries += retries
+            if not deleted:
+                self.failed += 1
+            rate = self.done / max(time.monotonic() - self.start_time, 1e-6)
+            status = "deleted" if deleted else "NOT deleted"
+            logger.info(f"[{self.done}/{self.total}] {kind} {status}:\t{name}\t({round(rate, 1)} deletes/sec)")
+
+
+def delete_object(api: API, call_url: str, limiter: RateLimiter, max_retries: int,
+                  pool: TokenPool = None) -> (bool, int):
+    """Send a DELETE call, retrying transient failures.
+
+    429 replies pause every worker (Retry-After header or exponential backoff).
+    With a token pool, each call is sent with the next token that has budget left, and a 429
+    only sets that token aside until its limit resets: the call is retried with another token.
+    5xx replies and connection errors are retried after a jittered exponential backoff.
+
+    Returns:
+        Bool indicating if the element was deleted, and the number of retries it took
+    """
+    for attempt in range(max_retries + 1):
+        limiter.wait()
+        backoff = random.uniform(0, min(30, 2 ** attempt))
+        headers = api._headers
+        if pool:
+            key = pool.acquire()
+            headers = dict(api._headers, Authorization=f"Token {key}")
+        try:
+            logger.debug(f"Sending API DELETE CALL: {api.mist_cloud_url + call_url}")
+            response = api.session.delete(api.mist_cloud_url + call_url, headers=headers)
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"API DELETE CALL error: {e}")
+            time.sleep(backoff)
+            continue
+
+        if pool:
+            pool.update(key, response)
+        else:
+            limiter.update(response)
+        if response.status_code in (200, 404):
+            # 404: already deleted (by a previous run or a retried call)
+            return True, attempt
+        if response.status_code == 429:
+            if not pool:
+                limiter.pause(retry_after_seconds(response.headers.get('Retry-After'), backoff))
+        elif response.status_code < 500:
+            logger.error(f"API Call error {response.status_code}: {response.text}")
+            return False, attempt
+        else:
+            time.sleep(backoff)
+    logger.error(f"API Call error: giving up on {call_url} after {max_retries} retries")
+    return False, max_retries
+
+
+def bulk_delete(api: API, kind: str, objects: list, args: argparse.Namespace, pool: TokenPool = None):
+    """Delete a list of (call_url, name) concurrently, or only list them in dry-run mode."""
+    if args.dry_run:
+        for call_url, name in objects:
+            logger.info(f"[DRY-RUN] {kind} would be deleted:\t{name}\t(DELETE {call_url})")
+        return
+
+    limiter = RateLimiter(reserve=args.concurrency)
+    progress = Progress(len(objects))
+
+    def worker(call_url: str, name: str):
+        try:
+            deleted, retries = delete_object(api, call_url, limiter, args.max_retries, pool)
+        except Exception as e:
+            logger.error(f"API Call error: {call_url} failed with {e!r}")
+            deleted, retries = False, 0
+        progress.record(kind, name, deleted, retries)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for call_url, name in objects:
+            executor.submit(worker, call_url, name)
+
+    run_time = time.monotonic() - progress.start_time
+    logger.info(f"{kind}s deleted: {progress.done - progress.failed}/{progress.total}\t"
+                f"Failed: {progress.failed}\tRetries: {progress.retries}\t"
+                f"({round(progress.done / max(run_time, 1e-6), 1)} deletes/sec)")
 
 
 def main():
     """Delete all sites of an organization but the Primary Site."""
-    config = script_args_parser()
+    config, args = script_args_parser()
+    args.concurrency = max(1, args.concurrency)
     api = API(config)
+    # One connection per worker, the default pool of 10 would reconnect above 10 workers
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency)
+    api.session.mount('https://', adapter)
+    api.session.mount('http://', adapter)
 
-    # Retreive sites
-    sites = api.get(f"orgs/{config.data['org_id']}/sites")
+    pool = None
+    if args.tokens > 1 and not args.dry_run:
+        pool = TokenPool(size=args.tokens)
+        pool.MIST_API_URL = api.mist_cloud_url
+        pool.create_tokens()
 
-    # Delete all but Primary Site
-    for site in sites:
-        if site['name'] != "Primary Site":
-            api.delete(f"sites/{site['id']}")
-            logger.info(f"Site deleted:\t{site['name']}")
+    try:
+        # Retreive sites
+        sites = api.get(f"orgs/{config.data['org_id']}/sites")
 
-    # Retreive rf rf_templates
-    rf_templates = api.get(f"orgs/{config.data['org_id']}/rftemplates")
+        # Delete all but Primary Site
+        bulk_delete(api, "Site", [(f"sites/{site['id']}", site['name'])
+                                  for site in sites if site['name'] != "Primary Site"], args, pool)
 
-    # Delete all RF rf_templates
-    for rf_template in rf_templates:
-        api.delete(f"orgs/{config.data['org_id']}/rftemplates/{rf_template['id']}")
-        logger.info(f"RF Template deleted:\t{rf_template['name']}")
+        # Retreive rf rf_templates (once the sites using them are gone)
+        rf_templates = api.get(f"orgs/{config.data['org_id']}/rftemplates")
 
-    api.__exit__()
+        # Delete all RF rf_templates
+        bulk_delete(api, "RF Template", [(f"orgs/{config.data['org_id']}/rftemplates/{rf_template['id']}",
+                                          rf_template['name']) for rf_template in rf_templates], args, pool)
+    finally:
+        if pool:
+            pool.delete_tokens()
+        api.__exit__()
 
 
 if __name__ == '__main__':
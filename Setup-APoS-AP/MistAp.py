@@ -5,89 +5,193 @@ Created on: April 30, 2020
 This file is a module that defines functions used for Mist AP operations
 """
 
-import requests
 import json
+import MistSession
 
 
-def is_ap_in_site(configs, site_id):
+def is_ap_in_site(configs, site_id, snapshot=None, ap=None, inventory=None):
     """
     This function check if an AP is already assigned to a site
 
     Parameters:
         - configs: Dictionary containing all configurations information
         - site_id: ID of the site we would like to assign the AP to
+        - snapshot: SiteSnapshot of the site, used instead of downloading the devices (Default = None)
+        - ap: Dictionary describing the AP (Default = configs['ap'])
+        - inventory: MistInventory of the org, used when no snapshot is given (Default = None)
 
     Returns:
         - the ID of the AP if the AP is assign to the site
     """
+    ap = ap or configs['ap']
+    if snapshot is not None:
+        device = snapshot.get_device(ap['mac'])
+        if device:
+            print('{0} AP is already assigned to site.\t\tSITE ID={1}'.format(device['name'], site_id))
+            return (device['id'])
+        return None
+
+    if inventory is not None:
+        device = inventory.get(ap['mac'])
+        if device and device.get('site_id') == site_id:
+            print('{0} AP is already assigned to site.\t\tSITE ID={1}'.format(device.get('name', ap['mac']), site_id))
+            # The installer list has no device ID, Mist derives it from the MAC address
+            return (device.get('id', '00000000-0000-0000-1000-{}'.format(ap['mac'])))
+        return None
+
     api_url = '{0}sites/{1}/devices'.format(configs['api']['mist_url'],site_id)
-    headers = {'Content-Type': 'application/json',
-                'Authorization': 'Token {}'.format(configs['api']['token'])}
-    response = requests.get(api_url, headers=headers)
+    response = MistSession.get_session(configs).get(api_url)
 
     if response.status_code == 200:
         devices = json.loads(response.content.decode('utf-8'))
         for device in devices:
-            if device['mac'] == configs['ap']['mac']:
+            if device['mac'] == ap['mac']:
                 print('{0} AP is already assigned to site.\t\tSITE ID={1}'.format(device['name'], site_id))
                 return (device['id'])
     else:
         print('Something went wrong: {}'.format(response.status_code))
 
 
-def has_been_claimed(configs):
+def has_been_claimed(configs, ap=None, inventory=None):
     """
     This function check if an AP has been claimed
 
     Parameters:
         - configs: Dictionary containing all configurations information
+        - ap: Dictionary describing the AP (Default = configs['ap'])
+        - inventory: MistInventory of the org, used instead of downloading the claimed devices (Default = None)
 
     Returns:
         - True is the AP has already been claimed
         - False is the AP has not been claimed yet
     """
-    api_url = '{0}installer/orgs/{1}/devices'.format(configs['api']['mist_url'], configs['api']['org_id'])
-    headers = {'Content-Type': 'application/json',
-                'Authorization': 'Token {}'.format(configs['api']['token'])}
+    ap = ap or configs['ap']
+    if inventory is not None:
+        claimed = inventory.get(ap['mac']) is not None
+    else:
+        claimed = ap['mac'] in get_claimed_macs(configs)
+    if claimed:
+        print('{0} AP has already be claimed to org.\t\tORG ID={1}'.format(ap['mac'], configs['api']['org_id']))
+        return (True)
+
+    return (False)
+
+
+def get_claimed_macs(configs, inventory=None):
+    """
+    This function returns the MAC addresses of all the APs claimed to the organization
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - inventory: MistInventory of the org, used instead of downloading the claimed devices (Default = None)
 
-    response = requests.get(api_url, headers=headers)
+    Returns:
+        - A set of MAC addresses
+    """
+    if inventory is not None:
+        inventory.refresh()
+        return set(inventory.devices)
+
+    api_url = '{0}installer/orgs/{1}/devices'.format(configs['api']['mist_url'], configs['api']['org_id'])
+    response = MistSession.get_session(configs).get(api_url)
 
     if response.status_code == 200:
         devices = json.loads(response.content.decode('utf-8'))
-        for device in devices:
-            if device['mac'] == configs['ap']['mac']:
-                print('{0} AP has already be claimed to org.\t\tORG ID={1}'.format(device['mac'], configs['api']['org_id']))
-                return (True)
-    else:
-        print('Something went wrong: {}'.format(response.status_code))
+        return {device['mac'] for device in devices}
+    print('Something went wrong: {}'.format(response.status_code))
 
-    return (False)
+    return set()
 
 
-def claim_ap(configs):
+def claim_ap(configs, ap=None, inventory=None):
     """
     This function claims an AP to an organization
 
     Parameters:
         - configs: Dictionary containing all configurations information
+        - ap: Dictionary describing the AP (Default = configs['ap'])
+        - inventory: MistInventory of the org, updated with the claimed AP (Default = None)
 
     Returns: N/A
     """
+    claim_aps(configs, [ap or configs['ap']], inventory=inventory)
+
 
-    data_post = '["{}"]'.format(configs['ap']['claim-code'])
+def claim_aps(configs, aps, chunk_size=100, inventory=None):
+    """
+    This function claims a list of APs to an organization, sending up to chunk_size claim codes per API call
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - aps: List of dictionaries describing the APs
+        - chunk_size: Maximum number of claim codes sent in one API call (Default = 100)
+        - inventory: MistInventory of the org, updated with the claimed APs (Default = None)
+
+    Returns:
+        - Dictionary with the claim codes 'added', the claim codes 'duplicated' and the
+          (claim code, reason) of the claim codes in 'error'
+    """
     api_url = '{0}orgs/{1}/inventory'.format(configs['api']['mist_url'], configs['api']['org_id'])
-    headers = {'Content-Type': 'application/json',
-                'Authorization': 'Token {}'.format(configs['api']['token'])}
+    aps_by_code = {ap['claim-code']: ap for ap in aps}
+    claim_codes = list(aps_by_code)
+    # The API may echo a claim code in another case than the one sent
+    aps_by_upper_code = {code.upper(): ap for code, ap in aps_by_code.items()}
+    results = {'added': [], 'duplicated': [], 'error': []}
+
+    for start in range(0, len(claim_codes), chunk_size):
+        chunk = claim_codes[start:start + chunk_size]
+        response = MistSession.get_session(configs).post(api_url, json.dumps(chunk))
+        if response.status_code != 200:
+            print('Something went wrong: {}'.format(response.status_code))
+            results['error'] += [(code, 'HTTP {}'.format(response.status_code)) for code in chunk]
+            continue
+        chunk_results = parse_claim_response(chunk, json.loads(response.content.decode('utf-8')))
+        for key in results:
+            results[key] += chunk_results[key]
+
+    def ap_mac(code):
+        ap = aps_by_upper_code.get(code.upper())
+        return ap['mac'] if ap else code
+
+    for code in results['added']:
+        print('{0} AP has been claimed to org.\t\tORG ID={1}'.format(ap_mac(code), configs['api']['org_id']))
+    for code in results['duplicated']:
+        print('{0} AP has already be claimed to org.\t\tORG ID={1}'.format(ap_mac(code), configs['api']['org_id']))
+    if inventory is not None:
+        for code in results['added'] + results['duplicated']:
+            if code.upper() in aps_by_upper_code:
+                inventory.update(ap_mac(code))
+    for code, reason in results['error']:
+        print('Something went wrong: {0} AP has not been claimed\t\tREASON: {1}'.format(ap_mac(code), reason))
+
+    return results
+
+
+def parse_claim_response(claim_codes, claim_response):
+    """
+    This function parses the result of a claim API call
 
-    response = requests.post(api_url, data=data_post, headers=headers)
+    Parameters:
+        - claim_codes: List of the claim codes sent in the API call
+        - claim_response: Dictionary returned by the API call
 
-    if response.status_code == 200:
-        print('{0} AP has been claimed to org.\t\tORG ID={1}'.format(configs['ap']['mac'], configs['api']['org_id']))
-    else:
-        print('Something went wrong: {}'.format(response.status_code))
+    Returns:
+        - Dictionary with the claim codes 'added', the claim codes 'duplicated' and the
+          (claim code, reason) of the claim codes in 'error'
+    """
+    errors = claim_response.get('error', [])
+    reasons = claim_response.get('reason', [])
+    results = {'added': list(claim_response.get('added', [])),
+               'duplicated': list(claim_response.get('duplicated', [])),
+               'error': [(code, reasons[i] if i < len(reasons) else '') for i, code in enumerate(errors)]}
+
+    # Claim codes that are not part of any list were not processed by the Mist cloud
+    answered = {code.upper() for code in results['added'] + results['duplicated'] + list(errors)}
+    results['error'] += [(code, 'No result returned') for code in claim_codes if code.upper() not in answered]
+    return results
 
 
-def config_radio(configs, site_id, device_id):
+def config_radio(configs, site_id, device_id, snapshot=None, ap=None):
     """
     This function configure radio settings of an AP
 
@@ -95,58 +199,74 @@ def config_radio(configs, site_id, device_id):
         - configs: Dictionary containing all configurations information
         - site_id: ID of the site we would like to assign the AP to
         - device_id: ID of the AP that needs to be configured
-        - band: 2.4 or 5 depending on which radio needs to be configured
+        - snapshot: SiteSnapshot of the site, updated with the new AP configuration (Default = None)
+        - ap: Dictionary describing the AP, its '24ghz' and '5ghz' settings override the ones of configs (Default = None)
 
     Returns: N/A
     """
+    radio_24ghz = dict(configs['24ghz'], **(ap or {}).get('24ghz', {}))
+    radio_5ghz = dict(configs['5ghz'], **(ap or {}).get('5ghz', {}))
     radio_configs = {}
     radio_configs['radio_config'] = {}
     radio_configs['radio_config']['band_24'] = {}
-    radio_configs['radio_config']['band_24']['power'] = configs['24ghz']['tx-power']
-    radio_configs['radio_config']['band_24']['channel'] = configs['24ghz']['channel']
+    radio_configs['radio_config']['band_24']['power'] = radio_24ghz['tx-power']
+    radio_configs['radio_config']['band_24']['channel'] = radio_24ghz['channel']
     radio_configs['radio_config']['band_5'] = {}
-    radio_configs['radio_config']['band_5']['power'] = configs['5ghz']['tx-power']
-    radio_configs['radio_config']['band_5']['bandwidth'] = configs['5ghz']['bandwidth']
-    radio_configs['radio_config']['band_5']['channel'] = configs['5ghz']['channel']
+    radio_configs['radio_config']['band_5']['power'] = radio_5ghz['tx-power']
+    radio_configs['radio_config']['band_5']['bandwidth'] = radio_5ghz['bandwidth']
+    radio_configs['radio_config']['band_5']['channel'] = radio_5ghz['channel']
 
     data_put = json.dumps(radio_configs)
     api_url = '{0}sites/{1}/devices/{2}'.format(configs['api']['mist_url'], site_id, device_id)
-    headers = {'Content-Type': 'application/json',
-                'Authorization': 'Token {}'.format(configs['api']['token'])}
-    response = requests.put(api_url, data=data_put, headers=headers)
+    response = MistSession.get_session(configs).put(api_url, data_put)
 
     if response.status_code == 200:
         new_site_response = json.loads(response.content.decode('utf-8'))
+        if snapshot is not None:
+            snapshot.update_device(new_site_response)
         # print(json.dumps(new_site_response, indent=4, sort_keys=True))
-        print(f"2.4GHz Radio Configured:\t\t\t\tCHANNEL={new_site_response['radio_config']['band_24']['channel']}\tTX-POWER={new_site_response['radio_config']['band_24']['power']}")
-        print(f"5GHz   Radio Configured:\t\t\t\tCHANNEL={new_site_response['radio_config']['band_5']['channel']}/{new_site_response['radio_config']['band_5']['bandwidth']}\tTX-POWER={new_site_response['radio_config']['band_5']['power']}")
+        radio_24 = new_site_response['radio_config']['band_24']
+        radio_5 = new_site_response['radio_config']['band_5']
+        if ap:
+            # Single write, so the output of APs configured at the same time does not get mixed
+            print(f"{ap['name']} Radios Configured:\t\t\t2.4GHz CHANNEL={radio_24['channel']} TX-POWER={radio_24['power']}\t"
+                  f"5GHz CHANNEL={radio_5['channel']}/{radio_5['bandwidth']} TX-POWER={radio_5['power']}\n", end='')
+        else:
+            print(f"2.4GHz Radio Configured:\t\t\t\tCHANNEL={radio_24['channel']}\tTX-POWER={radio_24['power']}")
+            print(f"5GHz   Radio Configured:\t\t\t\tCHANNEL={radio_5['channel']}/{radio_5['bandwidth']}\tTX-POWER={radio_5['power']}")
     else:
         print('Something went wrong: {}'.format(response.status_code))
 
 
-def provision_ap(configs, site_id):
+def provision_ap(configs, site_id, snapshot=None, ap=None, inventory=None):
     """
     This function assigns an AP to a site
 
     Parameters:
         - configs: Dictionary containing all configurations information
         - site_id: ID of the site we would like to assign the AP to
+        - snapshot: SiteSnapshot of the site, its devices are downloaded again once the AP is assigned (Default = None)
+        - ap: Dictionary describing the AP (Default = configs['ap'])
+        - inventory: MistInventory of the org, updated with the new site of the AP (Default = None)
 
     Returns:N/A
     """
+    ap = ap or configs['ap']
     ap_provision = {}
-    ap_provision['name'] = configs['ap']['name']
+    ap_provision['name'] = ap['name']
     ap_provision['site_id'] = site_id
     data_put = json.dumps(ap_provision)
 
     api_url = '{0}installer/orgs/{1}/devices/{2}'.format(configs['api']['mist_url'],
                                                          configs['api']['org_id'],
-                                                         configs['ap']['mac'])
-    headers = {'Content-Type': 'application/json',
-                'Authorization': 'Token {}'.format(configs['api']['token'])}
-    response = requests.put(api_url, data=data_put, headers=headers)
+                                                         ap['mac'])
+    response = MistSession.get_session(configs).put(api_url, data_put)
 
     if response.status_code == 200:
-        print('{0} has been assigned to APoS site.\t\tSITE ID={1}'.format(ap_provision['name'], site_id))
+        print('{0} has been assigned to APoS site.\t\tSITE ID={1}\n'.format(ap_provision['name'], site_id), end='')
+        if snapshot is not None:
+            snapshot.refresh('devices')
+        if inventory is not None:
+            inventory.update(ap['mac'], site_id=site_id, name=ap['name'])
     else:
-        print('Something went wrong: {0} - {1} AP has not claimed'.format(response.status_code, configs['ap']['mac']))
+        print('Something went wrong: {0} - {1} AP has not claimed'.format(response.status_code, ap['mac']))
@@ -0,0 +1,119 @@
+"""
+This file is a module that defines a local index of the devices claimed to the organization
+
+The installer/orgs/:org_id/devices list is downloaded once, indexed by MAC address and
+saved to disk with the time it was downloaded. Following runs reuse the file as long as it
+is not older than the staleness tolerance, and the claims and site assignments made by the
+scripts are applied to the index in memory instead of downloading the list again. They are
+written to disk once, when the script calls save().
+
+The Mist API has no "changed since" query on this list: once the index is stale, refresh()
+downloads the whole list again. Only the changes made by the scripts themselves are applied
+incrementally, changes made elsewhere (dashboard, other tools) are seen on the next refresh.
+"""
+
+import json
+import os
+import threading
+import time
+import MistSession
+
+
+class MistInventory:
+    """
+    MAC address keyed index of the devices claimed to the organization
+
+    Attributes:
+        - filename: Name of the file the index is saved to
+        - max_age: Number of seconds the index is used before it is downloaded again
+        - devices: Dictionary of the claimed devices indexed by MAC address
+        - fetched_at: Time the device list was last downloaded
+    """
+
+    def __init__(self, configs, filename='mist-inventory.json', max_age=300):
+        """
+        Parameters:
+            - configs: Dictionary containing all configurations information
+            - filename: Name of the file the index is saved to (Default = mist-inventory.json)
+            - max_age: Number of seconds the index is used before it is downloaded again (Default = 300)
+        """
+        self.configs = configs
+        self.filename = filename
+        self.max_age = max_age
+        self.devices = {}
+        self.fetched_at = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+
+        if os.path.exists(filename):
+            try:
+                with open(filename) as inventory_file:
+                    inventory = json.load(inventory_file)
+                if inventory['org_id'] == configs['api']['org_id']:
+                    self.devices = inventory['devices']
+                    self.fetched_at = inventory['fetched_at']
+            except (ValueError, KeyError):
+                pass
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > self.max_age
+
+    def refresh(self, force=False):
+        """
+        This function downloads the device list again if the index is older than max_age
+
+        Parameters:
+            - force: Download the device list even if the index is still fresh (Default = False)
+        """
+        if not force and not self.is_stale():
+            return
+        api_url = '{0}installer/orgs/{1}/devices'.format(self.configs['api']['mist_url'], self.configs['api']['org_id'])
+        response = MistSession.get_session(self.configs).get(api_url)
+        if response.status_code != 200:
+            print('Something went wrong: {}'.format(response.status_code))
+            return
+
+        devices = json.loads(response.content.decode('utf-8'))
+        with self.lock:
+            self.devices = {device['mac']: device for device in devices}
+            self.fetched_at = time.time()
+            self._save()
+
+    def get(self, mac):
+        """
+        Returns:
+            - The claimed device with this MAC address, None if it has not been claimed
+        """
+        self.refresh()
+        return self.devices.get(mac)
+
+    def update(self, mac, **fields):
+        """
+        This function applies a change made by the scripts to a device (claim, site assignment...)
+
+        The change is only made in memory, call save() once all the changes are made
+
+        Parameters:
+            - mac: MAC address of the device
+            - fields: Fields of the device that changed (ex: site_id, name)
+        """
+        with self.lock:
+            self.devices.setdefault(mac, {'mac': mac}).update(fields)
+            self.dirty = True
+
+    def save(self):
+        """
+        This function writes the index to disk if it changed since it was loaded or saved
+        """
+        with self.lock:
+            if self.dirty:
+                self._save()
+
+    def _save(self):
+        # Written to a temporary file first, so an interrupted run never leaves a truncated index
+        temporary_filename = self.filename + '.tmp'
+        with open(temporary_filename, mode='w') as inventory_file:
+            json.dump({'org_id': self.configs['api']['org_id'], 'fetched_at': self.fetched_at,
+                       'devices': self.devices}, inventory_file)
+        os.replace(temporary_filename, self.filename)
+        self.dirty = False
@@ -0,0 +1,80 @@
+"""
+This file is a module that defines the HTTP session shared by the MistAp, MistSite and MistWlan modules
+
+A single requests.Session keeps its TCP/TLS connections alive between API calls and
+carries the authorization headers, so they are only built once per run.
+"""
+
+import threading
+import requests
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class MistSession:
+    """
+    Keep-alive HTTP client used to send every API call of a run
+
+    Attributes:
+        - mist_url: Base URL of the Mist API (ex: https://api.mist.com/api/v1/)
+        - session: requests.Session holding the connection pool and the auth headers
+    """
+
+    def __init__(self, configs, pool_size=10):
+        """
+        Parameters:
+            - configs: Dictionary containing all configurations information
+            - pool_size: Maximum number of connections kept alive to the Mist cloud (Default = 10)
+        """
+        self.mist_url = configs['api']['mist_url']
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json',
+                                     'Authorization': 'Token {}'.format(configs['api']['token'])})
+
+    def get(self, api_url):
+        return self.session.get(api_url)
+
+    def post(self, api_url, data):
+        return self.session.post(api_url, data=data)
+
+    def put(self, api_url, data):
+        return self.session.put(api_url, data=data)
+
+    def delete(self, api_url):
+        return self.session.delete(api_url)
+
+    def close(self):
+        self.session.close()
+
+
+def get_session(configs, pool_size=10):
+    """
+    This function returns the session shared by all the modules for a given Mist cloud and token
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - pool_size: Maximum number of connections kept alive, used when the session is created (Default = 10)
+
+    Returns:
+        - The MistSession object (created on first use)
+    """
+    key = (configs['api']['mist_url'], configs['api']['token'])
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = MistSession(configs, pool_size)
+        return _sessions[key]
+
+
+def close_sessions():
+    """
+    This function closes every session opened by get_session()
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -5,8 +5,8 @@ Created on: April 30, 2020
 This file is a module that defines functions used for Mist Site operations
 """
 
-import requests
 import json
+import MistSession
 
 
 def does_site_exist(configs, verbose=True):
@@ -21,9 +21,7 @@ def does_site_exist(configs, verbose=True):
         - The ID of the site if it exists
     """
     api_url = '{0}orgs/{1}/sites'.format(configs['api']['mist_url'],configs['api']['org_id'])
-    headers = {'Content-Type': 'application/json',
-                'Authorization': 'Token {}'.format(configs['api']['token'])}
-    response = requests.get(api_url, headers=headers)
+    response = MistSession.get_session(configs).get(api_url)
 
     if response.status_code == 200:
         sites = json.loads(response.content.decode('utf-8'))
@@ -55,10 +53,7 @@ def create_new_site(configs):
 
     data_post = json.dumps(apos_site)
     api_url = '{0}orgs/{1}/sites'.format(configs['api']['mist_url'],configs['api']['org_id'])
-    headers = {'Content-Type': 'application/json',
-                'Authorization': 'Token {}'.format(configs['api']['token'])}
-
-    response = requests.post(api_url, data=data_post, headers=headers)
+    response = MistSession.get_session(configs).post(api_url, data_post)
     new_site = json.loads(response.content.decode('utf-8'))
 
     if response.status_code == 200:
@@ -69,26 +64,28 @@ def create_new_site(configs):
     return (new_site['id'])
 
 
-def enable_config_persistence(new_site_id, configs):
+def enable_config_persistence(new_site_id, configs, snapshot=None):
     """
     This function Enable the AP Config Persistence feature of a site
 
     Parameters:
         - configs: Dictionary containing all configurations information
         - new_site_id: ID of the newly created site
+        - snapshot: SiteSnapshot of the site, updated with the new settings (Default = None)
 
     Returns:N/A
     """
     data_put = '{"persist_config_on_device": true}'
     api_url = '{0}sites/{1}/setting'.format(configs['api']['mist_url'], new_site_id)
-    headers = {'Content-Type': 'application/json',
-                'Authorization': 'Token {}'.format(configs['api']['token'])}
-    response = requests.put(api_url, data=data_put, headers=headers)
-    if response.status_code != 200:
+    response = MistSession.get_session(configs).put(api_url, data_put)
+    if response.status_code == 200:
+        if snapshot is not None:
+            snapshot.setting = json.loads(response.content.decode('utf-8'))
+    else:
         print('Something went wrong: {}'.format(response.status_code))
 
 
-def get_device_id(configs, device_mac, site_id):
+def get_device_id(configs, device_mac, site_id, snapshot=None):
     """
     This function returns the device ID based on the device MAC address
 
@@ -96,14 +93,17 @@ def get_device_id(configs, device_mac, site_id):
         - configs: Dictionary containing all configurations information
         - device_mac: mac address of the device
         - site_id: ID of the site the device is in
+        - snapshot: SiteSnapshot of the site, used instead of downloading the devices (Default = None)
 
     Returns:
         - The ID of the device associated with the mac address if the device is in the site
     """
+    if snapshot is not None:
+        device = snapshot.get_device(device_mac)
+        return (device['id']) if device else ()
+
     api_url = '{0}sites/{1}/devices'.format(configs['api']['mist_url'],site_id)
-    headers = {'Content-Type': 'application/json',
-                'Authorization': 'Token {}'.format(configs['api']['token'])}
-    response = requests.get(api_url, headers=headers)
+    response = MistSession.get_session(configs).get(api_url)
 
     if response.status_code == 200:
         devices = json.loads(response.content.decode('utf-8'))
@@ -0,0 +1,95 @@
+"""
+This file is a module that defines a snapshot of the APoS site used by the MistAp, MistSite and MistWlan modules
+
+The WLANs, devices and settings of the site are downloaded once per run and indexed, so
+every existence check is answered locally instead of downloading the same list again.
+Functions writing to the site update (or refresh) the snapshot afterwards.
+"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+import MistSession
+
+
+class SiteSnapshot:
+    """
+    Local copy of the WLANs, devices and settings of a site
+
+    Attributes:
+        - site_id: ID of the site
+        - wlans: Dictionary of the WLANs of the site indexed by SSID
+        - devices: Dictionary of the devices of the site indexed by MAC address
+        - setting: Dictionary of the site settings
+    """
+
+    COLLECTIONS = {'wlans': 'sites/{0}/wlans', 'devices': 'sites/{0}/devices', 'setting': 'sites/{0}/setting'}
+
+    def __init__(self, configs, site_id):
+        """
+        Parameters:
+            - configs: Dictionary containing all configurations information
+            - site_id: ID of the site
+        """
+        self.configs = configs
+        self.site_id = site_id
+        self.wlans = {}
+        self.devices = {}
+        self.setting = {}
+        self.refresh()
+
+    def _download(self, collection):
+        api_url = self.configs['api']['mist_url'] + self.COLLECTIONS[collection].format(self.site_id)
+        response = MistSession.get_session(self.configs).get(api_url)
+        if response.status_code != 200:
+            print('Something went wrong: {}'.format(response.status_code))
+            return None
+        return json.loads(response.content.decode('utf-8'))
+
+    def refresh(self, *collections):
+        """
+        This function downloads the given collections of the site again (all of them by default)
+
+        Parameters:
+            - collections: Names of the collections to download ('wlans', 'devices' and/or 'setting')
+        """
+        collections = collections or tuple(self.COLLECTIONS)
+        with ThreadPoolExecutor(max_workers=len(collections)) as executor:
+            contents = dict(zip(collections, executor.map(self._download, collections)))
+
+        if contents.get('wlans') is not None:
+            self.wlans = {}
+            for wlan in contents['wlans']:
+                self.update_wlan(wlan)
+        if contents.get('devices') is not None:
+            self.devices = {}
+            for device in contents['devices']:
+                self.update_device(device)
+        if contents.get('setting') is not None:
+            self.setting = contents['setting']
+
+    def update_wlan(self, wlan):
+        """
+        This function records a WLAN returned by the Mist cloud (after it was created for instance)
+        """
+        if 'ssid' in wlan:
+            self.wlans.setdefault(wlan['ssid'], wlan)
+
+    def update_device(self, device):
+        """
+        This function records a device returned by the Mist cloud (after it was configured for instance)
+        """
+        self.devices[device['mac']] = device
+
+    def get_wlan(self, ssid):
+        """
+        Returns:
+            - The WLAN broadcasting this SSID if it exists in the site
+        """
+        return self.wlans.get(ssid)
+
+    def get_device(self, mac):
+        """
+        Returns:
+            - The device with this MAC address if it is assigned to the site
+        """
+        return self.devices.get(mac)
@@ -5,11 +5,11 @@ Created on: April 30, 2020
 This file is a module that defines functions used for Mist WLAN operations
 """
 
-import requests
 import json
+import MistSession
 
 
-def does_wlan_exist(configs, site_id, band):
+def does_wlan_exist(configs, site_id, band, snapshot=None):
     """
     Check if the WLAN already exist
 
@@ -17,14 +17,20 @@ def does_wlan_exist(configs, site_id, band):
         - configs: Dictionary containing all configurations information
         - site_id: ID of the site the WLAN is part of
         - band: 2.4 of 5 depending on which band we want to validate
+        - snapshot: SiteSnapshot of the site, used instead of downloading the WLANs (Default = None)
 
     Returns:
         - The ID of the WLAN if it exists
     """
+    if snapshot is not None:
+        wlan = snapshot.get_wlan(configs['{}ghz'.format(band)]['ssid'])
+        if wlan:
+            print('{0} WLAN already exist.\t\t\t\tWLAN ID={1}'.format(wlan['ssid'], wlan['id']))
+            return (wlan['id'])
+        return None
+
     api_url = '{0}sites/{1}/wlans'.format(configs['api']['mist_url'],site_id)
-    headers = {'Content-Type': 'application/json',
-                'Authorization': 'Token {}'.format(configs['api']['token'])}
-    response = requests.get(api_url, headers=headers)
+    response = MistSession.get_session(configs).get(api_url)
 
     if response.status_code == 200:
         wlans = json.loads(response.content.decode('utf-8'))
@@ -42,7 +48,7 @@ def does_wlan_exist(configs, site_id, band):
         print('Something went wrong: {}'.format(response.status_code))
 
 
-def create_wlan(site_id, configs, band):
+def create_wlan(site_id, configs, band, snapshot=None):
     """
     This function creates a new WLAN
 
@@ -50,6 +56,7 @@ def create_wlan(site_id, configs, band):
         - configs: Dictionary containing all configurations information
         - site_id: ID of the site we want to create the WLAN in
         - band: 2.4 of 5 depending on which band we want to create the WLAN on
+        - snapshot: SiteSnapshot of the site, updated with the new WLAN (Default = None)
 
     Returns:
         - The ID of the newly create WLAN
@@ -69,14 +76,13 @@ def create_wlan(site_id, configs, band):
 
     data_post = json.dumps(wlan)
     api_url = '{0}sites/{1}/wlans'.format(configs['api']['mist_url'],site_id)
-    headers = {'Content-Type': 'application/json',
-                'Authorization': 'Token {}'.format(configs['api']['token'])}
-
-    response = requests.post(api_url, data=data_post, headers=headers)
+    response = MistSession.get_session(configs).post(api_url, data_post)
     new_wlan = json.loads(response.content.decode('utf-8'))
 
     if response.status_code == 200:
         print('{0} WLAN was created.\t\t\t\tWLAN ID={1}'.format(new_wlan['ssid'], new_wlan['id']))
+        if snapshot is not None:
+            snapshot.update_wlan(new_wlan)
     else:
         print('Something went wrong: {}'.format(response.status_code))
 
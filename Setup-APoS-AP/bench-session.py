@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""
+This script compares the time it takes to run the API calls of setup-apos.py when:
+    - each call opens its own connection (bare requests.get/put/post, as before)
+    - all calls share the keep-alive connection pool of MistSession
+
+Both runs are sent to a local mock server so the comparison does not depend on the Mist cloud.
+The mock server adds a fixed delay when a new connection is accepted to emulate a TCP+TLS handshake.
+"""
+
+
+import argparse
+import time
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import MistSession
+
+
+class MockMistHandler(BaseHTTPRequestHandler):
+    """
+    Answers every call with an empty JSON list (GET) or an empty JSON object (POST/PUT)
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    handshake_delay = 0
+
+    def setup(self):
+        time.sleep(self.handshake_delay)
+        super().setup()
+
+    def _reply(self, body):
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        payload = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._reply('[]')
+
+    def do_POST(self):
+        self._reply('{}')
+
+    def do_PUT(self):
+        self._reply('{}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+# (method, path) of the ~10 API calls setup-apos.py sends for one AP
+SETUP_APOS_CALLS = [('GET', 'orgs/org/sites'),
+                    ('POST', 'orgs/org/sites'),
+                    ('PUT', 'sites/site/setting'),
+                    ('GET', 'sites/site/wlans'),
+                    ('POST', 'sites/site/wlans'),
+                    ('GET', 'sites/site/wlans'),
+                    ('POST', 'sites/site/wlans'),
+                    ('GET', 'installer/orgs/org/devices'),
+                    ('POST', 'orgs/org/inventory'),
+                    ('GET', 'sites/site/devices'),
+                    ('PUT', 'installer/orgs/org/devices/aabbccddeeff'),
+                    ('GET', 'sites/site/devices'),
+                    ('PUT', 'sites/site/devices/device')]
+
+
+def run_per_call(configs, nb_aps):
+    """
+    Sends the calls the way the modules used to: one bare requests call (and one connection) per API call
+    """
+    for _ in range(nb_aps):
+        for method, path in SETUP_APOS_CALLS:
+            headers = {'Content-Type': 'application/json',
+                       'Authorization': 'Token {}'.format(configs['api']['token'])}
+            if method == 'GET':
+                requests.get(configs['api']['mist_url'] + path, headers=headers)
+            else:
+                requests.request(method, configs['api']['mist_url'] + path, data='{}', headers=headers)
+
+
+def run_pooled(configs, nb_aps):
+    """
+    Sends the calls through the shared MistSession
+    """
+    session = MistSession.get_session(configs)
+    for _ in range(nb_aps):
+        for method, path in SETUP_APOS_CALLS:
+            if method == 'GET':
+                session.get(configs['api']['mist_url'] + path)
+            elif method == 'POST':
+                session.post(configs['api']['mist_url'] + path, '{}')
+            else:
+                session.put(configs['api']['mist_url'] + path, '{}')
+    MistSession.close_sessions()
+
+
+def main():
+    """
+    This function times both ways of sending the setup-apos.py API calls and prints the comparison
+    """
+    parser = argparse.ArgumentParser(description='Compares per-call connections to the shared MistSession pool')
+    parser.add_argument('--aps', type=int, default=20, help='number of APs to stage (Default = 20)')
+    parser.add_argument('--handshake-ms', type=float, default=30,
+                        help='delay added by the mock server to each new connection (Default = 30ms)')
+    args = parser.parse_args()
+
+    MockMistHandler.handshake_delay = args.handshake_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockMistHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    configs = {'api': {'mist_url': 'http://127.0.0.1:{}/api/v1/'.format(server.server_address[1]),
+                       'token': 'bench-token'}}
+
+    results = []
+    for label, runner in [('per-call requests', run_per_call), ('shared MistSession', run_pooled)]:
+        start_time = time.time()
+        runner(configs, args.aps)
+        results.append((label, time.time() - start_time))
+
+    nb_calls = args.aps * len(SETUP_APOS_CALLS)
+    for label, run_time in results:
+        print('{0:<20}{1} calls in {2:.2f} sec\t({3:.1f} ms/call)'.format(label, nb_calls, run_time,
+                                                                            run_time * 1000 / nb_calls))
+    print('Speedup: x{:.1f}'.format(results[0][1] / results[1][1]))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,13 +9,148 @@ This script configures a Mist AP for an AP-on-a-Stick site survey
 
 
 import argparse
+import os
+import sys
 import time
 import json
 import requests
 from pprint import pprint
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import MistSite
 import MistWlan
 import MistAp
+import MistSession
+from MistSiteSnapshot import SiteSnapshot
+from MistInventory import MistInventory
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from mist_metrics import add_metrics_arguments, install_metrics  # noqa: E402
+from mist_tracing import add_profile_arguments, install_profiling, span, traced  # noqa: E402
+
+
+@traced()
+def setup_site(configs):
+    """
+    This function makes sure the APoS site and its survey SSIDs exist
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+
+    Returns:
+        - The ID of the site and the SiteSnapshot of the site
+    """
+    with span('site check'):
+        site_id = MistSite.does_site_exist(configs)                                      # Validate if the APoS site already exist
+    if site_id is None:
+        with span('site create'):
+            site_id = MistSite.create_new_site(configs)                                  # Create a new site
+
+    with span('site snapshot'):
+        snapshot = SiteSnapshot(configs, site_id)                                        # Download the WLANs, devices and settings of the site once
+    if not snapshot.setting.get('persist_config_on_device'):
+        with span('config persistence'):
+            MistSite.enable_config_persistence(site_id, configs, snapshot)               # Enable the AP Config Persistence for this APoS site
+
+    with span('wlan 2.4GHz'):
+        wlan_24ghz_id = MistWlan.does_wlan_exist(configs, site_id, '24', snapshot)       # Validate if the 2.4GHz WLAN already exist
+        if wlan_24ghz_id is None:
+            wlan_24ghz_id = MistWlan.create_wlan(site_id, configs, '24', snapshot)       # Create a new 2.4GHz WLAN
+
+    with span('wlan 5GHz'):
+        wlan_5ghz_id = MistWlan.does_wlan_exist(configs, site_id, '5', snapshot)         # Validate if the 5Hz WLAN already exist
+        if wlan_5ghz_id is None:
+            wlan_5ghz_id = MistWlan.create_wlan(site_id, configs, '5', snapshot)         # Create a new 5GHz WLAN
+
+    return site_id, snapshot
+
+
+@traced()
+def setup_ap(configs, site_id, snapshot, inventory):
+    """
+    This function claims, assigns and configures the survey AP of configs['ap']
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - site_id: ID of the APoS site
+        - snapshot: SiteSnapshot of the APoS site
+        - inventory: MistInventory of the org
+    """
+    with span('claim', mac=configs['ap']['mac']):
+        if MistAp.has_been_claimed(configs, inventory=inventory) is False:
+            MistAp.claim_ap(configs, inventory=inventory)                                # Claim AP to Org if necessary
+
+    with span('provision', mac=configs['ap']['mac']):
+        survey_ap_id = MistAp.is_ap_in_site(configs, site_id, snapshot)                  # Validate if the AP is already assign to site
+        if survey_ap_id is None:
+            survey_ap_id = MistAp.provision_ap(configs, site_id, snapshot, inventory=inventory)    # Assigns the AP to the APoS Site
+
+    with span('radio config', mac=configs['ap']['mac']):
+        survey_ap_id = MistSite.get_device_id(configs, configs['ap']['mac'], site_id, snapshot)
+        MistAp.config_radio(configs, site_id, survey_ap_id, snapshot)                    # Configure both radios of the APoS survey AP
+
+
+@traced()
+def setup_fleet(configs, site_id, snapshot, inventory, workers):
+    """
+    This function claims, assigns and configures all the survey APs of configs['aps']
+
+    The APs that are not claimed yet are claimed with as few API calls as possible. The APs are then
+    assigned to the site, and their radios configured, 'workers' APs at a time. An AP that fails
+    does not stop the others: the MAC addresses of the failed APs are printed at the end.
+
+    Parameters:
+        - configs: Dictionary containing all configurations information
+        - site_id: ID of the APoS site
+        - snapshot: SiteSnapshot of the APoS site
+        - inventory: MistInventory of the org
+        - workers: Maximum number of APs configured at the same time
+    """
+    aps = configs['aps']
+    with span('claim', aps=len(aps)):
+        claimed_macs = MistAp.get_claimed_macs(configs, inventory)
+        for ap in aps:
+            if ap['mac'] in claimed_macs:
+                print('{0} AP has already be claimed to org.\t\tORG ID={1}'.format(ap['mac'], configs['api']['org_id']))
+        unclaimed_aps = [ap for ap in aps if ap['mac'] not in claimed_macs]
+        if unclaimed_aps:
+            claim_results = MistAp.claim_aps(configs, unclaimed_aps, inventory=inventory)    # Claim all the new APs to Org at once
+            failed_codes = {code.upper() for code, reason in claim_results['error']}
+            aps = [ap for ap in aps if ap['claim-code'].upper() not in failed_codes]     # Skip the APs that could not be claimed
+
+    def provision(ap):
+        with span('provision ap', mac=ap['mac']):
+            MistAp.provision_ap(configs, site_id, ap=ap, inventory=inventory)
+
+    def config_radio(ap):
+        with span('radio config ap', mac=ap['mac']):
+            MistAp.config_radio(configs, site_id, MistSite.get_device_id(configs, ap['mac'], site_id, snapshot), snapshot, ap)
+
+    failed = {}                                                                          # Error of each failed AP keyed by MAC address
+
+    def run_all(task, task_aps):
+        futures = {executor.submit(task, ap): ap for ap in task_aps}
+        for future in as_completed(futures):
+            ap = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print('Something went wrong: {0} AP - {1}\t\tERROR: {2!r}'.format(ap['mac'], task.__name__, e))
+                failed[ap['mac']] = '{0}: {1!r}'.format(task.__name__, e)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        with span('provision', aps=len(aps)):
+            unassigned_aps = [ap for ap in aps if MistAp.is_ap_in_site(configs, site_id, snapshot, ap) is None]
+            run_all(provision, unassigned_aps)
+            if unassigned_aps:
+                snapshot.refresh('devices')                                              # Download the devices once all the APs are assigned
+
+        with span('radio config', aps=len(aps)):
+            run_all(config_radio, [ap for ap in aps if ap['mac'] not in failed])        # Skip the APs that could not be assigned
+
+    if failed:
+        print('\n{0}/{1} APs failed:'.format(len(failed), len(aps)))
+        for mac, error in failed.items():
+            print('\t{0}\t{1}'.format(mac, error))
 
 
 def main():
@@ -24,34 +159,39 @@ def main():
         - The creation of a specific site that will be used to configure the AP
         - The creation of specific survey SSIDs on both frequency bands
         - The configuration of both 2.4GHz and 5GHz radios based on the config file
+
+    When the config file contains a list of APs ('aps') instead of a single AP ('ap'),
+    all the APs of the list are configured (fleet mode).
     """
     parser = argparse.ArgumentParser(description='Configures a Mist AP for an APoS site survey')
     parser.add_argument('config', metavar='config_file', type=argparse.FileType('r'), help='file containing all the configuration information')
+    parser.add_argument('-w', '--workers', type=int, default=50,
+                        help='number of APs configured at the same time in fleet mode (Default = 50)')
+    parser.add_argument('--inventory-cache', metavar='inventory_file', default='mist-inventory.json',
+                        help='file storing the devices claimed to the org between runs (Default = mist-inventory.json)')
+    parser.add_argument('--inventory-max-age', metavar='seconds', type=float, default=300,
+                        help='age after which the claimed devices are downloaded again (Default = 300)')
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
     args = parser.parse_args()
     configs = json.load(args.config)
+    install_metrics(args)
+    install_profiling(args)
+    args.workers = max(1, args.workers)
+    MistSession.get_session(configs, pool_size=max(10, args.workers))                  # One keep-alive connection per worker
 
-    site_id = MistSite.does_site_exist(configs)                                          # Validate if the APoS site already exist
-    if site_id is None:
-        site_id = MistSite.create_new_site(configs)                                      # Create a new site
-        MistSite.enable_config_persistence(site_id, configs)                             # Enable the AP Config Persistence for this APoS site
-
-    wlan_24ghz_id = MistWlan.does_wlan_exist(configs, site_id, '24')                     # Validate if the 2.4GHz WLAN already exist
-    if wlan_24ghz_id is None:
-        wlan_24ghz_id = MistWlan.create_wlan(site_id, configs, '24')                     # Create a new 2.4GHz WLAN
-
-    wlan_5ghz_id = MistWlan.does_wlan_exist(configs, site_id, '5')                       # Validate if the 5Hz WLAN already exist
-    if wlan_5ghz_id is None:
-        wlan_5ghz_id = MistWlan.create_wlan(site_id, configs, '5')                       # Create a new 5GHz WLAN
-
-    if MistAp.has_been_claimed(configs) is False:
-        MistAp.claim_ap(configs)                                                         # Claim AP to Org if necessary
+    inventory = MistInventory(configs, args.inventory_cache, args.inventory_max_age)   # Index of the devices claimed to the org
 
-    survey_ap_id = MistAp.is_ap_in_site(configs, site_id)                                # Validate if the AP is already assign to site
-    if survey_ap_id is None:
-        survey_ap_id = MistAp.provision_ap(configs, site_id)                             # Assigns the AP to the APoS Site
+    site_id, snapshot = setup_site(configs)
+    try:
+        if 'aps' in configs:
+            setup_fleet(configs, site_id, snapshot, inventory, args.workers)
+        else:
+            setup_ap(configs, site_id, snapshot, inventory)
+    finally:
+        inventory.save()                                                               # Write the claims and assignments once
 
-    survey_ap_id = MistSite.get_device_id(configs, configs['ap']['mac'], site_id)
-    MistAp.config_radio(configs, site_id, survey_ap_id)                                  # Configure both radios of the APoS survey AP
+    MistSession.close_sessions()
 
 
 if __name__ == '__main__':
@@ -1,11 +1,21 @@
 import os
 import json
+import hashlib
+import threading
+import time
+import sys
 import requests
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from mist_retry import retry_after_seconds  # noqa: E402
+
 
 class Token:
     """MIST TOKEN OBJECT."""
 
+    MIST_API_URL = "https://api.mist.com/api/v1/"
+    CACHE_FILE = os.path.join(os.path.expanduser("~"), ".mist_tmp_token.json")
+
     def __init__(self):
         """Initialize the Mist Token object.
 
@@ -16,57 +26,238 @@ class Token:
         """
         self.MASTER_TOKEN = os.environ['MIST_TOKEN']
 
-    def get_tmp_token(self):
-        """Create a Mist token 'on the fly' to be used witin a specific script.
+    def create_token(self):
+        """Create a new Mist token with the master token and return its KEY and ID.
 
         The following API call is made to the Mist Cloud to create a new token:
             POST https://api.mist.com/api/v1/self/apitokens
-
-        Set the following class variables:
-         - tmp_token_key: temporary token KEY received from Mist Cloud after creation
-         - tmp_token_id: temporary token ID received from Mist Cloud after creation
         """
-        api_url = "https://api.mist.com/api/v1/self/apitokens"
+        api_url = f"{self.MIST_API_URL}self/apitokens"
         headers = {"Content-Type": "application/json",
                    "Authorization": f"Token {self.MASTER_TOKEN}"}
-        try:
-            response = requests.post(api_url, data={}, headers=headers)
-            if response.status_code == 200:
-                token = json.loads(response.text)
-                self.tmp_token_key = token['key']
-                self.tmp_token_id = token['id']
-                print(f"Temporary Token created: {self.tmp_token_key}\nID: {self.tmp_token_id}")
-            else:
-                raise ValueError(
-                    f"Error connecting to Mist API!\tRESPONSE:'{response.status_code} - {response.text}'")
-        except Exception:
-            raise
+        response = requests.post(api_url, data={}, headers=headers)
+        if response.status_code != 200:
+            raise ValueError(
+                f"Error connecting to Mist API!\tRESPONSE:'{response.status_code} - {response.text}'")
+        token = json.loads(response.text)
+        print(f"Temporary Token created: {token['key']}\nID: {token['id']}")
+        return token['key'], token['id']
 
-    def delete_tmp_token(self):
-        """Delete the temporary Mist Token stored in self.tmp_token_key using its ID stored in self.tmp_token_id.
+    def delete_token(self, token_id):
+        """Delete a Mist token using its ID.
 
         The following API call is made to the Mist Cloud to delete the token:
             DELETE https://api.mist.com/api/v1/self/apitokens/:token_id
         """
+        api_url = f"{self.MIST_API_URL}self/apitokens/{token_id}"
+        headers = {"Content-Type": "application/json",
+                   "Authorization": f"Token {self.MASTER_TOKEN}"}
+        response = requests.delete(api_url, headers=headers)
+        if response.status_code != 200:
+            raise ValueError(
+                f"Error connecting to Mist API!\tRESPONSE:'{response.status_code} - {response.text}'")
+        print(f"Token deleted\nID: {token_id}")
+
+    def get_tmp_token(self):
+        """Create a Mist token 'on the fly' to be used witin a specific script.
+
+        Set the following class variables:
+         - tmp_token_key: temporary token KEY received from Mist Cloud after creation
+         - tmp_token_id: temporary token ID received from Mist Cloud after creation
+        """
+        self.tmp_token_key, self.tmp_token_id = self.create_token()
+
+    def delete_tmp_token(self):
+        """Delete the temporary Mist Token stored in self.tmp_token_key using its ID stored in self.tmp_token_id."""
         if "tmp_token_id" in self.__dict__:
-            api_url = f"https://api.mist.com/api/v1/self/apitokens/{self.tmp_token_id}"
-            headers = {"Content-Type": "application/json",
-                       "Authorization": f"Token {self.MASTER_TOKEN}"}
-            try:
-                response = requests.delete(api_url, headers=headers)
-                if response.status_code == 200:
-                    print(f"Token deleted\nID: {self.tmp_token_id}")
-                else:
-                    raise ValueError(
-                        f"Error connecting to Mist API!\tRESPONSE:'{response.status_code} - {response.text}'")
-            except Exception:
-                raise
+            self.delete_token(self.tmp_token_id)
         else:
             raise ValueError("tmp_token_id does not exits.")
 
+    def get_cached_token(self, cache_file=None, lifetime=3600):
+        """Reuse the temporary token of a previous run, or create a new one and cache it.
+
+        The temporary token is stored with its expiry in a file only readable by the current
+        user, so back-to-back runs of a script do not create and delete a token every time.
+        An expired token is deleted from the Mist Cloud before a new one is created.
+        Do not call delete_tmp_token() at the end of the script, use clear_cached_token()
+        to get rid of the token for good.
+
+        Args:
+            cache_file: str name of the cache file (Default = ~/.mist_tmp_token.json)
+            lifetime: float number of seconds a temporary token is reused (Default = 3600)
+
+        Set the same class variables as get_tmp_token().
+        """
+        cache_file = cache_file or self.CACHE_FILE
+        cached = self._read_cache(cache_file)
+        if cached and cached['expires_at'] > time.time():
+            self.tmp_token_key = cached['key']
+            self.tmp_token_id = cached['id']
+            return
+
+        if cached:
+            try:
+                self.delete_token(cached['id'])
+            except ValueError:
+                # Already deleted (from the Mist portal for instance)
+                pass
+        self.get_tmp_token()
+        self._write_cache(cache_file, {'owner': self._owner(), 'key': self.tmp_token_key,
+                                       'id': self.tmp_token_id, 'expires_at': time.time() + lifetime})
+
+    def clear_cached_token(self, cache_file=None):
+        """Delete the cached temporary token from the Mist Cloud and remove the cache file."""
+        cache_file = cache_file or self.CACHE_FILE
+        cached = self._read_cache(cache_file)
+        if cached:
+            self.delete_token(cached['id'])
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+
+    def _owner(self):
+        # Hash of the master token, so a token cached for another account is never reused
+        return hashlib.sha256(self.MASTER_TOKEN.encode("utf-8")).hexdigest()
+
+    def _read_cache(self, cache_file):
+        try:
+            with open(cache_file) as cache:
+                cached = json.load(cache)
+        except (OSError, ValueError):
+            return None
+        if cached.get('owner') != self._owner():
+            return None
+        return cached
+
+    def _write_cache(self, cache_file, cached):
+        # Created with read/write permissions for the current user only
+        fd = os.open(cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.chmod(cache_file, 0o600)
+        with os.fdopen(fd, "w") as cache:
+            json.dump(cached, cache)
+
+
+class TokenPool(Token):
+    """POOL OF TEMPORARY MIST TOKENS SHARED BY CONCURRENT WORKERS.
+
+    The Mist rate limit applies per token, so spreading the calls of a bulk job over K
+    temporary tokens gives it roughly K times the request budget (see purge-sites.py --tokens).
+
+    Use it as a context manager, so the temporary tokens are deleted even if the job fails:
+
+        with TokenPool(size=4) as pool:
+            key = pool.acquire()
+            response = requests.get(url, headers={"Authorization": f"Token {key}"})
+            pool.update(key, response)
+    """
+
+    CALLS_PER_HOUR = 5000
+
+    def __init__(self, size=4, calls_per_hour=CALLS_PER_HOUR):
+        """Initialize the token pool.
+
+        Args:
+            size: int number of temporary tokens created
+            calls_per_hour: int rate limit of each token, used until the Mist Cloud reports it
+        """
+        super().__init__()
+        self.size = size
+        self.calls_per_hour = calls_per_hour
+        self.tokens = []
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.create_tokens()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.delete_tokens()
+        except Exception:
+            # Do not hide the error that interrupted the job
+            if exc_type is None:
+                raise
+
+    def create_tokens(self):
+        """Create the temporary tokens of the pool (all of them or none)."""
+        try:
+            for _ in range(self.size):
+                key, token_id = self.create_token()
+                self.tokens.append({'key': key, 'id': token_id, 'remaining': self.calls_per_hour,
+                                    'reset_at': time.monotonic() + 3600})
+        except Exception:
+            self.delete_tokens()
+            raise
+
+    def delete_tokens(self):
+        """Delete every temporary token of the pool, even if some deletions fail."""
+        errors = []
+        for token in self.tokens:
+            try:
+                self.delete_token(token['id'])
+            except Exception as e:
+                errors.append(e)
+        self.tokens = []
+        if errors:
+            raise errors[0]
+
+    def acquire(self):
+        """Return the KEY of the next token with budget left (round-robin).
+
+        Blocks until a token gets its budget back when all of them are exhausted.
+        """
+        while True:
+            with self._lock:
+                if not self.tokens:
+                    raise ValueError("The token pool has no token, use it as a context manager.")
+                now = time.monotonic()
+                for _ in range(len(self.tokens)):
+                    token = self.tokens[self._next]
+                    self._next = (self._next + 1) % len(self.tokens)
+                    if token['reset_at'] <= now:
+                        token['remaining'] = self.calls_per_hour
+                        token['reset_at'] = now + 3600
+                    if token['remaining'] > 0:
+                        token['remaining'] -= 1
+                        return token['key']
+                delay = min(token['reset_at'] for token in self.tokens) - now
+            time.sleep(max(delay, 0.1))
+
+    def update(self, key, response):
+        """Update the budget of a token with the rate limit information of a response.
+
+        Args:
+            key: str KEY of the token used to send the API call
+            response: requests.Response (or any object with 'status_code' and 'headers')
+        """
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        retry_after = response.headers.get('Retry-After')
+        with self._lock:
+            token = next((token for token in self.tokens if token['key'] == key), None)
+            if token is None:
+                return
+            if remaining is not None:
+                token['remaining'] = int(remaining)
+            if reset is not None:
+                reset = float(reset)
+                # The reset is either a number of seconds or an epoch timestamp
+                token['reset_at'] = time.monotonic() + (reset - time.time() if reset > 1e9 else reset)
+            if response.status_code == 429:
+                token['remaining'] = 0
+                if retry_after is not None:
+                    token['reset_at'] = time.monotonic() + retry_after_seconds(retry_after, 1)
+
+    def budget(self):
+        """Return the number of calls left for each token KEY."""
+        with self._lock:
+            return {token['key']: token['remaining'] for token in self.tokens}
+
 
-# Tests
-token = Token()
-token.get_tmp_token()
-print("--> We would be running our large script here making our API calls using the tmp token.")
-token.delete_tmp_token()
+if __name__ == '__main__':
+    # Tests
+    token = Token()
+    token.get_tmp_token()
+    print("--> We would be running our large script here making our API calls using the tmp token.")
+    token.delete_tmp_token()
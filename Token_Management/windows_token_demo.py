@@ -47,6 +47,8 @@ from token_class import Token
 master_token_obj = Token()
 
 # get a temporary token so that we can do some stuff
+# (use master_token_obj.get_cached_token() instead to reuse the same temporary token
+# across back-to-back runs, and skip the delete_tmp_token() call below)
 temp_mist_token = master_token_obj.get_tmp_token()
 
 # do some stuff here (e.g. list WLANs)
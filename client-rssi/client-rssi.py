@@ -3,11 +3,19 @@
 import time
 import argparse
 import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
 from semfio_mist import Config
 from semfio_mist import logger
 from semfio_mist import API
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from mist_timeseries import TimeSeriesStore  # noqa: E402
+from mist_metrics import add_metrics_arguments, install_metrics  # noqa: E402
+
 
 def script_args_parser() -> Config:
     """PARSE THE ARGUMENTS AND RETURNS A CONFIG INSTANCE."""
@@ -16,7 +24,17 @@ def script_args_parser() -> Config:
     parser.add_argument('--config', metavar='config_file', type=argparse.FileType(
         'r'), default='config.json', help='file containing all the configuration information')
     parser.add_argument("-v", "--verbose", help="See DEBUG level messages", action="store_true")
+    parser.add_argument("--window", type=float, default=15,
+                        help="Minutes of history summarized when the monitoring stops (Default = 15)")
+    parser.add_argument('--clients', metavar='clients_file', type=argparse.FileType('r'),
+                        help='file listing the MAC addresses of the clients to track (one per line)')
+    parser.add_argument("--interval", type=float, default=1,
+                        help="Seconds between two polls while values are changing (Default = 1)")
+    parser.add_argument("--max-interval", type=float, default=16,
+                        help="Longest wait between two polls once values are stable (Default = 16)")
+    add_metrics_arguments(parser)
     args = parser.parse_args()
+    install_metrics(args)
 
     # Create a config object based on the config filename
     config = Config(args.config.name)
@@ -25,52 +43,200 @@ def script_args_parser() -> Config:
     if args.verbose:
         logger.setLevel("DEBUG")
 
-    return config
+    return config, args
+
+
+def retreive_client_macs(config: Config, clients_file) -> list:
+    """RETURN THE MAC ADDRESSES OF THE CLIENTS TO TRACK.
+
+    The MAC addresses come from the clients file if given, from the 'macs' list of the
+    config file otherwise, and finally from the single 'mac' of the config file.
+    """
+    if clients_file:
+        return [line.strip().lower() for line in clients_file if line.strip() and not line.startswith('#')]
+    if 'macs' in config.data['clients']:
+        return [mac.lower() for mac in config.data['clients']['macs']]
+    return [config.data['clients']['mac'].lower()]
+
+
+def read_local_nic() -> dict:
+    """RETREIVE CLIENT WI-FI DATA FROM LOCAL NIC (MACOS)."""
+    stream = os.popen("airport -I")
+    lines = stream.read().split('\n')
+    return {'rssi': int(lines[0].split(": ")[1]),
+            'mcs': int(lines[13].split(": ")[1]),
+            'tx_rate': int(lines[6].split(": ")[1])}
+
+
+class ClientPoller:
+    """POLLING ENGINE FOR THE MIST STATS OF A GROUP OF CLIENTS.
+
+    Each poll fetches the stats of every client and of every AP they are connected to at the
+    same time, through a pool of threads sharing the keep-alive session of the API object:
+        GET sites/:site_id/stats/clients/:client_mac
+        GET sites/:site_id/stats/devices/:ap_id
+
+    AP stats are requested with the AP known from the previous poll, so both calls run in
+    parallel. An AP is only fetched again after the client stats if the client roamed.
+    AP stats are shared by all the clients of the same AP.
+
+    Responses carrying an ETag or a Last-Modified header are revalidated with a conditional
+    request on the next poll. A 304 reply reuses the previous payload without downloading it.
+
+    The wait between two polls doubles every time nothing changed (up to max_interval) and
+    goes back to interval as soon as a value changes.
+    """
+
+    def __init__(self, api: API, site_id: str, client_macs: list, interval: float = 1, max_interval: float = 16):
+        self.api = api
+        self.site_id = site_id
+        self.client_macs = client_macs
+        self.interval = interval
+        self.max_interval = max_interval
+        self.wait = interval
+        self.client_ap_ids = {}
+        self._validators = {}
+        self._validators_lock = threading.Lock()
+        workers = min(32, 2 * len(client_macs))
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        # One keep-alive connection per thread, the default pool of 10 would reconnect above 10 threads
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, workers))
+        api.session.mount('https://', adapter)
+        api.session.mount('http://', adapter)
+
+    def _get(self, call_url: str) -> dict:
+        """SEND A (CONDITIONAL) GET CALL AND RETURN THE JSON PAYLOAD."""
+        with self._validators_lock:
+            etag, last_modified, payload = self._validators.get(call_url, (None, None, None))
+        headers = dict(self.api._headers)
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        logger.debug(f"Sending API GET CALL: {call_url}")
+        response = self.api.session.get(self.api.mist_cloud_url + call_url, headers=headers)
+        if response.status_code == 304:
+            return payload
+        if response.status_code >= 400:
+            logger.error(f"API Call error {response.status_code}: {response.text}")
+            return None
+
+        payload = response.json()
+        if 'ETag' in response.headers or 'Last-Modified' in response.headers:
+            with self._validators_lock:
+                self._validators[call_url] = (response.headers.get('ETag'),
+                                              response.headers.get('Last-Modified'), payload)
+        return payload
+
+    def _get_client(self, client_mac: str) -> dict:
+        return self._get(f"sites/{self.site_id}/stats/clients/{client_mac}")
+
+    def _get_ap(self, ap_id: str) -> dict:
+        return self._get(f"sites/{self.site_id}/stats/devices/{ap_id}")
+
+    def poll(self) -> dict:
+        """RETRIEVE THE CURRENT STATS OF ALL THE CLIENTS.
+
+        Returns:
+            A dict mapping each client MAC address to its 'rssi', 'tx_rate', 'ch_util' and 'ap_id'
+            (None for the clients that could not be retreived)
+        """
+        client_futures = {mac: self._executor.submit(self._get_client, mac) for mac in self.client_macs}
+        ap_futures = {ap_id: self._executor.submit(self._get_ap, ap_id)
+                      for ap_id in set(self.client_ap_ids.values())}
+
+        try:
+            clients_stats = {mac: future.result() for mac, future in client_futures.items()}
+            # Clients that roamed (or are seen for the first time) need the stats of their new AP
+            for client_stats in clients_stats.values():
+                if client_stats and client_stats.get('ap_id') and client_stats['ap_id'] not in ap_futures:
+                    ap_futures[client_stats['ap_id']] = self._executor.submit(self._get_ap, client_stats['ap_id'])
+            aps_stats = {ap_id: future.result() for ap_id, future in ap_futures.items()}
+        except requests.exceptions.RequestException as e:
+            logger.error(f"API Call error: {e}")
+            return {mac: None for mac in self.client_macs}
+
+        samples = {}
+        for mac, client_stats in clients_stats.items():
+            ap_stats = aps_stats.get(client_stats.get('ap_id')) if client_stats else None
+            if not client_stats or not ap_stats:
+                samples[mac] = None
+                continue
+            self.client_ap_ids[mac] = client_stats['ap_id']
+            band = f"band_{client_stats['band']}" if 'band' in client_stats else 'band_5'
+            samples[mac] = {'rssi': client_stats['rssi'],
+                            'tx_rate': client_stats['tx_rate'],
+                            'ch_util': ap_stats['radio_stat'][band]['util_all'],
+                            'ap_id': client_stats['ap_id']}
+        return samples
+
+    def sleep(self, changed: bool):
+        """WAIT UNTIL THE NEXT POLL, BACKING OFF WHILE NOTHING CHANGES."""
+        self.wait = self.interval if changed else min(self.max_interval, self.wait * 2)
+        time.sleep(self.wait)
+
+    def close(self):
+        self._executor.shutdown()
 
 
 def main():
     """COMPARE CLIENT RSSI VALUES TO MIST CLOUD RSSI VALUES."""
-    config = script_args_parser()
+    config, args = script_args_parser()
 
     api = API(config)
-    logger.info(f"\tClient MAC:\t{config.data['clients']['mac']}")
+    store = TimeSeriesStore()
+    client_macs = retreive_client_macs(config, args.clients)
+    # The local NIC can only be compared to the Mist data when a single client (this computer) is tracked
+    local_mode = len(client_macs) == 1 and args.clients is None
+    poller = ClientPoller(api, config.data['site']['id'], client_macs, args.interval, args.max_interval)
+    for client_mac in client_macs:
+        logger.info(f"\tClient MAC:\t{client_mac}")
 
     # Monitoring Client Data until interupted by user
     try:
-        local_rssi = 0
-        local_tx_rate = 0
-        ch_util = 0
-        mist_tx_rate = 0
+        last_values = {}
         while True:
-            # Retreiving Client Wi-Fi data from local NIC (macOS)
-            stream = os.popen("airport -I")
-            lines = stream.read().split('\n')
-            new_rssi = int(lines[0].split(": ")[1])
-            mcs = int(lines[13].split(": ")[1])
-            new_local_tx_rate = int(lines[6].split(": ")[1])
-
-            # Retreiving Client Wi-Fi data from Mist Cloud
-            response_client_stats = api.get(
-                f"sites/{config.data['site']['id']}/stats/clients/{config.data['clients']['mac']}")
-            response_ap_stats = api.get(
-                f"sites/{config.data['site']['id']}/stats/devices/{response_client_stats['ap_id']}")
-            new_ch_util = response_ap_stats['radio_stat']['band_5']['util_all']
-            new_mist_tx_rate = response_client_stats['tx_rate']
-            new_mist_rssi = response_client_stats['rssi']
-
-            # Display updated data if any of the metric changed
-            if (new_local_tx_rate != local_tx_rate) or (new_mist_tx_rate != mist_tx_rate) or (new_ch_util != ch_util) or (new_rssi != local_rssi):
-                logger.info(
-                    f"\tLocal MCS: {mcs}\tLocal RSSI: {new_rssi}dBm\tLocal Tx-Rate: {new_local_tx_rate}\t\tMist RSSI: {new_mist_rssi}dBm\tMist Tx Rate: {new_mist_tx_rate}\t\tCh. Utilization: {new_ch_util}%")
-                local_tx_rate = new_local_tx_rate
-                mist_tx_rate = new_mist_tx_rate
-                ch_util = new_ch_util
-                local_rssi = new_rssi
-            time.sleep(1)
+            local = read_local_nic() if local_mode else None
+            samples = poller.poll()
+
+            changed = False
+            sample_time = time.time()
+            for client_mac, sample in samples.items():
+                if sample is None:
+                    continue
+
+                # Keeping every sample so we can summarize the session when it ends
+                store.append(client_mac, 'mist', 'rssi', sample['rssi'], sample_time)
+                store.append(client_mac, 'mist', 'tx_rate', sample['tx_rate'], sample_time)
+                store.append(client_mac, 'ap', 'util_all', sample['ch_util'], sample_time)
+                values = (sample['rssi'], sample['tx_rate'], sample['ch_util'])
+                if local:
+                    store.append(client_mac, 'local', 'rssi', local['rssi'], sample_time)
+                    store.append(client_mac, 'local', 'tx_rate', local['tx_rate'], sample_time)
+                    values += (local['rssi'], local['tx_rate'])
+
+                # Display updated data if any of the metric changed
+                if last_values.get(client_mac) != values:
+                    changed = True
+                    last_values[client_mac] = values
+                    if local:
+                        logger.info(
+                            f"\tLocal MCS: {local['mcs']}\tLocal RSSI: {local['rssi']}dBm\tLocal Tx-Rate: {local['tx_rate']}\t\tMist RSSI: {sample['rssi']}dBm\tMist Tx Rate: {sample['tx_rate']}\t\tCh. Utilization: {sample['ch_util']}%")
+                    else:
+                        logger.info(
+                            f"\t{client_mac}\tMist RSSI: {sample['rssi']}dBm\tMist Tx Rate: {sample['tx_rate']}\t\tCh. Utilization: {sample['ch_util']}%")
+            poller.sleep(changed)
 
     except KeyboardInterrupt:
         pass
 
+    # Summarizing the last minutes of samples
+    for (client_mac, source, metric), stats in store.window_stats(args.window).items():
+        logger.info(f"\t{client_mac}\t{source} {metric} (last {args.window} min)\tAvg: {round(stats['mean'], 1)}\t"
+                    f"P95: {round(stats['p95'], 1)}\tMax: {round(stats['max'], 1)}\tSamples: {stats['count']}")
+
+    poller.close()
     api.__exit__()
 
 
@@ -1,11 +1,20 @@
 import time
 import argparse
+import asyncio
+import os
+import sys
 
+import aiohttp
 from semfio_mist import Config
 from semfio_mist import logger
 from semfio_mist import API
 from prettytable import PrettyTable
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from mist_timeseries import TimeSeriesStore  # noqa: E402
+from mist_http_cache import OfflineError, add_cache_arguments, install_cache  # noqa: E402
+from mist_metrics import add_metrics_arguments, install_metrics  # noqa: E402
+
 
 def script_args_parser() -> Config:
     """PARSE THE ARGUMENTS AND RETURN CONFIGS."""
@@ -14,7 +23,20 @@ def script_args_parser() -> Config:
     parser.add_argument('--config', metavar='config_file', type=argparse.FileType(
         'r'), default='config.json', help='file containing all the configuration information')
     parser.add_argument("-v", "--verbose", help="See DEBUG level messages", action="store_true")
+    parser.add_argument("-w", "--watch", help="Keep polling all sites and refresh the tables in place",
+                        action="store_true")
+    parser.add_argument("-i", "--interval", type=float, default=30,
+                        help="Seconds between two polls of a site in watch mode (Default = 30)")
+    parser.add_argument("-c", "--concurrency", type=int, default=20,
+                        help="Maximum number of sites polled at the same time in watch mode (Default = 20)")
+    parser.add_argument("--window", type=float, default=15,
+                        help="Minutes of history used for the 5GHz utilization avg/p95/max in watch mode (Default = 15)")
+    # The cache only applies to the one-shot mode, the watch mode polls with aiohttp to get live values
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
+    if args.offline and args.watch:
+        parser.error("--offline cannot be used with --watch, the watch mode polls the live Mist cloud")
 
     # Create a config object based on the config filename
     config = Config(args.config.name)
@@ -23,51 +45,176 @@ def script_args_parser() -> Config:
     if args.verbose:
         logger.setLevel("DEBUG")
 
-    return config
+    return config, args
+
+
+def site_table(site: dict, aps: list, history: dict = None) -> str:
+    """BUILD THE CHANNEL UTILIZATION TABLE OF A SITE.
+
+    When history is given (window stats of the 5GHz utilization keyed by AP MAC address),
+    the average, 95th percentile and max utilization over the window are added to the table.
+    """
+    # Creation of the table header (for printing results)
+    columns = ['AP Name', '2.4 Ch.', '2.4 Util.', '2.4 Clts', '5 Ch.', '5 Util.', '5 Clts']
+    if history is not None:
+        columns += ['5 Util. Avg', '5 Util. P95', '5 Util. Max']
+    table = PrettyTable(columns)
+
+    # Looping on each APs to retreive relevant stats (channel utilizations)
+    nb_ap_connected = 0
+    for ap in aps:
+        if ap['type'] == 'ap':
+            ap_mon_data = []
+            ap_mon_data.append(ap['name'])
+
+            if ap['status'] == 'connected':
+                nb_ap_connected += 1
+                ap_mon_data.append(ap['radio_stat']['band_24']['channel'])
+                ap_mon_data.append(f"{ap['radio_stat']['band_24']['util_all']}%")
+                ap_mon_data.append(ap['radio_stat']['band_24']['num_clients'])
+                ap_mon_data.append(
+                    f"{ap['radio_stat']['band_5']['channel']}({ap['radio_stat']['band_5']['bandwidth']})")
+                ap_mon_data.append(f"{ap['radio_stat']['band_5']['util_all']}%")
+                ap_mon_data.append(ap['radio_stat']['band_5']['num_clients'])
+                if history is not None:
+                    stats = history.get(ap['mac'])
+                    for aggregate in ('mean', 'p95', 'max'):
+                        ap_mon_data.append(f"{round(stats[aggregate])}%" if stats else "-")
+                table.add_row(ap_mon_data)
+
+    # Displaying the results sorting them by 5GHz channel utilization
+    site_output = f"SITE: {site['name']}\t\tAPs Online: {nb_ap_connected}\n"
+    if (nb_ap_connected != 0):
+        site_output += table.get_string(sortby="5 Util.", reversesort=True) + "\n"
+    return site_output
+
+
+class SiteBoard:
+    """KEEP ONE TABLE PER SITE ON SCREEN AND REDRAW ONLY WHAT CHANGED.
+
+    Sites are displayed in a fixed order. When the table of a site changes, the cursor is moved
+    back up to that table and only the tables from this point down are rewritten.
+    When stdout is not a terminal, every changed table is simply printed again.
+    """
+
+    def __init__(self, sites: list):
+        self.site_ids = [site['id'] for site in sites]
+        self.blocks = {site['id']: f"SITE: {site['name']}\t\tpolling...\n" for site in sites}
+        self.heights = {}
+        self.changed = set(self.site_ids)
+        self.in_place = sys.stdout.isatty()
+
+    def update(self, site_id: str, block: str):
+        if self.blocks[site_id] != block:
+            self.blocks[site_id] = block
+            self.changed.add(site_id)
+
+    def render(self):
+        if not self.changed:
+            return
+        if not self.in_place:
+            for site_id in self.site_ids:
+                if site_id in self.changed:
+                    print(self.blocks[site_id])
+        else:
+            first = min(self.site_ids.index(site_id) for site_id in self.changed)
+            lines_below = sum(self.heights.get(site_id, 0) for site_id in self.site_ids[first:])
+            if lines_below:
+                # Move up to the first changed table and clear everything below it
+                sys.stdout.write(f"\x1b[{lines_below}F\x1b[J")
+            for site_id in self.site_ids[first:]:
+                block = self.blocks[site_id] + "\n"
+                self.heights[site_id] = block.count("\n")
+                sys.stdout.write(block)
+            sys.stdout.flush()
+        self.changed.clear()
+
+
+async def poll_site(http: aiohttp.ClientSession, semaphore: asyncio.Semaphore, api: API, site: dict):
+    """RETRIEVE THE CURRENT STATS OF ALL DEVICES OF A SITE."""
+    async with semaphore:
+        logger.debug(f"Sending API GET CALL: sites/{site['id']}/stats/devices")
+        async with http.get(f"{api.mist_cloud_url}sites/{site['id']}/stats/devices") as response:
+            if response.status >= 400:
+                logger.error(f"API Call error {response.status}: {await response.text()}")
+                return site, None
+            return site, await response.json(content_type=None)
+
+
+async def watch_sites(api: API, sites: list, interval: float, concurrency: int, window: float, trace_configs=None):
+    """POLL ALL SITES CONCURRENTLY EVERY INTERVAL AND REFRESH THEIR TABLES IN PLACE.
+
+    Every sample is kept in a TimeSeriesStore so the tables can show the utilization
+    history of each AP over the last window minutes without polling the cloud again.
+    The trace_configs (ex: the metrics of the API calls) are attached to the aiohttp session.
+    """
+    board = SiteBoard(sites)
+    store = TimeSeriesStore()
+    board.render()
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(headers=api._headers, connector=connector, trace_configs=trace_configs) as http:
+        while True:
+            sweep_start = time.monotonic()
+            for poll in asyncio.as_completed([poll_site(http, semaphore, api, site) for site in sites]):
+                try:
+                    site, aps = await poll
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.error(f"API Call error: {e!r}")
+                    continue
+                if aps is not None:
+                    poll_time = time.time()
+                    for ap in aps:
+                        store.record_device_stats(ap, poll_time)
+                    history = store.window_stats(window, metric='util_all', band='band_5',
+                                                 entities={ap['mac'] for ap in aps}, now=poll_time)
+                    history = {key[0]: stats for key, stats in history.items()}
+                    try:
+                        board.update(site['id'], site_table(site, aps, history))
+                    except KeyError as e:
+                        logger.error(f"Unexpected stats for site {site['name']}: missing {e}")
+                        continue
+                    board.render()
+            await asyncio.sleep(max(0, interval - (time.monotonic() - sweep_start)))
 
 
 def main():
     """MONITOR CHANNEL UTILIZATION OF ALL APS OF A SITE."""
-    config = script_args_parser()
+    config, args = script_args_parser()
+    cache = install_cache(args)
+    metrics = install_metrics(args)
     api = API(config)
 
     # Retrieve the list of sites within my Org
-    sites = api.get(f"orgs/{config.data['org_id']}/sites")
-
-    for site in sites:
-
-        # Retrieve list of APs and their current stats
-        aps = api.get(f"sites/{site['id']}/stats/devices")
-
-        # Creation of the table header (for printing results)
-        table = PrettyTable(['AP Name', '2.4 Ch.', '2.4 Util.',
-                             '2.4 Clts', '5 Ch.', '5 Util.', '5 Clts'])
-
-        # Looping on each APs to retreive relevant stats (channel utilizations)
-        nb_ap_connected = 0
-        for ap in aps:
-            if ap['type'] == 'ap':
-                ap_mon_data = []
-                ap_mon_data.append(ap['name'])
-
-                if ap['status'] == 'connected':
-                    nb_ap_connected += 1
-                    ap_mon_data.append(ap['radio_stat']['band_24']['channel'])
-                    ap_mon_data.append(f"{ap['radio_stat']['band_24']['util_all']}%")
-                    ap_mon_data.append(ap['radio_stat']['band_24']['num_clients'])
-                    ap_mon_data.append(
-                        f"{ap['radio_stat']['band_5']['channel']}({ap['radio_stat']['band_5']['bandwidth']})")
-                    ap_mon_data.append(f"{ap['radio_stat']['band_5']['util_all']}%")
-                    ap_mon_data.append(ap['radio_stat']['band_5']['num_clients'])
-                    table.add_row(ap_mon_data)
-
-        # Displaying the results sorting them by 5GHz channel utilization
-        print(f"SITE: {site['name']}\t\tAPs Online: {nb_ap_connected}")
-        if (nb_ap_connected != 0):
-            print(table.get_string(sortby="5 Util.", reversesort=True))
-        print()
-
-    api.__exit__()
+    try:
+        sites = api.get(f"orgs/{config.data['org_id']}/sites")
+    except OfflineError as e:
+        print(f"Something went wrong: {e}")
+        sites = []
+
+    try:
+        if args.watch:
+            try:
+                asyncio.run(watch_sites(api, sites, args.interval, max(1, args.concurrency), args.window,
+                                        [metrics.trace_config()] if metrics else None))
+            except KeyboardInterrupt:
+                pass
+        else:
+            for site in sites:
+
+                # Retrieve list of APs and their current stats
+                try:
+                    aps = api.get(f"sites/{site['id']}/stats/devices")
+                except OfflineError as e:
+                    print(f"Something went wrong: {e}")
+                    continue
+                print(site_table(site, aps))
+    finally:
+        # Delete the temporary token whatever stopped the monitor
+        api.__exit__()
+    if cache:
+        print(f"\n{cache.summary()}")
 
 
 if __name__ == '__main__':